@@ -17,6 +17,59 @@ ALLOWED_HOSTS = CONFIG["backend"]["ALLOWED_HOSTS"]
 
 CACHEOPS_REDIS = CONFIG["backend"]["CACHE"]["CACHEOPS_REDIS"]
 CACHEOPS = CONFIG["backend"]["CACHE"]["CACHEOPS"]
+# in-process cache in front of cacheops for the hot questionnaire data (entries, seconds)
+L1_CACHE_SIZE = CONFIG["backend"]["CACHE"].get("L1_SIZE", 256)
+L1_CACHE_TTL = CONFIG["backend"]["CACHE"].get("L1_TTL", 60)
+# seconds the responses being the same for everyone are cached per worker, by route (0 = disabled)
+MICRO_CACHE_TTLS = {
+    "locales": 300,
+    "translation": 60,
+    "ssrdata": 10,
+    "question": 60,
+    "stats": 30
+}
+MICRO_CACHE_TTLS.update(CONFIG["backend"]["CACHE"].get("MICRO_CACHE_TTLS", {}))
+MICRO_CACHE_SIZE = CONFIG["backend"]["CACHE"].get("MICRO_CACHE_SIZE", 512)
+# seconds changes are collected before the cache versions are incremented, and between polls of the versions
+INVALIDATION_DEBOUNCE = CONFIG["backend"]["CACHE"].get("INVALIDATION_DEBOUNCE", 0.5)
+INVALIDATION_POLL_INTERVAL = CONFIG["backend"]["CACHE"].get("INVALIDATION_POLL_INTERVAL", 5)
+
+# JSON encoder of the API responses: "json", "orjson" or "auto" (orjson if installed)
+JSON_SERIALIZER = CONFIG["backend"].get("JSON_SERIALIZER", "auto")
+
+# votes are buffered per worker and written once the buffer is full or the interval (seconds) passed
+VOTE_BUFFER_SIZE = CONFIG["backend"].get("VOTE_BUFFER_SIZE", 50)
+VOTE_FLUSH_INTERVAL = CONFIG["backend"].get("VOTE_FLUSH_INTERVAL", 5)
+
+# sessions older than this (days) are rolled up and deleted by manage.py prune_sessions
+SESSION_RETENTION_DAYS = CONFIG["backend"].get("SESSION_RETENTION_DAYS", 730)
+# monthly partitions created in advance by manage.py partition_sessions (PostgreSQL only)
+SESSION_PARTITION_MONTHS_AHEAD = CONFIG["backend"].get("SESSION_PARTITION_MONTHS_AHEAD", 3)
+
+# limits of the expensive endpoints per worker, by URL name (see distrochooser/admission.py)
+ADMISSION_CONTROL = CONFIG["backend"].get("ADMISSION_CONTROL", {
+    "submit_answers": {"concurrency": 8, "rate": 1, "burst": 10, "max_queue_time": 5},
+    "get_stats": {"concurrency": 2, "rate": 0.5, "burst": 5, "max_queue_time": 2}
+})
+# identify clients by the first X-Forwarded-For address, only enable it behind a proxy setting it
+ADMISSION_TRUST_FORWARDED_FOR = CONFIG["backend"].get("ADMISSION_TRUST_FORWARDED_FOR", False)
+
+# background tasks (manage.py run_tasks): tasks claimed at once, seconds a claim is valid, attempts and base retry delay
+TASK_BATCH_SIZE = CONFIG["backend"].get("TASK_BATCH_SIZE", 20)
+TASK_LEASE = CONFIG["backend"].get("TASK_LEASE", 600)
+TASK_MAX_ATTEMPTS = CONFIG["backend"].get("TASK_MAX_ATTEMPTS", 5)
+TASK_RETRY_DELAY = CONFIG["backend"].get("TASK_RETRY_DELAY", 10)
+# finished tasks are deleted after this amount of days
+TASK_RETENTION_DAYS = CONFIG["backend"].get("TASK_RETENTION_DAYS", 7)
+# tasks enqueued periodically by manage.py run_tasks: task name -> seconds between two runs
+TASK_SCHEDULE = CONFIG["backend"].get("TASK_SCHEDULE", {
+    "prune_sessions": 86400,
+    "rebuild_vote_counts": 86400
+})
+# /stats/ is served from a snapshot, which manage.py run_tasks refreshes every this amount of seconds,
+# it's calculated inline if the snapshot gets older than STATS_MAX_AGE (e. g. no task runner)
+STATS_REFRESH_INTERVAL = CONFIG["backend"].get("STATS_REFRESH_INTERVAL", 60)
+STATS_MAX_AGE = CONFIG["backend"].get("STATS_MAX_AGE", 900)
 
 
 INSTALLED_APPS = [
@@ -31,16 +84,22 @@ INSTALLED_APPS = [
     'corsheaders'
 ]
 
+# the stateful middleware of distrochooser.middleware only runs for these routes (URL names or namespaces)
+FULL_STACK_ROUTES = CONFIG["backend"].get("FULL_STACK_ROUTES", [
+    "admin", "get_feedback", "process_feedback", "export_sessions", "reload_translations", "get_metrics"
+])
+
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'distrochooser.admission.AdmissionControlMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.middleware.locale.LocaleMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'distrochooser.middleware.LocaleMiddleware',
+    'distrochooser.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware'
+    'distrochooser.middleware.CsrfViewMiddleware',
+    'distrochooser.middleware.AuthenticationMiddleware',
+    'distrochooser.middleware.MessageMiddleware',
+    'distrochooser.middleware.XFrameOptionsMiddleware'
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -65,6 +124,64 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 
 DATABASES = CONFIG["backend"]["DATABASES"]
 
+# connection handling of the PostgreSQL databases:
+# POOL_SIZE > 0 enables the in-process pool (per worker), otherwise connections are kept for MAX_AGE seconds
+DATABASE_CONNECTIONS = CONFIG["backend"].get("DATABASE_CONNECTIONS", {})
+DATABASE_POOL_SIZE = DATABASE_CONNECTIONS.get("POOL_SIZE", 0)
+# seconds a connection is reused before it's replaced
+DATABASE_MAX_AGE = DATABASE_CONNECTIONS.get("MAX_AGE", 300)
+# idle seconds after which a pooled connection is checked before handing it out
+DATABASE_HEALTH_CHECK_AFTER = DATABASE_CONNECTIONS.get("HEALTH_CHECK_AFTER", 30)
+# seconds to wait for a free pooled connection
+DATABASE_POOL_TIMEOUT = DATABASE_CONNECTIONS.get("POOL_TIMEOUT", 10)
+# milliseconds a statement may run (0 = unlimited)
+DATABASE_STATEMENT_TIMEOUT = DATABASE_CONNECTIONS.get("STATEMENT_TIMEOUT", 0)
+
+for database in DATABASES.values():
+    if database.get("ENGINE") != "django.db.backends.postgresql":
+        continue
+    if DATABASE_STATEMENT_TIMEOUT:
+        options = database.setdefault("OPTIONS", {})
+        options["options"] = "{0} -c statement_timeout={1}".format(
+            options.get("options", ""), DATABASE_STATEMENT_TIMEOUT).strip()
+    if DATABASE_POOL_SIZE:
+        database["ENGINE"] = "distrochooser.db.backends.postgresql"
+        # closing a connection returns it to the pool
+        database["CONN_MAX_AGE"] = 0
+        database["POOL"] = {
+            "SIZE": DATABASE_POOL_SIZE,
+            "MAX_AGE": DATABASE_MAX_AGE,
+            "HEALTH_CHECK_AFTER": DATABASE_HEALTH_CHECK_AFTER,
+            "TIMEOUT": DATABASE_POOL_TIMEOUT
+        }
+    else:
+        database.setdefault("CONN_MAX_AGE", DATABASE_MAX_AGE)
+
+# aliases of DATABASES which are read-only replicas of the default database, used by some read-only views
+DATABASE_REPLICAS = CONFIG["backend"].get("DATABASE_REPLICAS", [])
+# replicas lagging behind for more than this (seconds) are skipped
+REPLICA_MAX_LAG = CONFIG["backend"].get("REPLICA_MAX_LAG", 5)
+# seconds between the health checks of a replica (per worker)
+REPLICA_CHECK_INTERVAL = CONFIG["backend"].get("REPLICA_CHECK_INTERVAL", 5)
+# a session is read from the primary for this amount of seconds after it was written
+REPLICA_STICKY_SECONDS = CONFIG["backend"].get("REPLICA_STICKY_SECONDS", 30)
+# aliases of DATABASES holding the session data, a new session is placed by the hash of its token (empty = default only)
+# shards may only be appended, the first one has to hold the sessions created before (see distrochooser/sharding.py)
+# the questionnaire is copied from the default database to the shards by manage.py sync_shards
+DATABASE_SHARDS = CONFIG["backend"].get("DATABASE_SHARDS", [])
+DATABASE_ROUTERS = []
+if DATABASE_SHARDS:
+    DATABASE_ROUTERS.append("distrochooser.sharding.ShardRouter")
+if DATABASE_REPLICAS:
+    DATABASE_ROUTERS.append("distrochooser.routers.ReplicaRouter")
+    for alias in DATABASE_REPLICAS:
+        # the test runner reuses the default database instead of creating one per replica
+        DATABASES[alias].setdefault("TEST", {}).setdefault("MIRROR", "default")
+
+# the read-your-writes marks of the replica routing need a cache shared by the workers (e. g. redis)
+if "CACHES" in CONFIG["backend"]:
+    CACHES = CONFIG["backend"]["CACHES"]
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -85,6 +202,14 @@ LOCALES = {}
 for key, value in CONFIG["backend"]["LOCALES"].items():
     LOCALES[key] = os.path.join(os.path.join(BASE_DIR, 'locale'), value + ".po")
 
+# parsed .po files are cached here, manage.py compile_translations fills it ahead of time
+TRANSLATION_CACHE_DIR = CONFIG["backend"].get(
+    "TRANSLATION_CACHE_DIR", os.path.join(BASE_DIR, 'locale', '.compiled'))
+# only load a locale when it's requested the first time
+LAZY_TRANSLATIONS = CONFIG["backend"].get("LAZY_TRANSLATIONS", False)
+# seconds between checks for changed .po files, which are reloaded without a restart (0 = never)
+TRANSLATION_RELOAD_INTERVAL = CONFIG["backend"].get("TRANSLATION_RELOAD_INTERVAL", 30)
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
@@ -102,3 +227,11 @@ CORS_ORIGIN_ALLOW_ALL = True
 CSRF_COOKIE_SECURE = False
 
 MEDIA_ROOT = "media/"
+
+MEDIA_URL = CONFIG["backend"].get("MEDIA_URL", "/media/")
+# resized variants of the logos and answer images (manage.py build_media, needs Pillow)
+MEDIA_VARIANT_WIDTHS = CONFIG["backend"].get("MEDIA_VARIANT_WIDTHS", [64, 128, 256])
+# preferred formats first, formats the installed Pillow can't write are skipped
+MEDIA_VARIANT_FORMATS = CONFIG["backend"].get("MEDIA_VARIANT_FORMATS", ["avif", "webp", "png"])
+# seconds the files of replaced variants are kept, cached responses may still reference them
+MEDIA_VARIANT_GRACE_PERIOD = CONFIG["backend"].get("MEDIA_VARIANT_GRACE_PERIOD", 604800)
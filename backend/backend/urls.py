@@ -15,8 +15,8 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from distrochooser.views import start, load_question, submit_answers, get_locales, vote, get_given_answers, update_remark, get_ssr_data, get_language_values, get_stats, get_feedback, process_feedback
-from backend.settings import CONFIG
+from distrochooser.views import start, load_question, submit_answers, get_locales, vote, get_given_answers, update_remark, get_ssr_data, get_language_values, get_stats, get_feedback, process_feedback, export_sessions, reload_translations, get_readiness, get_metrics, get_media_variant
+from backend.settings import CONFIG, MEDIA_URL
 
 system_suffix = CONFIG["backend"]["SUFFIX"]
 
@@ -37,6 +37,15 @@ urlpatterns = [
     path('feedback{0}/'.format(system_suffix),
          get_feedback, name="get_feedback"),
     path('process_feedback{0}/<str:token>/'.format(system_suffix),
-         process_feedback, name="process_feedback")
+         process_feedback, name="process_feedback"),
+    path('export{0}/<str:format>/'.format(system_suffix),
+         export_sessions, name="export_sessions"),
+    path('reload_translations{0}/'.format(system_suffix),
+         reload_translations, name="reload_translations"),
+    path('ready{0}/'.format(system_suffix), get_readiness, name="get_readiness"),
+    path('metrics{0}/'.format(system_suffix), get_metrics, name="get_metrics"),
+    # for deployments where no web server or CDN serves MEDIA_ROOT
+    path('{0}variants/<path:name>'.format(MEDIA_URL.lstrip("/")),
+         get_media_variant, name="get_media_variant")
 
 ]
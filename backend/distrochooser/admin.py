@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Question, Answer, GivenAnswer, UserSession, ResultDistroSelection, Distribution, SelectionReason, Category, AnswerDistributionMatrix
+from .models import Question, Answer, GivenAnswer, UserSession, ResultDistroSelection, Distribution, SelectionReason, Category, AnswerDistributionMatrix, DistributionVoteCount, SessionRollup, ReferrerRollup, AnswerCooccurrence, AnswerDistroCorrelation, Task
 
 [admin.site.register(*models) for models in [
   (Question,),
@@ -8,6 +8,12 @@ from .models import Question, Answer, GivenAnswer, UserSession, ResultDistroSele
   (ResultDistroSelection,),
   (Distribution,),
   (SelectionReason,),
+  (DistributionVoteCount,),
+  (SessionRollup,),
+  (ReferrerRollup,),
+  (AnswerCooccurrence,),
+  (AnswerDistroCorrelation,),
+  (Task,),
 ]]
 
 
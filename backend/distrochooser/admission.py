@@ -0,0 +1,170 @@
+"""
+Admission control for the expensive endpoints.
+
+Configured per URL name in ADMISSION_CONTROL (distrochooser.json), endpoints
+without a configuration are not limited. A request of a limited endpoint is
+
+- rejected with 503 if it waited in the load balancer's queue for longer than
+  max_queue_time seconds (X-Request-Start header, set by e. g. nginx or haproxy),
+- rejected with 429 if its client exhausted its token bucket (rate requests per
+  second, up to burst at once),
+- and rejected with 503 if no concurrency slot becomes free within max_queue_time.
+
+All limits apply per worker process. Rejections carry a Retry-After header and
+are counted in the "admission" metrics.
+"""
+
+from collections import OrderedDict
+from math import ceil, isfinite
+from threading import BoundedSemaphore, Lock
+from time import monotonic, time
+
+from backend.settings import ADMISSION_CONTROL, ADMISSION_TRUST_FORWARDED_FOR
+from distrochooser import metrics
+from distrochooser.middleware import get_route
+from distrochooser.util import get_json_response
+
+# amount of (route, client) token buckets kept per worker
+MAX_BUCKETS = 10000
+# seconds an X-Request-Start value may lie in the past or the future, anything beyond is considered bogus
+MAX_REQUEST_START_OFFSET = 300
+
+
+class Route:
+    """
+    The limits and counters of one endpoint
+    """
+
+    def __init__(self, name: str, config: dict):
+        self.name = name
+        self.concurrency = config.get("concurrency", 0)
+        self.rate = config.get("rate", 0)
+        self.burst = config.get("burst", max(self.rate, 1))
+        self.max_queue_time = config.get("max_queue_time", 5)
+        self.retry_after = config.get("retry_after", 5)
+        self.slots = BoundedSemaphore(self.concurrency) if self.concurrency else None
+        self.stats = {
+            "admitted": 0,
+            "inFlight": 0,
+            "shedQueueTime": 0,
+            "shedConcurrency": 0,
+            "rateLimited": 0
+        }
+
+
+class TokenBuckets:
+    """
+    Per-client token buckets, the least recently used ones are dropped
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # (route, client) -> (tokens, updated)
+        self.buckets = OrderedDict()
+        self.lock = Lock()
+
+    def take(self, key, rate: float, burst: float) -> float:
+        """
+        Take a token
+
+        Returns:
+          float: 0 if a token was taken, otherwise the seconds until the next one is available
+        """
+        now = monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens = tokens - 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_size:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+ROUTES = {name: Route(name, config) for name, config in ADMISSION_CONTROL.items()}
+BUCKETS = TokenBuckets(MAX_BUCKETS)
+
+
+def get_client(request) -> str:
+    if ADMISSION_TRUST_FORWARDED_FOR and "HTTP_X_FORWARDED_FOR" in request.META:
+        return request.META["HTTP_X_FORWARDED_FOR"].split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def get_queue_time(request):
+    """
+    Get the seconds the request waited before reaching the worker
+
+    Returns:
+      float: The queue time, None if the X-Request-Start header is missing, invalid or implausible
+    """
+    header = request.META.get("HTTP_X_REQUEST_START", "")
+    value = header[2:] if header.startswith("t=") else header
+    try:
+        started = float(value)
+    except ValueError:
+        return None
+    if not isfinite(started):
+        return None
+    now = time()
+    # seconds, milliseconds or microseconds since the epoch, depending on the proxy
+    while started > now * 10:
+        started = started / 1000
+    if abs(now - started) > MAX_REQUEST_START_OFFSET:
+        return None
+    return max(0, now - started)
+
+
+def reject(request, status: int, retry_after: float):
+    response = get_json_response({
+        "error": "tooManyRequests" if status == 429 else "overloaded"
+    }, request, status=status)
+    response["Retry-After"] = str(max(1, ceil(retry_after)))
+    return response
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        route = None
+        if ROUTES:
+            match = get_route(request)
+            route = ROUTES.get(match.url_name) if match else None
+        if route is None:
+            return self.get_response(request)
+
+        queue_time = get_queue_time(request)
+        if queue_time is not None and queue_time > route.max_queue_time:
+            route.stats["shedQueueTime"] += 1
+            return reject(request, 503, route.retry_after)
+
+        if route.rate:
+            wait = BUCKETS.take((route.name, get_client(request)), route.rate, route.burst)
+            if wait:
+                route.stats["rateLimited"] += 1
+                return reject(request, 429, wait)
+
+        if route.slots is not None:
+            timeout = route.max_queue_time - (queue_time or 0)
+            if not route.slots.acquire(timeout=max(0, timeout)):
+                route.stats["shedConcurrency"] += 1
+                return reject(request, 503, route.retry_after)
+        route.stats["admitted"] += 1
+        route.stats["inFlight"] += 1
+        try:
+            return self.get_response(request)
+        finally:
+            route.stats["inFlight"] -= 1
+            if route.slots is not None:
+                route.slots.release()
+
+
+def get_metrics() -> dict:
+    return {name: dict(route.stats) for name, route in ROUTES.items()}
+
+
+metrics.register("admission", get_metrics)
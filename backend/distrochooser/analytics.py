@@ -0,0 +1,177 @@
+"""
+Offline analytics of the given answers and the distribution votes.
+
+The sessions are processed in ranges of their ids. Each range becomes a sparse
+session x answer matrix A and two session x distro matrices U (upvotes) and
+D (downvotes), which are reduced to the small dense products A'A, A'U and A'D
+right away. Only those are kept, so the memory usage depends on the amount of
+answers and distributions, not on the amount of sessions. Sharded sessions are
+processed shard by shard into the same totals.
+
+Needs numpy and scipy (requirements-analytics.txt).
+"""
+
+from django.db import transaction
+from django.db.models import Min, Max, Q
+
+from distrochooser.sharding import get_shards
+from distrochooser.models import Answer, Distribution, GivenAnswer, ResultDistroSelection, AnswerCooccurrence, AnswerDistroCorrelation
+
+
+class Totals:
+    """
+    The accumulated counts of all processed sessions
+    """
+
+    def __init__(self, answer_ids: list, distro_ids: list):
+        import numpy
+        answer_count = len(answer_ids)
+        distro_count = len(distro_ids)
+        self.answer_ids = answer_ids
+        self.distro_ids = distro_ids
+        self.sessions = 0
+        self.answers = numpy.zeros(answer_count, dtype=numpy.int64)
+        self.upvotes = numpy.zeros(distro_count, dtype=numpy.int64)
+        self.cooccurrences = numpy.zeros(
+            (answer_count, answer_count), dtype=numpy.int64)
+        self.approvals = numpy.zeros(
+            (answer_count, distro_count), dtype=numpy.int64)
+        self.disapprovals = numpy.zeros(
+            (answer_count, distro_count), dtype=numpy.int64)
+
+
+def _to_matrix(rows, columns, shape):
+    import numpy
+    from scipy.sparse import csr_matrix
+    matrix = csr_matrix(
+        (numpy.ones(len(rows), dtype=numpy.int64), (rows, columns)), shape=shape)
+    # duplicates are summed up by scipy, but a session either has a value or not
+    matrix.data[:] = 1
+    return matrix
+
+
+def accumulate_range(totals: Totals, first_id: int, last_id: int, answer_index: dict, distro_index: dict, using: str = None):
+    """
+    Add the sessions within an id range to the totals
+
+    Args:
+      totals (Totals): The totals to update
+      first_id (int): The first session id of the range
+      last_id (int): The last session id of the range (inclusive)
+      answer_index (dict): Answer pk -> matrix column
+      distro_index (dict): Distribution pk -> matrix column
+      using (str): The database alias of the sessions
+    """
+    import numpy
+    given = numpy.array(list(GivenAnswer.objects.using(using).filter(
+        session_id__gte=first_id, session_id__lte=last_id).values_list("session_id", "answer_id")), dtype=numpy.int64).reshape(-1, 2)
+    if len(given) == 0:
+        return
+    voted = numpy.array(list(ResultDistroSelection.objects.using(using).filter(
+        Q(isApprovedByUser=True) | Q(isDisApprovedByUser=True),
+        session_id__gte=first_id, session_id__lte=last_id
+    ).values_list("session_id", "distro_id", "isApprovedByUser")), dtype=numpy.int64).reshape(-1, 3)
+
+    # only sessions having answers are taken into account
+    sessions, given_rows = numpy.unique(given[:, 0], return_inverse=True)
+    voted = voted[numpy.isin(voted[:, 0], sessions)]
+    voted_rows = numpy.searchsorted(sessions, voted[:, 0])
+    answer_columns = numpy.array([answer_index[pk] for pk in given[:, 1]], dtype=numpy.int64)
+    distro_columns = numpy.array([distro_index[pk] for pk in voted[:, 1]], dtype=numpy.int64)
+    is_upvote = voted[:, 2] == 1
+
+    answers = _to_matrix(given_rows, answer_columns,
+                         (len(sessions), len(answer_index)))
+    upvotes = _to_matrix(voted_rows[is_upvote], distro_columns[is_upvote],
+                         (len(sessions), len(distro_index)))
+    downvotes = _to_matrix(voted_rows[~is_upvote], distro_columns[~is_upvote],
+                           (len(sessions), len(distro_index)))
+
+    transposed = answers.T.tocsr()
+    totals.sessions += len(sessions)
+    totals.answers += numpy.asarray(answers.sum(axis=0)).ravel()
+    totals.upvotes += numpy.asarray(upvotes.sum(axis=0)).ravel()
+    totals.cooccurrences += (transposed @ answers).toarray()
+    totals.approvals += (transposed @ upvotes).toarray()
+    totals.disapprovals += (transposed @ downvotes).toarray()
+
+
+def compute(range_size: int = 50000, progress=None) -> Totals:
+    """
+    Accumulate all sessions
+
+    Args:
+      range_size (int): Amount of session ids processed at once
+      progress (callable): Called with the last processed session id of the current shard
+
+    Returns:
+      Totals: The accumulated counts, the matrix columns follow the pk order of answers and distributions
+    """
+    answer_ids = list(Answer.objects.order_by("pk").values_list("pk", flat=True))
+    distro_ids = list(Distribution.objects.order_by("pk").values_list("pk", flat=True))
+    answer_index = {pk: index for index, pk in enumerate(answer_ids)}
+    distro_index = {pk: index for index, pk in enumerate(distro_ids)}
+    totals = Totals(answer_ids, distro_ids)
+
+    for alias in get_shards():
+        bounds = GivenAnswer.objects.using(alias).aggregate(first=Min("session_id"), last=Max("session_id"))
+        if bounds["first"] is None:
+            continue
+        for first_id in range(bounds["first"], bounds["last"] + 1, range_size):
+            last_id = first_id + range_size - 1
+            accumulate_range(totals, first_id, last_id, answer_index, distro_index, alias)
+            if progress:
+                progress(min(last_id, bounds["last"]))
+    return totals
+
+
+def store(totals: Totals, min_sessions: int = 10) -> tuple:
+    """
+    Replace the stored analytics by the ones calculated out of the totals
+
+    Args:
+      totals (Totals): The result of compute()
+      min_sessions (int): Pairs seen in less sessions are skipped as they are not significant
+
+    Returns:
+      tuple: The amount of co-occurrences and correlations stored
+    """
+    import numpy
+    if totals.sessions == 0:
+        return 0, 0
+    count = totals.sessions
+    answers = totals.answers.astype(numpy.float64)
+    upvotes = totals.upvotes.astype(numpy.float64)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        lift = totals.cooccurrences * count / numpy.outer(answers, answers)
+        votes = totals.approvals + totals.disapprovals
+        approval_rate = totals.approvals / votes
+        correlation = (count * totals.approvals - numpy.outer(answers, upvotes)) / numpy.sqrt(
+            numpy.outer(answers * (count - answers), upvotes * (count - upvotes)))
+
+    cooccurrences = []
+    first, second = numpy.nonzero(numpy.triu(totals.cooccurrences, k=1) >= min_sessions)
+    for a, b in zip(first, second):
+        cooccurrences.append(AnswerCooccurrence(
+            answer_id=totals.answer_ids[a],
+            otherAnswer_id=totals.answer_ids[b],
+            sessions=int(totals.cooccurrences[a, b]),
+            lift=float(lift[a, b])
+        ))
+    correlations = []
+    for a, d in zip(*numpy.nonzero(votes >= min_sessions)):
+        correlations.append(AnswerDistroCorrelation(
+            answer_id=totals.answer_ids[a],
+            distro_id=totals.distro_ids[d],
+            approvals=int(totals.approvals[a, d]),
+            disapprovals=int(totals.disapprovals[a, d]),
+            approvalRate=float(approval_rate[a, d]),
+            correlation=float(numpy.nan_to_num(correlation[a, d]))
+        ))
+
+    with transaction.atomic():
+        AnswerCooccurrence.objects.all().delete()
+        AnswerDistroCorrelation.objects.all().delete()
+        AnswerCooccurrence.objects.bulk_create(cooccurrences, batch_size=1000)
+        AnswerDistroCorrelation.objects.bulk_create(correlations, batch_size=1000)
+    return len(cooccurrences), len(correlations)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class DistrochooserConfig(AppConfig):
     name = 'distrochooser'
+
+    def ready(self):
+        # connects the signal handlers
+        from distrochooser.db import health
@@ -0,0 +1,341 @@
+"""
+In-process (L1) cache in front of cacheops/Redis (L2).
+
+Small, hot and read-mostly results (e. g. the questionnaire steps) are kept in
+a bounded LRU cache per worker, so serving them needs neither a network round
+trip nor unpickling. Every entry is tagged with the models it was built from.
+
+Changes of the tagged models (saves, deletes, m2m changes and cacheops'
+cache_invalidated events) are reported to the invalidation bus once the
+transaction is committed, which drops the tagged entries of every worker
+(see distrochooser/invalidation.py). The TTL bounds the staleness in case
+a change can't be recorded at all.
+
+Whole GET responses which are the same for everyone are kept in a separate
+micro-cache for a few seconds (MICRO_CACHE_TTLS per route). Concurrent misses
+of the same key within a worker are coalesced into one computation.
+"""
+
+from collections import OrderedDict
+from functools import wraps
+from threading import Event, Lock
+from time import monotonic
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.http import HttpResponse
+from cacheops.signals import cache_read, cache_invalidated
+
+from backend.settings import L1_CACHE_SIZE, L1_CACHE_TTL, MICRO_CACHE_SIZE, MICRO_CACHE_TTLS
+from distrochooser import metrics, invalidation
+from distrochooser.serializers import accepts_msgpack
+
+class LocalCache:
+    """
+    Thread safe LRU cache with a TTL and tagged entries
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Args:
+          max_size (int): Maximum amount of entries
+          ttl (float): Seconds an entry is valid
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (expires, tags, value)
+        self.entries = OrderedDict()
+        # tag -> amount of invalidations, None counts the ones of all entries
+        self.generations = {}
+        self.lock = Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "staleSets": 0
+        }
+
+    def get(self, key) -> tuple:
+        """
+        Get an entry
+
+        Returns:
+          tuple: (True, value) on a hit, (False, None) otherwise
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < monotonic():
+                self.stats["misses"] += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return True, entry[2]
+
+    def get_generation(self, tags: tuple) -> tuple:
+        """
+        Get the invalidation counters of tags, to be passed to set() after computing a value
+
+        Returns:
+          tuple: The counters of all entries and the given tags
+        """
+        with self.lock:
+            return tuple(self.generations.get(tag, 0) for tag in (None,) + tags)
+
+    def set(self, key, value, tags: tuple, ttl: float = None, generation: tuple = None) -> bool:
+        """
+        Store an entry
+
+        Args:
+          generation (tuple): The result of get_generation() before the value was computed,
+          the value is dropped if one of its tags was invalidated since
+
+        Returns:
+          bool: True if the entry was stored
+        """
+        with self.lock:
+            if generation is not None and generation != tuple(self.generations.get(tag, 0) for tag in (None,) + tags):
+                self.stats["staleSets"] += 1
+                return False
+            self.entries[key] = (monotonic() + (self.ttl if ttl is None else ttl), tags, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            return True
+
+    def invalidate(self, tag: str = None):
+        """
+        Drop the entries having the given tag, all entries if it's None
+        """
+        with self.lock:
+            self.stats["invalidations"] += 1
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+            if tag is None:
+                self.entries.clear()
+                return
+            for key in [key for key, entry in self.entries.items() if tag in entry[1]]:
+                del self.entries[key]
+
+    def get_metrics(self) -> dict:
+        metrics = dict(self.stats)
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hitRatio"] = metrics["hits"] / lookups if lookups else None
+        metrics["size"] = len(self.entries)
+        return metrics
+
+
+L1 = LocalCache(L1_CACHE_SIZE, L1_CACHE_TTL)
+
+MICRO_CACHE = LocalCache(MICRO_CACHE_SIZE, 0)
+
+LOCAL_CACHES = (L1, MICRO_CACHE)
+
+L2_STATS = {
+    "hits": 0,
+    "misses": 0
+}
+
+# tags of the models watched for changes
+WATCHED = set()
+
+
+def get_tag(model) -> str:
+    # m2m changes are reported for the auto created through model
+    if model._meta.auto_created:
+        model = model._meta.auto_created
+    return model._meta.label_lower
+
+
+def watch(model):
+    """
+    Invalidate the entries tagged with a model whenever it's changed, even if cacheops doesn't cache it
+    """
+    WATCHED.add(get_tag(model))
+    post_save.connect(on_model_changed, sender=model, dispatch_uid=("l1", model))
+    post_delete.connect(on_model_changed, sender=model, dispatch_uid=("l1", model))
+    for field in model._meta.many_to_many:
+        m2m_changed.connect(on_model_changed, sender=field.remote_field.through, dispatch_uid=("l1", model, field.name))
+
+
+def l1_cached(*models):
+    """
+    Cache the result of a function in the L1 cache, keyed on its arguments.
+
+    The result is shared by all callers, so it must not be modified.
+
+    Args:
+      models: The models the result is built from, changing one of them invalidates it
+    """
+    tags = tuple(get_tag(model) for model in models)
+    for model in models:
+        watch(model)
+
+    def decorator(func):
+        prefix = "{0}.{1}".format(func.__module__, func.__qualname__)
+
+        @wraps(func)
+        def wrapper(*args):
+            invalidation.start()
+            key = (prefix,) + args
+            found, value = L1.get(key)
+            if not found:
+                # an invalidation arriving while computing must not be overwritten by the old state
+                generation = L1.get_generation(tags)
+                value = func(*args)
+                L1.set(key, value, tags, generation=generation)
+            return value
+        return wrapper
+    return decorator
+
+
+def invalidate_locally(tag: str = None):
+    for local_cache in LOCAL_CACHES:
+        local_cache.invalidate(tag)
+
+
+def on_model_changed(sender, **kwargs):
+    tag = get_tag(sender)
+    transaction.on_commit(lambda: invalidation.notify(tag))
+
+
+def on_cache_invalidated(sender, obj_dict, **kwargs):
+    # also covers manual invalidations, e. g. manage.py invalidate
+    if sender is None:
+        transaction.on_commit(invalidation.notify)
+    elif get_tag(sender) in WATCHED:
+        tag = get_tag(sender)
+        transaction.on_commit(lambda: invalidation.notify(tag))
+
+
+def on_cache_read(sender, func, hit, **kwargs):
+    L2_STATS["hits" if hit else "misses"] += 1
+
+
+class _Call:
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls having the same key into one
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """
+        Call func, or wait for the result of a running call having the same key
+
+        Args:
+          key: Identifies equal calls
+          func (callable): Computes the result
+
+        Returns:
+          tuple: The result of func and whether it was computed by another call
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self.calls[key] = call
+            else:
+                self.coalesced += 1
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result, False
+
+
+FLIGHTS = SingleFlight()
+
+
+def micro_cache(route: str, *models):
+    """
+    Cache the successful GET responses of a view for MICRO_CACHE_TTLS[route] seconds.
+
+    The key consists of the route, the view arguments, the translation version and the negotiated format.
+
+    Args:
+      route (str): The key of the TTL in MICRO_CACHE_TTLS, a missing or zero TTL disables the cache
+      models: Changing one of these models drops the cached responses right away
+    """
+    tags = tuple(get_tag(model) for model in models)
+    for model in models:
+        watch(model)
+
+    def decorator(view):
+        ttl = MICRO_CACHE_TTLS.get(route, 0)
+        if not ttl:
+            return view
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            from distrochooser.constants import TRANSLATIONS
+            invalidation.start()
+            version = TRANSLATIONS.version
+            key = (route, args, tuple(sorted(kwargs.items())), version, accepts_msgpack(request))
+            found, cached = MICRO_CACHE.get(key)
+            if not found:
+                def render():
+                    generation = MICRO_CACHE.get_generation(tags)
+                    response = view(request, *args, **kwargs)
+                    if response.status_code != 200 or response.streaming or response.cookies:
+                        return response, None
+                    cached = (response.content, list(response.items()))
+                    # rendered before an invalidation, so it's neither stored nor shared
+                    if version != TRANSLATIONS.version or not MICRO_CACHE.set(key, cached, tags, ttl, generation):
+                        return response, None
+                    return response, cached
+                (response, cached), is_shared = FLIGHTS.do(key, render)
+                if not is_shared:
+                    return response
+                if cached is None:
+                    # not cacheable or stale, so every waiting request renders its own response
+                    return view(request, *args, **kwargs)
+            content, headers = cached
+            response = HttpResponse(content)
+            for header, value in headers:
+                response[header] = value
+            return response
+        return wrapper
+    return decorator
+
+
+def get_metrics() -> dict:
+    lookups = L2_STATS["hits"] + L2_STATS["misses"]
+    return {
+        "l1": L1.get_metrics(),
+        "micro": dict(MICRO_CACHE.get_metrics(), coalesced=FLIGHTS.coalesced),
+        "l2": {
+            "hits": L2_STATS["hits"],
+            "misses": L2_STATS["misses"],
+            "hitRatio": L2_STATS["hits"] / lookups if lookups else None
+        }
+    }
+
+
+invalidation.subscribe(invalidate_locally)
+cache_invalidated.connect(on_cache_invalidated)
+cache_read.connect(on_cache_read)
+metrics.register("cache", get_metrics)
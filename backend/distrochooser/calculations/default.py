@@ -1,83 +1,183 @@
+from threading import Lock
 from distrochooser.constants import TRANSLATIONS
-from distrochooser.models import GivenAnswer, ResultDistroSelection, ResultDistroSelection, Distribution, SelectionReason, Answer, AnswerDistributionMatrix, UserSession
+from distrochooser.models import GivenAnswer, ResultDistroSelection, ResultDistroSelection, Distribution, SelectionReason, Answer, AnswerDistributionMatrix, UserSession, MediaVariant
 from django.forms.models import model_to_dict
-from django.db import transaction
+from django.db import transaction, connections
+from django.dispatch import receiver
+from distrochooser.votes import get_vote_counts, EMPTY_VOTES
+from distrochooser.serializers import to_fragment
+from distrochooser.util import get_answer_space
+from distrochooser.cache import get_tag, watch
+from distrochooser import invalidation
+from distrochooser.sharding import encode_id
+from distrochooser.media import get_media
 
-def saveAnswers(userSession, rawAnswers):
+# the reason tables are rebuilt once one of them changed, on every worker
+MATRIX_MODELS = [AnswerDistributionMatrix, Answer, Distribution, MediaVariant]
+MATRIX_TAGS = tuple(get_tag(model) for model in MATRIX_MODELS)
+# langCode -> ReasonTable
+REASON_TABLES = {}
+REASON_TABLES_LOCK = Lock()
+
+
+class ReasonTable():
+  """
+  The matrix of one locale, resolved ahead of time.
+
+  Each tuple is stored as (index, reason, importantReason, distroIds), grouped by the answer id.
+  The reasons are the dictionaries returned to the client, with the translated description
+  (falling back to english and the msgid), so a request only has to pick references.
+  """
+  def __init__(self, langCode, version):
+    self.version = version
+    translationToUse = TRANSLATIONS[langCode] if langCode in TRANSLATIONS else TRANSLATIONS["en"]
+    fallback = TRANSLATIONS["en"] if "en" in TRANSLATIONS else {}
+
+    self.distros = []
+    for distro in Distribution.objects.all().order_by("pk"):
+      self.distros.append((distro.id, to_fragment(getDistroDict(distro))))
+
+    self.tuplesByAnswer = {}
+    matchingTuples = AnswerDistributionMatrix.objects.all().order_by("pk").prefetch_related('distros')
+    for index, matrixTuple in enumerate(matchingTuples):
+      description = translationToUse.get(matrixTuple.description) or fallback.get(matrixTuple.description) or matrixTuple.description
+      # same key order as model_to_dict(SelectionReason)
+      reason = {
+        "description": description,
+        "isPositiveHit": not matrixTuple.isNegativeHit if not matrixTuple.isNeutralHit else True,
+        "isBlockingHit": matrixTuple.isBlockingHit,
+        "isRelatedBlocked": False,
+        "isNeutralHit": matrixTuple.isNeutralHit,
+        "isImportant": False
+      }
+      importantReason = dict(reason, isImportant=True)
+      distroIds = tuple(distro.id for distro in matrixTuple.distros.all())
+      self.tuplesByAnswer.setdefault(matrixTuple.answer_id, []).append((index, reason, importantReason, distroIds))
+
+
+def getDistroDict(distro):
+  """
+  The distribution as returned to the client, referencing the variants of the logo
+  """
+  result = model_to_dict(distro, exclude=["logo", "id"])
+  result["logo"] = get_media(distro.logo.name)
+  return result
+
+
+def getReasonTable(langCode):
+  version = (TRANSLATIONS.version, invalidation.get_version(*MATRIX_TAGS))
+  table = REASON_TABLES.get(langCode)
+  if table is None or table.version != version:
+    with REASON_TABLES_LOCK:
+      table = REASON_TABLES.get(langCode)
+      if table is None or table.version != version:
+        table = ReasonTable(langCode, version)
+        REASON_TABLES[langCode] = table
+  return table
+
+
+for model in MATRIX_MODELS:
+  watch(model)
+
+
+def saveAnswers(userSession, data):
+  # the rows of a session are kept on its shard
+  database = userSession._state.db
   # Delete old answers
-  GivenAnswer.objects.filter(session=userSession).delete()
+  GivenAnswer.objects.using(database).filter(session=userSession).delete()
   newAnswers = []
-  selectedAnswers = {answer[0]: answer[1] for answer in Answer.objects.filter(msgid__in=[a["msgid"] for a in rawAnswers]).values_list('msgid', 'pk')}
-  for answer in rawAnswers:
+  for answerId, isImportant in get_answer_space().resolve(data):
     newAnswers.append(
       GivenAnswer(
           session=userSession,
-          answer_id=selectedAnswers[answer['msgid']],
-          isImportant=answer['important']
+          dateTime=userSession.dateTime,
+          answer_id=answerId,
+          isImportant=isImportant
       )
     )
-  GivenAnswer.objects.bulk_create(newAnswers)
+  GivenAnswer.objects.using(database).bulk_create(newAnswers)
+  return newAnswers
 
 
-@transaction.atomic
 def getSelections(userSession, data, langCode):
-  translationToUse = TRANSLATIONS[langCode] if langCode in TRANSLATIONS else TRANSLATIONS["en"]
-  ResultDistroSelection.objects.filter(session=userSession).delete()
-  saveAnswers(userSession, data['answers'])
+  database = userSession._state.db
+  with transaction.atomic(using=database):
+    return calculateSelections(userSession, data, langCode, database)
+
 
-  givenAnswers = GivenAnswer.objects.filter(session=userSession).prefetch_related('answer').values("answer","isImportant")
-  importantAnswers = list(map(lambda o: o["answer"], filter(lambda o: o["isImportant"], givenAnswers)))
-  distros = Distribution.objects.all()
-  matchingTuples = AnswerDistributionMatrix.objects.all().prefetch_related('distros', 'answer')
+def calculateSelections(userSession, data, langCode, database):
+  table = getReasonTable(langCode)
+  ResultDistroSelection.objects.using(database).filter(session=userSession).delete()
+  givenAnswers = saveAnswers(userSession, data)
 
+  matches = []
+  for givenAnswer in givenAnswers:
+    for index, reason, importantReason, distroIds in table.tuplesByAnswer.get(givenAnswer.answer_id, ()):
+      matches.append((index, importantReason if givenAnswer.isImportant else reason, distroIds))
+  # keep the order of the matrix
+  matches.sort(key=lambda match: match[0])
 
-  createdSelections = {}
-  createdReasons = {}
+  createdReasons = {distroId: [] for distroId, distro in table.distros}
+  createdDescriptions = {distroId: set() for distroId, distro in table.distros}
+  for index, reason, distroIds in matches:
+    for distroId in distroIds:
+      # prevent that same descritptions appear multiple times
+      if reason["description"] not in createdDescriptions[distroId]:
+        createdDescriptions[distroId].add(reason["description"])
+        createdReasons[distroId].append(reason)
+
+  newSelections = [
+    ResultDistroSelection(session=userSession, dateTime=userSession.dateTime, distro_id=distroId)
+    for distroId, distro in table.distros
+  ]
+  if connections[database].features.can_return_ids_from_bulk_insert:
+    ResultDistroSelection.objects.using(database).bulk_create(newSelections)
+  else:
+    for selection in newSelections:
+      selection.save(using=database)
 
+  newReasons = []
+  for selection in newSelections:
+    for reason in createdReasons[selection.distro_id]:
+      newReasons.append(SelectionReason(resultSelection=selection, dateTime=userSession.dateTime, **reason))
+  SelectionReason.objects.using(database).bulk_create(newReasons)
 
-  newSelections = []
-  for distro in distros:
-    selection = ResultDistroSelection(
-      session=userSession,
-      distro=distro
+  voteCounts = get_vote_counts()
+  results = []
+  for selection, (distroId, distro) in zip(newSelections, table.distros):
+    results.append(
+      {
+        "distro": distro,
+        "reasons": createdReasons[distroId],
+        "selection": encode_id(database, selection.id),
+        "votes": voteCounts.get(distroId, EMPTY_VOTES)
+      }
     )
-    newSelections.append(selection)
-    createdSelections[distro.id] = selection
-    createdReasons[distro.id] = []
-    selection.save()
-
-  for matrixTuple in matchingTuples:
-    isInAnswerList = matrixTuple.answer.pk in (o["answer"] for o in givenAnswers)
-    if isInAnswerList:
-      selectedDescription = translationToUse[matrixTuple.description] if matrixTuple.description in translationToUse else matrixTuple.description
-
-      reason = SelectionReason(
-        isImportant = matrixTuple.answer.pk in importantAnswers,
-        resultSelection = None,
-        isBlockingHit = matrixTuple.isBlockingHit,
-        isPositiveHit = not matrixTuple.isNegativeHit if not matrixTuple.isNeutralHit else True,
-        isNeutralHit = matrixTuple.isNeutralHit,
-        description = selectedDescription
-      )
+  return results
 
-      # prevent that same descritptions appear multiple times
-      isReasonUnique = not len(list(filter(lambda r: r.description == reason.description, createdReasons[distro.id]))) > 0
-      
-      for distro in matrixTuple.distros.all():
-        if isReasonUnique:
-          selection = createdSelections[distro.id]
-          reason.resultSelection = selection
-          createdReasons[distro.id].append(reason)
-          reason.save()
 
+def getStoredSelections(userSession, langCode):
+  """
+  Rebuild the result of the last calculation out of the stored selections and reasons
+  """
+  table = getReasonTable(langCode)
+  distros = dict(table.distros)
+  database = userSession._state.db
+  selections = ResultDistroSelection.objects.using(database).filter(session=userSession).order_by("pk")
+  reasons = {}
+  for reason in SelectionReason.objects.using(database).filter(resultSelection__in=selections).order_by("pk").values(
+      "resultSelection_id", "description", "isPositiveHit", "isBlockingHit", "isRelatedBlocked", "isNeutralHit", "isImportant"):
+    reasons.setdefault(reason.pop("resultSelection_id"), []).append(reason)
+
+  voteCounts = get_vote_counts()
   results = []
-  for distroId, selection in createdSelections.items():
-    reasons = createdReasons[distroId]
+  for selection in selections:
     results.append(
       {
-        "distro": model_to_dict(selection.distro, exclude=["logo", "id"]),
-        "reasons": list(map(lambda r: model_to_dict(r,exclude=["id", "resultSelection"]), reasons)),
-        "selection": selection.id
+        "distro": distros.get(selection.distro_id) or getDistroDict(selection.distro),
+        "reasons": reasons.get(selection.id, []),
+        "selection": encode_id(database, selection.id),
+        "votes": voteCounts.get(selection.distro_id, EMPTY_VOTES)
       }
     )
-  return results
\ No newline at end of file
+  return results
@@ -1,21 +1,18 @@
 from os.path import join, exists
-from backend.settings import CONFIG, LOCALES
-# not using django's translation model b/c of dynamical content instead of values taken out of the sourcecode
-import polib
+from backend.settings import CONFIG, LOCALES, TRANSLATION_CACHE_DIR, LAZY_TRANSLATIONS, TRANSLATION_RELOAD_INTERVAL
+from distrochooser.translations import TranslationStore, parse_catalog
 
 def parseTranslation(langCode: str, poFile: str) -> dict:
   if langCode not in LOCALES:
     raise Exception("Language not installed")
-  po = polib.pofile(poFile)
-  result = {}
-  for entry in po:
-    result[entry.msgid] = entry.msgstr
-  return result
+  with open(poFile, "r", encoding="utf-8") as file:
+    return parse_catalog(file.read())
 
 # Build the translation one time to prevent them from being generated on each request
-TRANSLATIONS = {}
-for key, value in LOCALES.items():
-  TRANSLATIONS[key] = parseTranslation(key, value)
+# The parsed catalogs are cached in TRANSLATION_CACHE_DIR, so only changed .po files are parsed again
+# Changed .po files are picked up every TRANSLATION_RELOAD_INTERVAL seconds
+TRANSLATIONS = TranslationStore(
+  LOCALES, TRANSLATION_CACHE_DIR, lazy=LAZY_TRANSLATIONS, check_interval=TRANSLATION_RELOAD_INTERVAL)
 
 
 TESTOFFSET = 713037
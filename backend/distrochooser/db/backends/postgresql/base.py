@@ -0,0 +1,40 @@
+"""
+PostgreSQL backend handing out connections of the in-process pool.
+
+Selected by backend/settings.py if DATABASE_CONNECTIONS.POOL_SIZE is set.
+"""
+
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgreSQLDatabaseWrapper, Database
+
+from distrochooser.db.pool import ConnectionPool, get_pool
+
+
+class DatabaseWrapper(PostgreSQLDatabaseWrapper):
+
+    def get_pool(self, conn_params: dict) -> ConnectionPool:
+        settings = self.settings_dict["POOL"]
+        return get_pool(self.alias, lambda: ConnectionPool(
+            lambda: Database.connect(**conn_params),
+            size=settings["SIZE"],
+            max_age=settings["MAX_AGE"],
+            health_check_after=settings["HEALTH_CHECK_AFTER"],
+            timeout=settings["TIMEOUT"]
+        ))
+
+    def get_new_connection(self, conn_params):
+        connection = self.get_pool(conn_params).acquire()
+        # see django.db.backends.postgresql.base.DatabaseWrapper.get_new_connection
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.get_pool(self.get_connection_params()).release(self.connection)
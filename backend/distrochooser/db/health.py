@@ -0,0 +1,56 @@
+"""
+Health checks of persistent database connections.
+
+Django checks a persistent connection only after an error occurred on it, so a
+connection dropped by the server (restart, failover, idle timeout) fails the
+next request using it. Connections idle for longer than HEALTH_CHECK_AFTER are
+therefore pinged when a request starts and replaced if they are unusable.
+"""
+
+from time import monotonic
+
+from django.core.signals import request_started, request_finished
+from django.db import connections
+
+from backend.settings import DATABASE_HEALTH_CHECK_AFTER
+from distrochooser import metrics
+from distrochooser.db import pool
+
+STATS = {
+    "checks": 0,
+    "replaced": 0
+}
+
+
+def check_connections(**kwargs):
+    now = monotonic()
+    for connection in connections.all():
+        # pooled connections are checked by the pool
+        if connection.connection is None or "POOL" in connection.settings_dict:
+            continue
+        released = getattr(connection, "released_at", None)
+        if released is None or now - released < DATABASE_HEALTH_CHECK_AFTER:
+            continue
+        STATS["checks"] += 1
+        if not connection.is_usable():
+            STATS["replaced"] += 1
+            connection.close()
+
+
+def mark_released(**kwargs):
+    now = monotonic()
+    for connection in connections.all():
+        connection.released_at = now
+
+
+def get_metrics() -> dict:
+    return {
+        "pools": pool.get_metrics(),
+        "healthChecks": STATS["checks"],
+        "replacedConnections": STATS["replaced"]
+    }
+
+
+request_started.connect(check_connections)
+request_finished.connect(mark_released)
+metrics.register("database", get_metrics)
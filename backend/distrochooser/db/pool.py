@@ -0,0 +1,172 @@
+"""
+In-process database connection pool.
+
+Django opens one connection per thread and closes it at the end of the request
+(CONN_MAX_AGE = 0). With the pool, closing hands the connection back instead,
+so the next request of any thread of the worker reuses it. Connections older
+than max_age are replaced, idle ones are checked with a cheap query before
+being handed out again.
+"""
+
+import os
+from collections import deque
+from threading import Lock, Semaphore
+from time import monotonic
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, size: int, max_age: float, health_check_after: float, timeout: float):
+        """
+        Args:
+          connect (callable): Opens a new DB-API connection
+          size (int): Maximum amount of connections handed out at the same time
+          max_age (float): Seconds after which a connection is replaced
+          health_check_after (float): Idle seconds after which a connection is checked before reuse
+          timeout (float): Seconds to wait for a free connection
+        """
+        self.connect = connect
+        self.size = size
+        self.max_age = max_age
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.lock = Lock()
+        self.slots = Semaphore(size)
+        # (connection, created, released)
+        self.idle = deque()
+        # id(connection) -> created
+        self.created = {}
+        self.stats = {
+            "created": 0,
+            "reused": 0,
+            "discarded": 0,
+            "failedHealthChecks": 0,
+            "waitTimeouts": 0
+        }
+
+    def acquire(self):
+        """
+        Hand out a healthy connection, opening a new one if none is idle
+
+        Returns:
+          The DB-API connection
+        """
+        if not self.slots.acquire(timeout=self.timeout):
+            self.stats["waitTimeouts"] += 1
+            raise PoolExhausted("No database connection available after {0}s".format(self.timeout))
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    connection, created, released = self.idle.pop()
+                now = monotonic()
+                if now - created > self.max_age or connection.closed:
+                    self.discard(connection)
+                    continue
+                if now - released > self.health_check_after and not self.is_healthy(connection):
+                    self.stats["failedHealthChecks"] += 1
+                    self.discard(connection)
+                    continue
+                self.stats["reused"] += 1
+                return connection
+            connection = self.connect()
+            self.created[id(connection)] = monotonic()
+            self.stats["created"] += 1
+            return connection
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, connection):
+        """
+        Take a connection back, it's discarded if it's broken or too old
+        """
+        try:
+            created = self.created.get(id(connection), 0)
+            if connection.closed or monotonic() - created > self.max_age:
+                self.discard(connection)
+                return
+            try:
+                # never hand out a connection within a transaction
+                connection.rollback()
+            except Exception:
+                self.discard(connection)
+                return
+            with self.lock:
+                self.idle.append((connection, created, monotonic()))
+        finally:
+            self.slots.release()
+
+    def discard(self, connection):
+        self.created.pop(id(connection), None)
+        self.stats["discarded"] += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def is_healthy(connection) -> bool:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self.lock:
+            idle = list(self.idle)
+            self.idle.clear()
+        for connection, created, released in idle:
+            self.discard(connection)
+
+    def get_metrics(self) -> dict:
+        metrics = dict(self.stats)
+        metrics["size"] = self.size
+        metrics["idle"] = len(self.idle)
+        metrics["inUse"] = len(self.created) - len(self.idle)
+        return metrics
+
+
+# alias -> ConnectionPool of this process
+POOLS = {}
+POOLS_LOCK = Lock()
+
+
+def get_pool(alias: str, create) -> ConnectionPool:
+    """
+    Get the pool of a database alias, creating it with create() if needed.
+
+    Pools inherited from a parent process are dropped without closing their
+    connections, as those belong to the parent.
+    """
+    pool = POOLS.get(alias)
+    if pool is None or pool.pid != os.getpid():
+        with POOLS_LOCK:
+            pool = POOLS.get(alias)
+            if pool is None or pool.pid != os.getpid():
+                pool = create()
+                POOLS[alias] = pool
+    return pool
+
+
+def close_pools():
+    """
+    Close the idle connections of all pools, e. g. before forking
+    """
+    for pool in list(POOLS.values()):
+        if pool.pid == os.getpid():
+            pool.close()
+
+
+def get_metrics() -> dict:
+    return {alias: pool.get_metrics() for alias, pool in POOLS.items() if pool.pid == os.getpid()}
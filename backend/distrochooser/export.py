@@ -0,0 +1,174 @@
+"""
+Streaming export of sessions including their answers and votes.
+
+The sessions are read through server side cursors in chunks, every chunk
+fetches the answers and votes of its sessions with one query each. All
+writers are generators, so the memory usage does not depend on the export size.
+
+Sharded sessions are exported shard by shard, the exported ids encode the shard
+(see sharding.encode_id()), so after_id continues within the right shard.
+"""
+
+import csv
+from collections import defaultdict
+from json import dumps
+
+from django.db.models import Q
+
+from distrochooser.models import UserSession, GivenAnswer, ResultDistroSelection
+from distrochooser.sharding import get_shards, encode_id, decode_id
+
+FORMATS = {
+    "jsonl": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+FIELDS = ["id", "token", "dateTime", "language", "referrer", "calculationTime",
+          "answers", "important", "approved", "disapproved"]
+
+
+def _iter_chunks(iterable, chunk_size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_records(after_id: int = None, since=None, chunk_size: int = 1000):
+    """
+    Iterate the sessions ordered by their shard and id as flat dictionaries
+
+    Args:
+      after_id (int): Only export sessions following the one having this id
+      since (datetime): Only export sessions created at or after this
+      chunk_size (int): Amount of sessions fetched at once
+
+    Yields:
+      dict: A session record having the keys of FIELDS
+    """
+    shards = get_shards()
+    first = 0
+    after_pk = None
+    if after_id is not None:
+        alias, after_pk = decode_id(after_id)
+        first = shards.index(alias)
+    for index in range(first, len(shards)):
+        yield from iter_shard_records(shards[index], after_pk if index == first else None, since, chunk_size)
+
+
+def iter_shard_records(alias: str, after_pk: int = None, since=None, chunk_size: int = 1000):
+    """
+    Iterate the sessions of one database ordered by their primary key, see iter_records()
+    """
+    sessions = UserSession.objects.using(alias).order_by("pk")
+    if after_pk is not None:
+        sessions = sessions.filter(pk__gt=after_pk)
+    if since is not None:
+        sessions = sessions.filter(dateTime__gte=since)
+    sessions = sessions.values_list(
+        "pk", "token", "dateTime", "language", "referrer", "calculationTime")
+
+    for chunk in _iter_chunks(sessions.iterator(chunk_size=chunk_size), chunk_size):
+        ids = [session[0] for session in chunk]
+        answers = defaultdict(list)
+        important = defaultdict(list)
+        for session_id, msgid, is_important in GivenAnswer.objects.using(alias).filter(
+                session_id__in=ids).values_list("session_id", "answer__msgid", "isImportant"):
+            answers[session_id].append(msgid)
+            if is_important:
+                important[session_id].append(msgid)
+        approved = defaultdict(list)
+        disapproved = defaultdict(list)
+        for session_id, identifier, is_approved in ResultDistroSelection.objects.using(alias).filter(
+                Q(isApprovedByUser=True) | Q(isDisApprovedByUser=True), session_id__in=ids).values_list(
+                "session_id", "distro__identifier", "isApprovedByUser"):
+            (approved if is_approved else disapproved)[session_id].append(identifier)
+
+        for pk, token, date_time, language, referrer, calculation_time in chunk:
+            yield {
+                "id": encode_id(alias, pk),
+                "token": token,
+                "dateTime": date_time.isoformat(),
+                "language": language,
+                "referrer": referrer,
+                "calculationTime": calculation_time,
+                "answers": answers[pk],
+                "important": important[pk],
+                "approved": approved[pk],
+                "disapproved": disapproved[pk]
+            }
+
+
+def write_jsonl(records):
+    """
+    Encode records as JSON lines
+
+    Yields:
+      bytes: One line per record
+    """
+    for record in records:
+        yield (dumps(record) + "\n").encode("utf-8")
+
+
+class _Echo:
+    """
+    File-like object returning what is written, used to stream the csv writer
+    """
+
+    def write(self, value):
+        return value
+
+
+def write_csv(records):
+    """
+    Encode records as CSV having a header row. Lists are joined by spaces.
+
+    Yields:
+      bytes: One line per record
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS).encode("utf-8")
+    for record in records:
+        yield writer.writerow([
+            " ".join(record[field]) if isinstance(record[field], list) else record[field] for field in FIELDS
+        ]).encode("utf-8")
+
+
+def write_parquet(records, path: str, chunk_size: int = 1000) -> int:
+    """
+    Write records into a parquet file, one row group per chunk. Needs pyarrow.
+
+    Args:
+      records: The records to write
+      path (str): The file to write
+      chunk_size (int): Amount of records per row group
+
+    Returns:
+      int: The amount of records written
+    """
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema([
+        ("id", pyarrow.int64()),
+        ("token", pyarrow.string()),
+        ("dateTime", pyarrow.string()),
+        ("language", pyarrow.string()),
+        ("referrer", pyarrow.string()),
+        ("calculationTime", pyarrow.int64()),
+        ("answers", pyarrow.list_(pyarrow.string())),
+        ("important", pyarrow.list_(pyarrow.string())),
+        ("approved", pyarrow.list_(pyarrow.string())),
+        ("disapproved", pyarrow.list_(pyarrow.string()))
+    ])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for chunk in _iter_chunks(records, chunk_size):
+            writer.write_table(pyarrow.Table.from_pylist(chunk, schema=schema))
+            count = count + len(chunk)
+    return count
@@ -0,0 +1,274 @@
+"""
+Versioned invalidation bus of the in-process caches.
+
+Each tag (the label of a model, see cache.get_tag) has a version, stored in the
+CacheVersion table. Once a change of a tagged model is committed, its version
+is incremented and published via Redis pub/sub. Every worker remembers the
+versions it has applied and notifies its subscribers only if a newer version
+arrives, so each worker drops its derived caches exactly once per change, no
+matter how many messages or polls report it.
+
+Besides listening, every worker polls the CacheVersion table each
+INVALIDATION_POLL_INTERVAL seconds, which covers the messages lost while Redis
+is unreachable.
+
+Changes are collected for INVALIDATION_DEBOUNCE seconds before the versions are
+incremented, so a bulk edit in the admin increments each tag once instead of
+once per saved row.
+
+The listener thread is started on first use in each process. The gunicorn
+master only loads the versions (see load(), called by preload()), its workers
+start their own listener after forking.
+"""
+
+import atexit
+import json
+import logging
+import os
+from threading import Lock, Thread, Timer
+from time import monotonic, sleep
+
+from django.db import connection, transaction
+from django.db.models import F
+
+from backend.settings import INVALIDATION_DEBOUNCE, INVALIDATION_POLL_INTERVAL
+from distrochooser import metrics
+from distrochooser.models import CacheVersion
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "distrochooser:invalidate"
+
+# the tag of changes affecting all caches, e. g. manage.py invalidate
+ALL = "*"
+
+# tag -> latest version applied by this process
+VERSIONS = {}
+# tags changed since the last increment
+PENDING = set()
+SUBSCRIBERS = []
+LOCK = Lock()
+
+STATE = {
+    # pid of the process whose listener thread is running
+    "pid": None,
+    "timer": None
+}
+
+STATS = {
+    "changes": 0,
+    "increments": 0,
+    "applied": 0,
+    "polls": 0
+}
+
+
+def subscribe(callback):
+    """
+    Register a callback, which is called after the version of a tag changed
+
+    Args:
+      callback (callable): Receives the tag as the only argument, None if all caches are affected
+    """
+    SUBSCRIBERS.append(callback)
+
+
+def get_version(*tags) -> tuple:
+    """
+    Get the versions of tags applied by this process, to be used as part of a cache key
+
+    Returns:
+      tuple: The versions of ALL and the given tags
+    """
+    start()
+    return tuple(VERSIONS.get(tag, 0) for tag in (ALL,) + tags)
+
+
+def apply(versions: dict) -> list:
+    """
+    Apply the versions reported by the database or another worker
+
+    Args:
+      versions (dict): tag -> version
+
+    Returns:
+      list: The tags whose version changed
+    """
+    changed = []
+    with LOCK:
+        for tag, version in versions.items():
+            if version > VERSIONS.get(tag, 0):
+                VERSIONS[tag] = version
+                changed.append(tag)
+    for tag in changed:
+        STATS["applied"] += 1
+        for callback in SUBSCRIBERS:
+            callback(None if tag == ALL else tag)
+    return changed
+
+
+def increment(tags) -> dict:
+    """
+    Increment the stored versions of the tags
+
+    Returns:
+      dict: tag -> new version
+    """
+    versions = {}
+    with transaction.atomic():
+        for tag in sorted(tags):
+            CacheVersion.objects.get_or_create(tag=tag)
+            CacheVersion.objects.filter(tag=tag).update(version=F("version") + 1)
+            versions[tag] = CacheVersion.objects.values_list(
+                "version", flat=True).get(tag=tag)
+    return versions
+
+
+def publish(versions: dict):
+    from cacheops.redis import redis_client
+    try:
+        redis_client.publish(CHANNEL, json.dumps(versions))
+    except Exception:
+        logger.warning("Could not publish the cache versions %s", versions, exc_info=True)
+
+
+def flush():
+    """
+    Increment and publish the versions of the pending tags
+    """
+    with LOCK:
+        tags = set(PENDING)
+        PENDING.clear()
+        STATE["timer"] = None
+    if not tags:
+        return
+    try:
+        versions = increment(tags)
+    except Exception:
+        # the other workers catch up once their cache entries expire
+        logger.warning("Could not increment the cache versions of %s", tags, exc_info=True)
+        for tag in tags:
+            for callback in SUBSCRIBERS:
+                callback(None if tag == ALL else tag)
+        return
+    STATS["increments"] += len(versions)
+    apply(versions)
+    publish(versions)
+
+
+def flush_in_background():
+    try:
+        flush()
+    finally:
+        # the timer thread has its own connection
+        connection.close()
+
+
+def notify(tag: str = None):
+    """
+    Report a committed change. The caches of all workers are dropped after the debounce delay.
+
+    Args:
+      tag (str): The tag of the changed model, None if all caches are affected
+    """
+    STATS["changes"] += 1
+    with LOCK:
+        PENDING.add(ALL if tag is None else tag)
+        if INVALIDATION_DEBOUNCE and STATE["timer"] is None:
+            timer = Timer(INVALIDATION_DEBOUNCE, flush_in_background)
+            timer.daemon = True
+            STATE["timer"] = timer
+            timer.start()
+    if not INVALIDATION_DEBOUNCE:
+        flush()
+
+
+def poll():
+    STATS["polls"] += 1
+    apply(dict(CacheVersion.objects.values_list("tag", "version")))
+
+
+def connect():
+    from cacheops.redis import redis_client
+    try:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(CHANNEL)
+        return pubsub
+    except Exception:
+        logger.warning("Could not subscribe to the cache versions, polling them instead", exc_info=True)
+        return None
+
+
+def listen():
+    pubsub = None
+    while True:
+        try:
+            poll()
+        except Exception:
+            logger.warning("Could not poll the cache versions", exc_info=True)
+        finally:
+            connection.close()
+        if pubsub is None:
+            pubsub = connect()
+        if pubsub is None:
+            sleep(INVALIDATION_POLL_INTERVAL)
+            continue
+        deadline = monotonic() + INVALIDATION_POLL_INTERVAL
+        try:
+            while monotonic() < deadline:
+                message = pubsub.get_message(timeout=max(deadline - monotonic(), 0))
+                if message is not None:
+                    apply(json.loads(message["data"]))
+        except Exception:
+            logger.warning("Cache version subscription failed, reconnecting", exc_info=True)
+            pubsub = None
+
+
+def load():
+    """
+    Load the current versions without listening to changes. Used by the gunicorn master before forking,
+    as threads (and held locks) must not be inherited by the workers.
+    """
+    # start() won't start a listener in this process, the forked workers have another pid
+    STATE["pid"] = os.getpid()
+    try:
+        poll()
+    except Exception:
+        logger.warning("Could not load the cache versions", exc_info=True)
+    finally:
+        connection.close()
+
+
+def reset_after_fork():
+    global LOCK
+    LOCK = Lock()
+    STATE["timer"] = None
+
+
+def start():
+    """
+    Load the current versions and start listening to changes, once per process
+    """
+    if STATE["pid"] == os.getpid():
+        return
+    with LOCK:
+        if STATE["pid"] == os.getpid():
+            return
+        STATE["pid"] = os.getpid()
+    try:
+        poll()
+    except Exception:
+        logger.warning("Could not load the cache versions", exc_info=True)
+    Thread(target=listen, daemon=True).start()
+
+
+def get_metrics() -> dict:
+    return dict(STATS, versions=dict(VERSIONS), pending=len(PENDING))
+
+
+# changes made right before a management command exits are still published
+atexit.register(flush)
+# available as of Python 3.7
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
+metrics.register("invalidation", get_metrics)
@@ -0,0 +1,64 @@
+from time import perf_counter
+
+from django.conf import settings
+from django.core.handlers.base import BaseHandler
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+
+from distrochooser import middleware
+
+
+def get_full_stack() -> list:
+    """
+    Get MIDDLEWARE with Django's own classes instead of the route-aware ones
+    """
+    full = []
+    for path in settings.MIDDLEWARE:
+        module, name = path.rsplit(".", 1)
+        if module == middleware.__name__:
+            base = getattr(middleware, name).__mro__[1]
+            path = "{0}.{1}".format(base.__module__, base.__name__)
+        full.append(path)
+    return full
+
+
+def get_handler(stack: list) -> BaseHandler:
+    with override_settings(MIDDLEWARE=stack):
+        handler = BaseHandler()
+        handler.load_middleware()
+    return handler
+
+
+def measure(handler: BaseHandler, path: str, iterations: int) -> float:
+    """
+    Returns:
+      float: The average microseconds per request
+    """
+    factory = RequestFactory(HTTP_USER_AGENT="bench_middleware")
+    requests = [factory.get(path) for _ in range(iterations)]
+    # the first request fills the caches of the view
+    handler.get_response(factory.get(path))
+    started = perf_counter()
+    for request in requests:
+        handler.get_response(request)
+    return (perf_counter() - started) * 1000000 / iterations
+
+
+class Command(BaseCommand):
+    help = "Compares the per-request overhead of the full middleware stack and the route-aware profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", action="append", default=None,
+                            help="Path to request, may be repeated (default: /locales/)")
+        parser.add_argument("--iterations", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        handlers = {
+            "full": get_handler(get_full_stack()),
+            "profiled": get_handler(settings.MIDDLEWARE)
+        }
+        for path in options["path"] or ["/locales/"]:
+            results = {name: measure(handler, path, options["iterations"]) for name, handler in handlers.items()}
+            saved = results["full"] - results["profiled"]
+            self.stdout.write("{0}: full {1:.1f} us, profiled {2:.1f} us, saved {3:.1f} us ({4:.0f} %)".format(
+                path, results["full"], results["profiled"], saved, saved * 100 / results["full"]))
@@ -0,0 +1,104 @@
+from json import loads
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from distrochooser.calculations import default
+from distrochooser.constants import TRANSLATIONS
+from distrochooser.models import UserSession, Category
+from distrochooser.serializers import BACKENDS, dumps, packb, msgpack
+from distrochooser.util import get_step_data, get_step_fragments, get_categories_fragment, get_translations_fragment
+
+
+class Rollback(Exception):
+    pass
+
+
+def get_start_payloads(language: str) -> tuple:
+    """
+    Build the /start/ response data without and with fragments
+
+    Returns:
+      tuple: (plain, fragmented)
+    """
+    common = {
+        "token": "d5benchmark",
+        "sessionToken": "d5benchmark",
+        "language": language,
+        "testCount": 1000000
+    }
+    step = get_step_data(0)
+    plain = dict(common, translations=TRANSLATIONS[language],
+                 categories=list(Category.objects.all().order_by("index").values()), **step)
+    fragmented = dict(common, translations=get_translations_fragment(language),
+                      categories=get_categories_fragment(), **get_step_fragments(0))
+    return plain, fragmented
+
+
+def get_submit_payloads(language: str) -> tuple:
+    """
+    Calculate a result for the first answer of each question, in a transaction which is rolled back
+
+    Returns:
+      tuple: (plain, fragmented)
+    """
+    answers = []
+    for category in Category.objects.all().order_by("index"):
+        answers.extend({"msgid": answer["msgid"], "important": False}
+                       for answer in get_step_data(category.index)["answers"][:1])
+    try:
+        with transaction.atomic():
+            session = UserSession(userAgent="bench_serializers", language=language)
+            session.save()
+            selections = default.getSelections(session, {"answers": answers}, language)
+            raise Rollback()
+    except Rollback:
+        pass
+    fragmented = {
+        "url": "https://distrochooser.de/{0}/d5benchmark/".format(language),
+        "selections": selections,
+        "token": "d5benchmark"
+    }
+    plain = dict(fragmented, selections=[
+        dict(selection, distro=loads(selection["distro"].content)) for selection in selections])
+    return plain, fragmented
+
+
+def get_encoders() -> dict:
+    encoders = {name: lambda data, backend=name: dumps(data, backend) for name in BACKENDS}
+    if msgpack is not None:
+        encoders["msgpack"] = packb
+    return encoders
+
+
+def measure(data, encode, iterations: int) -> tuple:
+    started = perf_counter()
+    for _ in range(iterations):
+        encoded = encode(data)
+    return (perf_counter() - started) * 1000 / iterations, len(encoded)
+
+
+class Command(BaseCommand):
+    help = "Compares the JSON encoder backends and MessagePack with and without fragments on /start/ and /submit/ payloads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--language", default="en")
+        parser.add_argument("--iterations", type=int, default=200)
+
+    def handle(self, *args, **options):
+        language = options["language"]
+        if language not in TRANSLATIONS:
+            raise CommandError("Language {0} is not installed".format(language))
+        payloads = {
+            "start": get_start_payloads(language),
+            "submit": get_submit_payloads(language)
+        }
+        self.stdout.write("{0:<8} {1:<8} {2:<11} {3:>10} {4:>10}".format(
+            "payload", "backend", "fragments", "ms", "bytes"))
+        for name, (plain, fragmented) in payloads.items():
+            for backend, encode in get_encoders().items():
+                for label, data in (("no", plain), ("yes", fragmented)):
+                    duration, size = measure(data, encode, options["iterations"])
+                    self.stdout.write("{0:<8} {1:<8} {2:<11} {3:>10.3f} {4:>10}".format(
+                        name, backend, label, duration, size))
@@ -0,0 +1,116 @@
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps, loads
+from time import monotonic, sleep
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.settings import BASE_DIR, CONFIG
+
+
+def request(base_url: str, path: str, data=None) -> dict:
+    body = dumps(data).encode("utf-8") if data is not None else None
+    headers = {"Content-Type": "application/json", "User-Agent": "bench_serving"}
+    with urlopen(Request(base_url + path, data=body, headers=headers), timeout=60) as response:
+        return loads(response.read())
+
+
+def run_flow(base_url: str, language: str) -> float:
+    """
+    One visitor: start, submit the first answer, vote, remark and load the answers again
+
+    Returns:
+      float: The duration in seconds
+    """
+    started = monotonic()
+    session = request(base_url, "/start/{0}/".format(language), {"referrer": None})
+    answers = [{"msgid": answer["msgid"], "important": False}
+               for answer in session["answers"][:1]]
+    result = request(base_url, "/submit/{0}/{1}/default/".format(language, session["token"]),
+                     {"answers": answers})
+    if result["selections"]:
+        request(base_url, "/vote/",
+                {"selection": result["selections"][0]["selection"], "positive": True})
+    request(base_url, "/remarks/", {"result": session["token"],
+                                    "sessionToken": session["sessionToken"], "remarks": "benchmark"})
+    request(base_url, "/answers/{0}/".format(session["token"]))
+    request(base_url, "/ssrdata/{0}/".format(language))
+    return monotonic() - started
+
+
+def load(base_url: str, language: str, concurrency: int, flows: int) -> dict:
+    durations = []
+    errors = 0
+    started = monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_flow, base_url, language) for _ in range(flows)]
+        for future in futures:
+            try:
+                durations.append(future.result())
+            except Exception:
+                errors = errors + 1
+    elapsed = monotonic() - started
+    durations.sort()
+
+    def percentile(share):
+        return durations[min(int(len(durations) * share), len(durations) - 1)] * 1000 if durations else 0
+    return {
+        "flows/s": len(durations) / elapsed,
+        "p50 ms": percentile(0.5),
+        "p95 ms": percentile(0.95),
+        "p99 ms": percentile(0.99),
+        "errors": errors
+    }
+
+
+class Command(BaseCommand):
+    help = "Compares the sync and the threaded gunicorn workers under concurrent visitor flows (use PostgreSQL, SQLite locks under concurrent writes)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default=None,
+                            help="Benchmark an already running server instead of starting gunicorn")
+        parser.add_argument("--language", default="en")
+        parser.add_argument("--concurrency", type=int, default=32)
+        parser.add_argument("--flows", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--threads", type=int, default=16,
+                            help="Threads per worker of the threaded profile")
+        parser.add_argument("--port", type=int, default=8765)
+
+    def handle(self, *args, **options):
+        if options["url"]:
+            results = {options["url"]: load(options["url"], options["language"],
+                                            options["concurrency"], options["flows"])}
+        else:
+            results = {}
+            for name, threads in [("sync", 1), ("gthread", options["threads"])]:
+                results[name] = self.run_profile(options, threads)
+        for name, result in results.items():
+            self.stdout.write("{0}: {1}".format(name, ", ".join(
+                "{0} {1:g}".format(key, round(value, 1)) for key, value in result.items())))
+
+    def run_profile(self, options, threads: int) -> dict:
+        base_url = "http://127.0.0.1:{0}".format(options["port"])
+        environment = dict(os.environ,
+                           GUNICORN_BIND="127.0.0.1:{0}".format(options["port"]),
+                           GUNICORN_WORKERS=str(options["workers"]),
+                           GUNICORN_THREADS=str(threads))
+        server = subprocess.Popen([sys.executable, "-m", "gunicorn", "backend.wsgi", "-c", "gunicorn.conf.py"],
+                                  cwd=BASE_DIR, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            ready_path = "/ready{0}/".format(CONFIG["backend"]["SUFFIX"])
+            for _ in range(100):
+                try:
+                    if request(base_url, ready_path)["ready"]:
+                        break
+                except Exception:
+                    sleep(0.1)
+            else:
+                raise CommandError("gunicorn did not get ready")
+            return load(base_url, options["language"], options["concurrency"], options["flows"])
+        finally:
+            server.terminate()
+            server.wait()
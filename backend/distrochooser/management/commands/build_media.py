@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from distrochooser import media
+
+
+class Command(BaseCommand):
+    help = "Builds the resized, content hashed variants of the logos and answer images"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true",
+                            help="Rebuild the variants of unchanged originals as well")
+
+    def handle(self, *args, **options):
+        if not media.is_supported():
+            raise CommandError("Building media variants needs Pillow to be installed")
+        built = media.build_all(options["force"])
+        for source, amount in built.items():
+            if options["verbosity"] > 1 or amount:
+                self.stdout.write("{0}: {1} variants".format(source, amount))
+        self.stdout.write("Checked {0} originals, formats: {1}".format(
+            len(built), ", ".join(media.get_formats())))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from distrochooser.constants import TRANSLATIONS
+
+
+class Command(BaseCommand):
+    help = "Parses the .po files into the compiled translation cache"
+
+    def handle(self, *args, **options):
+        locales = TRANSLATIONS.compile()
+        self.stdout.write("Compiled {0} locales into {1}".format(
+            len(locales), TRANSLATIONS.cache_dir))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from distrochooser import tasks
+
+
+class Command(BaseCommand):
+    help = "Computes answer co-occurrences and answer/distribution vote correlations"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--range-size", type=int, default=50000,
+                            help="Amount of session ids processed at once")
+        parser.add_argument("--min-sessions", type=int, default=10,
+                            help="Skip pairs seen in less sessions")
+        parser.add_argument("--enqueue", action="store_true",
+                            help="Leave the computation to manage.py run_tasks instead of computing now")
+
+    def handle(self, *args, **options):
+        if options["enqueue"]:
+            task = tasks.enqueue("compute_answer_analytics", {
+                "rangeSize": options["range_size"],
+                "minSessions": options["min_sessions"]
+            }, key="compute_answer_analytics")
+            self.stdout.write("Enqueued task {0}".format(task.pk))
+            return
+        try:
+            from distrochooser import analytics
+            import numpy
+            import scipy
+        except ImportError:
+            raise CommandError(
+                "The analytics need numpy and scipy, see requirements-analytics.txt")
+
+        def progress(last_id):
+            if options["verbosity"] > 1:
+                self.stdout.write("Processed sessions up to id {0}".format(last_id))
+
+        totals = analytics.compute(options["range_size"], progress)
+        cooccurrences, correlations = analytics.store(totals, options["min_sessions"])
+        self.stdout.write("Processed {0} sessions, stored {1} co-occurrences and {2} correlations".format(
+            totals.sessions, cooccurrences, correlations))
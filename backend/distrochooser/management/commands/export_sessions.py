@@ -0,0 +1,66 @@
+import sys
+from json import load, dump
+from os.path import exists
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from distrochooser.export import FORMATS, iter_records, write_jsonl, write_csv, write_parquet
+
+
+class Command(BaseCommand):
+    help = "Streams sessions including their answers and votes as JSONL, CSV or Parquet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=FORMATS.keys(), default="jsonl")
+        parser.add_argument("--output", default=None,
+                            help="The file to write, stdout if omitted (required for parquet)")
+        parser.add_argument("--after-id", type=int, default=None,
+                            help="Only export sessions with an id greater than this")
+        parser.add_argument("--since", default=None,
+                            help="Only export sessions created at or after this ISO 8601 timestamp")
+        parser.add_argument("--state-file", default=None,
+                            help="JSON file to continue from and to store the last exported id in")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        after_id = options["after_id"]
+        if options["state_file"] and exists(options["state_file"]) and after_id is None:
+            with open(options["state_file"], "r") as file:
+                after_id = load(file).get("lastId")
+        since = None
+        if options["since"]:
+            since = parse_datetime(options["since"])
+            if since is None:
+                raise CommandError("Invalid timestamp: {0}".format(options["since"]))
+
+        last = {"id": after_id, "count": 0}
+
+        def tracked(records):
+            for record in records:
+                last["id"] = record["id"]
+                last["count"] = last["count"] + 1
+                yield record
+
+        records = tracked(iter_records(after_id, since, options["chunk_size"]))
+        if options["format"] == "parquet":
+            if not options["output"]:
+                raise CommandError("Parquet exports need --output")
+            try:
+                write_parquet(records, options["output"], options["chunk_size"])
+            except ImportError:
+                raise CommandError("Parquet exports need pyarrow to be installed")
+        else:
+            writer = write_jsonl if options["format"] == "jsonl" else write_csv
+            output = open(options["output"], "wb") if options["output"] else sys.stdout.buffer
+            try:
+                for line in writer(records):
+                    output.write(line)
+            finally:
+                if options["output"]:
+                    output.close()
+
+        if options["state_file"]:
+            with open(options["state_file"], "w") as file:
+                dump({"lastId": last["id"]}, file)
+        self.stderr.write("Exported {0} sessions, last id: {1}".format(last["count"], last["id"]))
@@ -0,0 +1,53 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.settings import SESSION_RETENTION_DAYS, SESSION_PARTITION_MONTHS_AHEAD
+from distrochooser import partitioning
+from distrochooser.models import UserSession
+from distrochooser.retention import get_cutoff
+
+
+class Command(BaseCommand):
+    help = "Maintains the monthly partitions of the session tables (PostgreSQL only)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--convert", action="store_true",
+                            help="Convert the existing session tables into partitioned tables (one-time, locks the tables)")
+        parser.add_argument("--months-ahead", type=int, default=SESSION_PARTITION_MONTHS_AHEAD,
+                            help="Amount of future months to create partitions for")
+        parser.add_argument("--detach", action="store_true",
+                            help="Roll up and detach partitions older than the retention horizon")
+        parser.add_argument("--days", type=int, default=SESSION_RETENTION_DAYS,
+                            help="Retention horizon in days, used by --detach")
+        parser.add_argument("--drop", action="store_true",
+                            help="Drop detached partitions instead of keeping them for archival")
+
+    def handle(self, *args, **options):
+        if not partitioning.is_supported():
+            self.stdout.write(
+                "Partitioning needs PostgreSQL 11 or later, the session tables stay regular tables. Use prune_sessions instead.")
+            return
+
+        if options["convert"]:
+            converted = partitioning.convert(options["months_ahead"])
+            self.stdout.write("Converted {0}".format(", ".join(converted) or "nothing"))
+        else:
+            from django.db import connection
+            with connection.cursor() as cursor:
+                if not partitioning.is_partitioned(cursor, UserSession._meta.db_table):
+                    raise CommandError("The session tables are not partitioned yet, run with --convert first")
+
+        created = partitioning.create_future_partitions(
+            date.today().replace(day=1), options["months_ahead"])
+        self.stdout.write("Created {0} partitions".format(len(created)))
+
+        for table, (amount, oldest, newest) in partitioning.get_default_rows().items():
+            self.stderr.write(self.style.WARNING(
+                "{0} rows of {1} ({2} - {3}) are in the default partition, they are moved once the partitions of their months exist (--months-ahead)".format(
+                    amount, table, oldest, newest)))
+
+        if options["detach"]:
+            detached = partitioning.detach_partitions(
+                get_cutoff(options["days"]), drop=options["drop"])
+            self.stdout.write("Detached {0}".format(", ".join(detached) or "nothing"))
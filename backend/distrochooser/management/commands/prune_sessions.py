@@ -0,0 +1,51 @@
+from time import monotonic, sleep
+
+from django.core.management.base import BaseCommand
+
+from backend.settings import SESSION_RETENTION_DAYS
+from distrochooser import tasks
+from distrochooser.retention import get_cutoff, prune_chunk
+from distrochooser.sharding import fan_out
+
+
+class Command(BaseCommand):
+    help = "Rolls up and deletes sessions older than the retention horizon in small chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=SESSION_RETENTION_DAYS,
+                            help="Retention horizon in days")
+        parser.add_argument("--chunk-size", type=int, default=500,
+                            help="Sessions deleted per transaction")
+        parser.add_argument("--duty-cycle", type=float, default=0.5,
+                            help="Share of the runtime spent working, the rest is spent sleeping between chunks")
+        parser.add_argument("--max-chunks", type=int, default=0,
+                            help="Stop after this amount of chunks (0 = until done)")
+        parser.add_argument("--enqueue", action="store_true",
+                            help="Leave the pruning to manage.py run_tasks instead of pruning now")
+
+    def handle(self, *args, **options):
+        if options["enqueue"]:
+            task = tasks.enqueue("prune_sessions", {
+                "chunkSize": options["chunk_size"],
+                "days": options["days"]
+            }, key="prune_sessions")
+            self.stdout.write("Enqueued task {0}".format(task.pk))
+            return
+        cutoff = get_cutoff(options["days"])
+        duty_cycle = min(max(options["duty_cycle"], 0.01), 1)
+        chunks = 0
+        total = 0
+        while True:
+            started = monotonic()
+            pruned = sum(fan_out(lambda alias: prune_chunk(cutoff, options["chunk_size"], alias)))
+            if pruned == 0:
+                break
+            total = total + pruned
+            chunks = chunks + 1
+            if options["verbosity"] > 1:
+                self.stdout.write("Pruned {0} sessions".format(total))
+            if options["max_chunks"] and chunks >= options["max_chunks"]:
+                break
+            # throttle proportional to the time the chunk took, so it backs off under load
+            sleep((monotonic() - started) * (1 / duty_cycle - 1))
+        self.stdout.write("Pruned {0} sessions older than {1}".format(total, cutoff))
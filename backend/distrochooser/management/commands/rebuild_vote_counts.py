@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from distrochooser import tasks
+from distrochooser.votes import rebuild_counts
+
+
+class Command(BaseCommand):
+    help = "Recalculates the per-distribution vote counters out of the stored selections"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--enqueue", action="store_true",
+                            help="Leave the rebuild to manage.py run_tasks instead of rebuilding now")
+
+    def handle(self, *args, **options):
+        if options["enqueue"]:
+            task = tasks.enqueue("rebuild_vote_counts", key="rebuild_vote_counts")
+            self.stdout.write("Enqueued task {0}".format(task.pk))
+            return
+        count = rebuild_counts()
+        self.stdout.write("Rebuilt vote counters of {0} distributions".format(count))
@@ -0,0 +1,65 @@
+import signal
+from datetime import timedelta
+from time import monotonic, sleep
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils.timezone import now
+
+from backend.settings import TASK_BATCH_SIZE, TASK_LEASE, TASK_RETENTION_DAYS, TASK_SCHEDULE, \
+    STATS_REFRESH_INTERVAL
+from distrochooser import tasks, stats
+
+
+class Command(BaseCommand):
+    help = "Runs the queued background tasks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=TASK_BATCH_SIZE,
+                            help="Tasks claimed at once")
+        parser.add_argument("--lease", type=float, default=TASK_LEASE,
+                            help="Seconds until claimed tasks may be claimed by another runner")
+        parser.add_argument("--poll-interval", type=float, default=1,
+                            help="Seconds to wait while no task is due")
+        parser.add_argument("--once", action="store_true",
+                            help="Stop as soon as no task is due")
+        parser.add_argument("--max-batches", type=int, default=0,
+                            help="Stop after this amount of batches (0 = never)")
+
+    def handle(self, *args, **options):
+        self.is_stopping = False
+
+        def stop(signum, frame):
+            # the current batch is finished first
+            self.is_stopping = True
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        batches = 0
+        total = 0
+        last_prune = 0
+        last_schedule = 0
+        while not self.is_stopping:
+            close_old_connections()
+            if monotonic() - last_prune > 3600:
+                last_prune = monotonic()
+                tasks.delete_finished(now() - timedelta(days=TASK_RETENTION_DAYS))
+            if monotonic() - last_schedule > STATS_REFRESH_INTERVAL:
+                last_schedule = monotonic()
+                stats.schedule_refresh()
+                for name, interval in TASK_SCHEDULE.items():
+                    if interval:
+                        tasks.schedule(name, interval)
+            claimed = tasks.claim(options["batch_size"], options["lease"])
+            if not claimed:
+                if options["once"]:
+                    break
+                sleep(options["poll_interval"])
+                continue
+            total = total + tasks.run(claimed)
+            batches = batches + 1
+            if options["verbosity"] > 1:
+                self.stdout.write("Ran {0} tasks".format(total))
+            if options["max_batches"] and batches >= options["max_batches"]:
+                break
+        self.stdout.write("Ran {0} tasks successfully".format(total))
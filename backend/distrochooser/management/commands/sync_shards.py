@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from distrochooser.sharding import sync_all
+
+
+class Command(BaseCommand):
+    help = "Copies the questionnaire of the default database to the session shards"
+
+    def handle(self, *args, **options):
+        synced = sync_all()
+        for alias, copied in synced.items():
+            self.stdout.write("{0}: {1}".format(alias, ", ".join(
+                "{0} {1}".format(amount, label) for label, amount in copied.items())))
+        self.stdout.write("Synchronized {0} shards".format(len(synced)))
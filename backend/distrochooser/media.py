@@ -0,0 +1,260 @@
+"""
+Resized, content hashed variants of the distribution logos and answer images.
+
+manage.py build_media (and the build_media task, enqueued when a logo is
+saved) resizes each original to the MEDIA_VARIANT_WIDTHS and encodes it in each
+of the MEDIA_VARIANT_FORMATS the installed Pillow supports. The file names
+contain a hash of their source and content, so they never change their content,
+are never shared by two originals and can
+be served with a year-long, immutable cache lifetime (see get_media_variant in
+views.py). Unchanged originals are skipped by comparing their hash.
+
+Replaced variants (and the ones of removed originals) are marked as superseded
+instead of being deleted, as cached responses may still reference them. Their
+files are deleted by purge_superseded() once MEDIA_VARIANT_GRACE_PERIOD passed.
+
+The API references the variants by get_media(), as the src and the sources of
+a <picture> element. Answer images are taken from MEDIA_ROOT/img/<msgid>.png,
+the path the frontend uses for them.
+
+Needs Pillow (requirements-media.txt).
+"""
+
+import logging
+import os
+from datetime import timedelta
+from hashlib import sha256
+from importlib.util import find_spec
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.utils.timezone import now
+
+from backend.settings import MEDIA_VARIANT_WIDTHS, MEDIA_VARIANT_FORMATS, MEDIA_VARIANT_GRACE_PERIOD
+from distrochooser.cache import l1_cached, on_model_changed
+from distrochooser.models import MediaVariant, Distribution, Answer
+
+logger = logging.getLogger(__name__)
+
+# ordered by preference, the last one is supported by every client
+CONTENT_TYPES = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "png": "image/png"
+}
+
+# format -> keyword arguments of Image.save
+SAVE_OPTIONS = {
+    "avif": {"quality": 60},
+    "webp": {"quality": 80, "method": 6},
+    "png": {"optimize": True}
+}
+
+
+def is_supported() -> bool:
+    return find_spec("PIL") is not None
+
+
+def get_formats() -> list:
+    """
+    Get the configured formats the installed Pillow can write
+
+    Returns:
+      list: The formats, in the order of MEDIA_VARIANT_FORMATS
+    """
+    from PIL import features
+    return [format for format in MEDIA_VARIANT_FORMATS if format in CONTENT_TYPES and (format == "png" or features.check(format))]
+
+
+def get_answer_source(msgid: str) -> str:
+    return "img/{0}.png".format(msgid)
+
+
+def get_sources() -> list:
+    """
+    Get the originals existing below MEDIA_ROOT
+
+    Returns:
+      list: The paths relative to MEDIA_ROOT
+    """
+    sources = [logo for logo in Distribution.objects.exclude(logo="").exclude(
+        logo__isnull=True).values_list("logo", flat=True)]
+    for msgid in Answer.objects.filter(question__isMediaQuestion=True).values_list("msgid", flat=True):
+        sources.append(get_answer_source(msgid))
+    return [source for source in sources if default_storage.exists(source)]
+
+
+def get_variant_name(source: str, width: int, format: str, content: bytes) -> str:
+    stem = os.path.splitext(os.path.basename(source))[0]
+    # originals having the same stem (e. g. logos/debian.png and img/debian.png) must not share a file,
+    # a rebuild of one of them would delete it
+    digest = sha256(source.encode("utf-8"))
+    digest.update(content)
+    return "variants/{0}-{1}w.{2}.{3}".format(stem, width, digest.hexdigest()[:12], format)
+
+
+def build(source: str, force: bool = False) -> int:
+    """
+    Build the variants of an original, replacing the ones of a previous version
+
+    Args:
+      source (str): The path of the original, relative to MEDIA_ROOT
+      force (bool): Build the variants even if the original didn't change
+
+    Returns:
+      int: The amount of variants built, 0 if they were up to date or the original isn't an image Pillow can read
+    """
+    from PIL import Image
+
+    with default_storage.open(source, "rb") as file:
+        original = file.read()
+    source_hash = sha256(original).hexdigest()
+    existing = MediaVariant.objects.filter(source=source, supersededAt__isnull=True)
+    if not force and existing.exists() and not existing.exclude(sourceHash=source_hash).exists():
+        return 0
+    try:
+        image = Image.open(BytesIO(original))
+        image.load()
+    except (OSError, SyntaxError):
+        # e. g. SVG logos, which are served as they are
+        logger.info("Skipping %s, it's no raster image", source)
+        return 0
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+
+    # smaller originals are not scaled up
+    widths = sorted(set(min(width, image.width) for width in MEDIA_VARIANT_WIDTHS))
+    variants = []
+    for width in widths:
+        height = max(round(image.height * width / image.width), 1)
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for format in get_formats():
+            buffer = BytesIO()
+            resized.save(buffer, format=format.upper(), **SAVE_OPTIONS[format])
+            content = buffer.getvalue()
+            name = get_variant_name(source, width, format, content)
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(content))
+            variants.append(MediaVariant(
+                source=source,
+                sourceHash=source_hash,
+                format=format,
+                width=width,
+                height=height,
+                name=name,
+                size=len(content)
+            ))
+
+    with transaction.atomic():
+        # identical contents keep their name, so the row is replaced and the file stays
+        MediaVariant.objects.filter(name__in=[variant.name for variant in variants]).delete()
+        existing.update(supersededAt=now())
+        MediaVariant.objects.bulk_create(variants)
+        # neither update() nor bulk_create() send the signals the L1 cache listens to
+        on_model_changed(MediaVariant)
+    return len(variants)
+
+
+def build_all(force: bool = False) -> dict:
+    """
+    Build the variants of all originals, supersede the variants of removed ones and purge the expired ones
+
+    Returns:
+      dict: source -> amount of variants built
+    """
+    sources = get_sources()
+    built = {source: build(source, force) for source in sources}
+    if MediaVariant.objects.exclude(source__in=sources).filter(supersededAt__isnull=True).update(supersededAt=now()):
+        on_model_changed(MediaVariant)
+    purge_superseded()
+    return built
+
+
+def purge_superseded(grace_period: float = MEDIA_VARIANT_GRACE_PERIOD) -> int:
+    """
+    Delete the variants which were superseded longer than the grace period ago, including their files
+
+    Args:
+      grace_period (float): Seconds a superseded variant is kept
+
+    Returns:
+      int: The amount of variants deleted
+    """
+    expired = MediaVariant.objects.filter(supersededAt__lt=now() - timedelta(seconds=grace_period))
+    names = list(expired.values_list("name", flat=True))
+    for name in names:
+        default_storage.delete(name)
+    MediaVariant.objects.filter(name__in=names).delete()
+    return len(names)
+
+
+@l1_cached(MediaVariant)
+def get_media_index() -> dict:
+    """
+    Get the references of all variants
+
+    Returns:
+      dict: source -> the result of get_media(), must not be modified
+    """
+    variants = {}
+    for variant in MediaVariant.objects.filter(supersededAt__isnull=True).order_by("source", "width"):
+        variants.setdefault(variant.source, []).append(variant)
+    index = {}
+    for source, source_variants in variants.items():
+        sources = []
+        for format in CONTENT_TYPES:
+            srcset = ", ".join("{0} {1}w".format(default_storage.url(variant.name), variant.width)
+                               for variant in source_variants if variant.format == format)
+            if srcset:
+                sources.append({
+                    "type": CONTENT_TYPES[format],
+                    "srcset": srcset
+                })
+        # the largest variant of the most compatible format (e. g. png) is the fallback
+        formats = [format for format in CONTENT_TYPES if any(variant.format == format for variant in source_variants)]
+        fallback = [variant for variant in source_variants if variant.format == formats[-1]][-1]
+        index[source] = {
+            "src": default_storage.url(fallback.name),
+            "width": fallback.width,
+            "height": fallback.height,
+            "sources": sources
+        }
+    return index
+
+
+def get_media(source: str, fallback: bool = True) -> dict:
+    """
+    Get the references of the variants of an original, to be used as <picture> element
+
+    Args:
+      source (str): The path of the original, relative to MEDIA_ROOT
+      fallback (bool): Reference the original if there are no variants
+
+    Returns:
+      dict: src (and its width and height) and the sources by type, None if there is nothing to reference
+    """
+    if not source:
+        return None
+    media = get_media_index().get(source)
+    if media is None and fallback:
+        media = {
+            "src": default_storage.url(source),
+            "width": None,
+            "height": None,
+            "sources": []
+        }
+    return media
+
+
+def on_distribution_saved(sender, instance, **kwargs):
+    if not instance.logo or not is_supported():
+        return
+    from distrochooser import tasks
+    source = instance.logo.name
+    transaction.on_commit(lambda: tasks.enqueue("build_media", {"source": source}, key="build_media:{0}".format(source)))
+
+
+post_save.connect(on_distribution_saved, sender=Distribution, dispatch_uid="media_variants")
@@ -0,0 +1,34 @@
+"""
+Runtime metrics of the worker.
+
+Subsystems register a provider returning a dictionary of their current numbers,
+the /metrics<suffix>/ endpoint returns all of them.
+"""
+
+import os
+
+PROVIDERS = {}
+
+
+def register(name: str, provider):
+    """
+    Register a metrics provider
+
+    Args:
+      name (str): The key of the metrics in the response
+      provider (callable): Returns a JSON serializable dictionary
+    """
+    PROVIDERS[name] = provider
+
+
+def collect() -> dict:
+    """
+    Collect the metrics of all providers
+
+    Returns:
+      dict: The metrics of this worker, keyed by the provider name
+    """
+    metrics = {"pid": os.getpid()}
+    for name, provider in PROVIDERS.items():
+        metrics[name] = provider()
+    return metrics
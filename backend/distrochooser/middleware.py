@@ -0,0 +1,108 @@
+"""
+Route-aware middleware profiles.
+
+The public API views are csrf_exempt, keep their state in their own tokens and
+don't translate anything through Django, so the stateful middleware (locale,
+sessions, CSRF, authentication, messages, clickjacking) is pure overhead for
+them. The middleware classes of this module are subclasses of Django's ones,
+which only run for the FULL_STACK_ROUTES (the admin and the staff pages) and
+pass all other requests through untouched. Being subclasses, Django's system
+checks (e. g. of the admin) still find them.
+
+Requests of unknown routes (404) get the full stack, so nothing changes for
+pages this module doesn't know about.
+"""
+
+from django.contrib.auth import middleware as auth
+from django.contrib.messages import middleware as messages
+from django.contrib.sessions import middleware as sessions
+from django.middleware import clickjacking, csrf, locale
+from django.urls import resolve, Resolver404
+
+from backend.settings import FULL_STACK_ROUTES
+from distrochooser import metrics
+
+STATS = {
+    "full": 0,
+    "lean": 0
+}
+
+
+def get_route(request):
+    """
+    Resolve the route of a request, once per request
+
+    Returns:
+      ResolverMatch: The route, None if the path is unknown
+    """
+    if not hasattr(request, "_route"):
+        try:
+            request._route = resolve(request.path_info)
+        except Resolver404:
+            request._route = None
+    return request._route
+
+
+def is_full_stack(request) -> bool:
+    """
+    Check if a request runs through the stateful middleware
+
+    Returns:
+      bool: True for the FULL_STACK_ROUTES (by URL name or namespace) and unknown paths
+    """
+    if not hasattr(request, "_is_full_stack"):
+        route = get_route(request)
+        request._is_full_stack = route is None or route.url_name in FULL_STACK_ROUTES or any(
+            namespace in FULL_STACK_ROUTES for namespace in route.namespaces)
+        STATS["full" if request._is_full_stack else "lean"] += 1
+    return request._is_full_stack
+
+
+def full_stack_only(middleware_class):
+    """
+    Create a subclass of a middleware which skips the requests of the lean routes
+
+    Args:
+      middleware_class (type): A middleware based on MiddlewareMixin
+
+    Returns:
+      type: The subclass
+    """
+    def __call__(self, request):
+        if not is_full_stack(request):
+            return self.get_response(request)
+        return middleware_class.__call__(self, request)
+    attributes = {
+        "__call__": __call__,
+        "__module__": __name__,
+        "__doc__": "{0}, only for the FULL_STACK_ROUTES".format(middleware_class.__name__)
+    }
+
+    # the view hooks are collected by the handler, they have to be skipped as well
+    def wrap(name):
+        hook = getattr(middleware_class, name)
+
+        def skipped(self, request, *args, **kwargs):
+            if not is_full_stack(request):
+                return None
+            return hook(self, request, *args, **kwargs)
+        return skipped
+    for name in ("process_view", "process_exception", "process_template_response"):
+        if hasattr(middleware_class, name):
+            attributes[name] = wrap(name)
+    return type(middleware_class.__name__, (middleware_class,), attributes)
+
+
+LocaleMiddleware = full_stack_only(locale.LocaleMiddleware)
+SessionMiddleware = full_stack_only(sessions.SessionMiddleware)
+CsrfViewMiddleware = full_stack_only(csrf.CsrfViewMiddleware)
+AuthenticationMiddleware = full_stack_only(auth.AuthenticationMiddleware)
+MessageMiddleware = full_stack_only(messages.MessageMiddleware)
+XFrameOptionsMiddleware = full_stack_only(clickjacking.XFrameOptionsMiddleware)
+
+
+def get_metrics() -> dict:
+    return dict(STATS)
+
+
+metrics.register("middleware", get_metrics)
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 07:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distrochooser', '0060_answer_orderindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistributionVoteCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upvotes', models.IntegerField(default=0)),
+                ('downvotes', models.IntegerField(default=0)),
+                ('distro', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='voteCount', to='distrochooser.Distribution')),
+            ],
+        ),
+    ]
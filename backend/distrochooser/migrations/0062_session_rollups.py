@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-19 07:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distrochooser', '0061_distributionvotecount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferrerRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.CharField(max_length=255, unique=True)),
+                ('amount', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SessionRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('language', models.CharField(default='en', max_length=10)),
+                ('sessions', models.IntegerField(default=0)),
+                ('testedSessions', models.IntegerField(default=0)),
+                ('calculatedSessions', models.IntegerField(default=0)),
+                ('calculationTime', models.BigIntegerField(default=0)),
+                ('stayTime', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='usersession',
+            index=models.Index(fields=['dateTime'], name='distrochoos_dateTim_875995_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='sessionrollup',
+            unique_together={('day', 'language')},
+        ),
+    ]
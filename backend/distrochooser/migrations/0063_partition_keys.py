@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-19 07:57
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distrochooser', '0062_session_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='givenanswer',
+            name='dateTime',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='resultdistroselection',
+            name='dateTime',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='selectionreason',
+            name='dateTime',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 2.2.28 on 2026-10-19 07:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distrochooser', '0063_partition_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerDistroCorrelation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('approvals', models.IntegerField(default=0)),
+                ('disapprovals', models.IntegerField(default=0)),
+                ('approvalRate', models.FloatField(default=0)),
+                ('correlation', models.FloatField(default=0)),
+                ('answer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='distrochooser.Answer')),
+                ('distro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='distrochooser.Distribution')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AnswerCooccurrence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sessions', models.IntegerField(default=0)),
+                ('lift', models.FloatField(default=0)),
+                ('answer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cooccurrences', to='distrochooser.Answer')),
+                ('otherAnswer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='distrochooser.Answer')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='answerdistrocorrelation',
+            index=models.Index(fields=['answer'], name='distrochoos_answer__542db4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='answerdistrocorrelation',
+            index=models.Index(fields=['distro'], name='distrochoos_distro__6486e3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='answercooccurrence',
+            index=models.Index(fields=['answer'], name='distrochoos_answer__e5e18c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='answercooccurrence',
+            index=models.Index(fields=['lift'], name='distrochoos_lift_e28ab8_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distrochooser', '0064_answer_analytics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersession',
+            name='submissionHash',
+            field=models.CharField(blank=True, default=None, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 2.2.28 on 2026-10-19 08:15
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distrochooser', '0065_submission_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('key', models.CharField(blank=True, default=None, max_length=200, null=True)),
+                ('payload', models.TextField(default='null')),
+                ('result', models.TextField(blank=True, default=None, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('maxAttempts', models.IntegerField(default=5)),
+                ('runAfter', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lockedUntil', models.DateTimeField(blank=True, default=None, null=True)),
+                ('createdAt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finishedAt', models.DateTimeField(blank=True, default=None, null=True)),
+                ('lastError', models.TextField(blank=True, default=None, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'runAfter'], name='distrochoos_status_80c77d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['name', 'status'], name='distrochoos_name_5abe4f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['key'], name='distrochoos_key_6cfc24_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-19 08:23
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distrochooser', '0067_cache_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaVariant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=300)),
+                ('sourceHash', models.CharField(max_length=64)),
+                ('format', models.CharField(max_length=10)),
+                ('width', models.IntegerField()),
+                ('height', models.IntegerField()),
+                ('name', models.CharField(max_length=300, unique=True)),
+                ('size', models.IntegerField(default=0)),
+                ('createdAt', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='mediavariant',
+            index=models.Index(fields=['source'], name='distrochoos_source_8b70d9_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='mediavariant',
+            unique_together={('source', 'format', 'width')},
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distrochooser', '0068_media_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='distributionvotecount',
+            name='prunedDownvotes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='distributionvotecount',
+            name='prunedUpvotes',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-19 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('distrochooser', '0069_pruned_vote_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediavariant',
+            name='supersededAt',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='mediavariant',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='mediavariant',
+            constraint=models.UniqueConstraint(condition=models.Q(supersededAt__isnull=True), fields=('source', 'format', 'width'), name='mediavariant_current_unique'),
+        ),
+    ]
@@ -56,6 +56,7 @@ class UserSession(models.Model):
         indexes = [
             models.Index(fields=['token']),
             models.Index(fields=['publicUrl']),
+            models.Index(fields=['dateTime']),
         ]
     dateTime = models.DateTimeField(default=now)
     userAgent = models.CharField(
@@ -79,6 +80,9 @@ class UserSession(models.Model):
     calculationEndTime = models.DateTimeField(
         null=True, blank=True, default=None)
     remarksProcessed = models.BooleanField(default=False)
+    # identifies the last submission (Idempotency-Key or hash of the answers), so retries return the stored result
+    submissionHash = models.CharField(
+        max_length=64, null=True, blank=True, default=None)
 
     def __str__(self):
         return "{0} - {1}".format(self.dateTime, self.publicUrl)
@@ -99,6 +103,8 @@ class GivenAnswer(models.Model):
         UserSession, on_delete=models.CASCADE, db_index=True)
     answer = models.ForeignKey(Answer, on_delete=models.CASCADE, default=None)
     isImportant = models.BooleanField(default=False)
+    # copy of the session's dateTime, used as partition key
+    dateTime = models.DateTimeField(default=now)
 
     def __str__(self):
         return "{0}: {1}".format(self.session, self.answer)
@@ -135,6 +141,8 @@ class ResultDistroSelection(models.Model):
         UserSession, on_delete=models.CASCADE, default=None, db_index=True)
     isApprovedByUser = models.BooleanField(default=False)
     isDisApprovedByUser = models.BooleanField(default=False)
+    # copy of the session's dateTime, used as partition key
+    dateTime = models.DateTimeField(default=now)
 
     def __str__(self):
         return "{0:} {1}".format(self.session, self.distro)
@@ -155,6 +163,8 @@ class SelectionReason(models.Model):
     isNeutralHit = models.BooleanField(default=False)
     # if answer was flagged as important
     isImportant = models.BooleanField(default=False)
+    # copy of the session's dateTime, used as partition key
+    dateTime = models.DateTimeField(default=now)
 
     def __str__(self):
         return "{0}: P{1}-B{2}-RB{3}-N{4}-I{5}".format(self.description, self.isPositiveHit, self.isBlockingHit, self.isRelatedBlocked, self.isNeutralHit, self.isImportant)
@@ -176,3 +186,198 @@ class AnswerDistributionMatrix(models.Model):
 
     def __str__(self):
         return "Blocking: {0}, Negative: {1}, Neutral: {2}, {3} ({4})".format(self.isBlockingHit, self.isNegativeHit, self.isNeutralHit, self.answer, self.distros.all().values_list("name", flat=True))
+
+
+class DistributionVoteCount(models.Model):
+    """
+    Denormalized up-/downvote counters of a distribution, maintained by the vote buffer
+    """
+    distro = models.OneToOneField(
+        Distribution, on_delete=models.CASCADE, related_name="voteCount")
+    upvotes = models.IntegerField(default=0)
+    downvotes = models.IntegerField(default=0)
+    # the part of the counters belonging to pruned sessions, kept by rebuild_counts
+    prunedUpvotes = models.IntegerField(default=0)
+    prunedDownvotes = models.IntegerField(default=0)
+
+    @property
+    def upvote_percentage(self) -> float:
+        total = self.upvotes + self.downvotes
+        return round(self.upvotes / total, 2) if total > 0 else 0
+
+    @property
+    def downvote_percentage(self) -> float:
+        total = self.upvotes + self.downvotes
+        return round(self.downvotes / total, 2) if total > 0 else 0
+
+    def as_dict(self) -> dict:
+        return {
+            "upvotes": self.upvotes,
+            "downvotes": self.downvotes,
+            "upvote_percentage": self.upvote_percentage,
+            "downvote_percentage": self.downvote_percentage
+        }
+
+    def __str__(self):
+        return "{0}: +{1} -{2}".format(self.distro, self.upvotes, self.downvotes)
+
+
+
+class SessionRollup(models.Model):
+    """
+    Aggregated numbers of pruned sessions, one row per day and language
+    """
+    class Meta():
+        unique_together = [['day', 'language']]
+    day = models.DateField()
+    language = models.CharField(
+        max_length=10, null=False, blank=False, default="en")
+    sessions = models.IntegerField(default=0)
+    # sessions having at least one result selection
+    testedSessions = models.IntegerField(default=0)
+    # sessions having a calculation time and end time, used for averages
+    calculatedSessions = models.IntegerField(default=0)
+    calculationTime = models.BigIntegerField(default=0)
+    stayTime = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return "{0} ({1}): {2}".format(self.day, self.language, self.sessions)
+
+
+class ReferrerRollup(models.Model):
+    """
+    Aggregated referrer hosts of pruned sessions
+    """
+    host = models.CharField(max_length=255, unique=True)
+    amount = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "{0}: {1}".format(self.host, self.amount)
+
+
+
+class AnswerCooccurrence(models.Model):
+    """
+    How often two answers are given together, computed by manage.py compute_answer_analytics
+    """
+    class Meta():
+        indexes = [
+            models.Index(fields=['answer']),
+            models.Index(fields=['lift']),
+        ]
+    answer = models.ForeignKey(
+        Answer, on_delete=models.CASCADE, related_name="cooccurrences")
+    otherAnswer = models.ForeignKey(
+        Answer, on_delete=models.CASCADE, related_name="+")
+    sessions = models.IntegerField(default=0)
+    # > 1: given together more often than expected by chance
+    lift = models.FloatField(default=0)
+
+    def __str__(self):
+        return "{0} + {1}: {2} ({3:.2f})".format(self.answer.msgid, self.otherAnswer.msgid, self.sessions, self.lift)
+
+
+class AnswerDistroCorrelation(models.Model):
+    """
+    How the users giving an answer voted a distribution, computed by manage.py compute_answer_analytics
+    """
+    class Meta():
+        indexes = [
+            models.Index(fields=['answer']),
+            models.Index(fields=['distro']),
+        ]
+    answer = models.ForeignKey(Answer, on_delete=models.CASCADE)
+    distro = models.ForeignKey(Distribution, on_delete=models.CASCADE)
+    approvals = models.IntegerField(default=0)
+    disapprovals = models.IntegerField(default=0)
+    approvalRate = models.FloatField(default=0)
+    # phi coefficient between giving the answer and upvoting the distribution
+    correlation = models.FloatField(default=0)
+
+    def __str__(self):
+        return "{0} -> {1}: {2:.2f}".format(self.answer.msgid, self.distro, self.correlation)
+
+
+class Task(models.Model):
+    """
+    Deferred work, processed by manage.py run_tasks (see distrochooser/tasks.py)
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed")
+    ]
+
+    class Meta():
+        indexes = [
+            models.Index(fields=['status', 'runAfter']),
+            models.Index(fields=['name', 'status']),
+            models.Index(fields=['key']),
+        ]
+    name = models.CharField(max_length=100)
+    # pending tasks having the same key are enqueued only once
+    key = models.CharField(
+        max_length=200, null=True, blank=True, default=None)
+    payload = models.TextField(default="null")
+    result = models.TextField(null=True, blank=True, default=None)
+    status = models.CharField(
+        max_length=10, choices=STATES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    maxAttempts = models.IntegerField(default=5)
+    runAfter = models.DateTimeField(default=now)
+    # a running task whose lease expired is picked up again (e. g. after a crash of the runner)
+    lockedUntil = models.DateTimeField(null=True, blank=True, default=None)
+    createdAt = models.DateTimeField(default=now)
+    finishedAt = models.DateTimeField(null=True, blank=True, default=None)
+    lastError = models.TextField(null=True, blank=True, default=None)
+
+    def __str__(self):
+        return "{0} ({1}, {2} attempts)".format(self.name, self.status, self.attempts)
+
+
+class CacheVersion(models.Model):
+    """
+    Version of the in-process caches derived from a model (see distrochooser/invalidation.py)
+    """
+    tag = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField(default=0)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{0} (version {1})".format(self.tag, self.version)
+
+
+class MediaVariant(models.Model):
+    """
+    A resized copy of a logo or answer image, built by manage.py build_media (see distrochooser/media.py)
+    """
+    class Meta():
+        constraints = [
+            # superseded variants are kept for a grace period next to the current ones
+            models.UniqueConstraint(fields=['source', 'format', 'width'], condition=models.Q(
+                supersededAt__isnull=True), name='mediavariant_current_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['source']),
+        ]
+    # path of the original, relative to MEDIA_ROOT
+    source = models.CharField(max_length=300)
+    # sha256 of the original the variant was built from
+    sourceHash = models.CharField(max_length=64)
+    format = models.CharField(max_length=10)
+    width = models.IntegerField()
+    height = models.IntegerField()
+    # content hashed path, relative to MEDIA_ROOT
+    name = models.CharField(max_length=300, unique=True)
+    size = models.IntegerField(default=0)
+    createdAt = models.DateTimeField(default=now)
+    # set when a rebuild replaced the variant, the file is deleted after MEDIA_VARIANT_GRACE_PERIOD
+    supersededAt = models.DateTimeField(null=True, blank=True, default=None)
+
+    def __str__(self):
+        return self.name
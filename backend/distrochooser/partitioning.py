@@ -0,0 +1,325 @@
+"""
+Monthly range partitioning of the session tables (PostgreSQL 11 and later).
+
+UserSession and its children are partitioned by their dateTime column, one
+partition per month, named <table>_pYYYYMM. The children carry a copy of the
+session's dateTime for this purpose. As PostgreSQL requires the partition key
+to be part of the primary key, the primary keys become (id, dateTime) and the
+foreign keys between the partitioned tables are dropped. The ORM keeps using
+the id column, so the queries of the views stay unchanged.
+
+Rows without a monthly partition (e. g. a dateTime beyond the months created in
+advance) land in the DEFAULT partition <table>_default. As PostgreSQL refuses
+to create a partition while the default partition holds rows of its range,
+create_partition() moves them into the new partition. manage.py
+partition_sessions reports the rows left in the default partitions.
+
+On other database vendors (e. g. SQLite in development setups) the tables stay
+regular tables and the retention (manage.py prune_sessions) takes care of them.
+"""
+
+from datetime import date, datetime, time
+
+from django.db import connection, transaction
+from django.utils.timezone import utc
+
+from distrochooser.models import UserSession, GivenAnswer, ResultDistroSelection, SelectionReason
+from distrochooser.retention import rollup_sessions
+
+# the order matters: children are filled by joining their already converted parent
+PARTITIONED_MODELS = [
+    UserSession,
+    ResultDistroSelection,
+    GivenAnswer,
+    SelectionReason
+]
+
+# child table -> (foreign key column, parent model) to take the dateTime from
+PARENT_KEYS = {
+    ResultDistroSelection: ("session_id", UserSession),
+    GivenAnswer: ("session_id", UserSession),
+    SelectionReason: ("resultSelection_id", ResultDistroSelection)
+}
+
+
+def is_supported() -> bool:
+    """
+    Check if the database supports declarative partitioning
+
+    Returns:
+      bool: True on PostgreSQL 11 and later
+    """
+    return connection.vendor == "postgresql" and connection.pg_version >= 110000
+
+
+def add_months(month: date, months: int) -> date:
+    """
+    Move the first day of a month by the given amount of months
+    """
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def get_partition_name(table: str, month: date) -> str:
+    return "{0}_p{1:04d}{2:02d}".format(table, month.year, month.month)
+
+
+def is_partitioned(cursor, table: str) -> bool:
+    cursor.execute(
+        "SELECT count(*) FROM pg_partitioned_table WHERE partrelid = %s::regclass", [table])
+    return cursor.fetchone()[0] > 0
+
+
+def get_partitions(cursor, table: str) -> list:
+    """
+    Get the monthly partitions of a table
+
+    Returns:
+      list: (name, month) tuples, ordered by month
+    """
+    cursor.execute("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+    """, [table])
+    partitions = []
+    prefix = table + "_p"
+    for name, in cursor.fetchall():
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and suffix.isdigit() and len(suffix) == 6:
+            partitions.append(
+                (name, date(int(suffix[:4]), int(suffix[4:]), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def get_default_partition(table: str) -> str:
+    return "{0}_default".format(table)
+
+
+def create_partition(cursor, table: str, month: date) -> bool:
+    """
+    Create the partition of a month if it's missing, moving its rows out of the default partition
+
+    Returns:
+      bool: True if the partition was created
+    """
+    name = get_partition_name(table, month)
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    if cursor.fetchone()[0] is not None:
+        return False
+    bounds = [month.isoformat(), add_months(month, 1).isoformat()]
+    default = get_default_partition(table)
+    cursor.execute("SELECT to_regclass(%s)", [default])
+    has_default = cursor.fetchone()[0] is not None
+    if has_default:
+        cursor.execute('SELECT count(*) FROM "{0}" WHERE "dateTime" >= %s AND "dateTime" < %s'.format(
+            default), bounds)
+        has_default = cursor.fetchone()[0] > 0
+    if not has_default:
+        cursor.execute('CREATE TABLE "{0}" PARTITION OF "{1}" FOR VALUES FROM (%s) TO (%s)'.format(
+            name, table), bounds)
+        return True
+
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s ORDER BY ordinal_position
+    """, [table])
+    column_list = ", ".join('"{0}"'.format(column) for column, in cursor.fetchall())
+    # the rows are invisible while the default partition is detached, so all of it happens in one transaction
+    with transaction.atomic():
+        cursor.execute('ALTER TABLE "{0}" DETACH PARTITION "{1}"'.format(table, default))
+        cursor.execute('CREATE TABLE "{0}" PARTITION OF "{1}" FOR VALUES FROM (%s) TO (%s)'.format(
+            name, table), bounds)
+        cursor.execute('INSERT INTO "{0}" ({1}) SELECT {1} FROM "{2}" WHERE "dateTime" >= %s AND "dateTime" < %s'.format(
+            name, column_list, default), bounds)
+        cursor.execute('DELETE FROM "{0}" WHERE "dateTime" >= %s AND "dateTime" < %s'.format(
+            default), bounds)
+        cursor.execute('ALTER TABLE "{0}" ATTACH PARTITION "{1}" DEFAULT'.format(table, default))
+    return True
+
+
+def get_default_rows() -> dict:
+    """
+    Count the rows of the default partitions, which have no monthly partition
+
+    Returns:
+      dict: table -> (amount of rows, oldest and newest dateTime), only tables having such rows
+    """
+    rows = {}
+    with connection.cursor() as cursor:
+        for model in PARTITIONED_MODELS:
+            default = get_default_partition(model._meta.db_table)
+            cursor.execute("SELECT to_regclass(%s)", [default])
+            if cursor.fetchone()[0] is None:
+                continue
+            cursor.execute('SELECT count(*), min("dateTime"), max("dateTime") FROM "{0}"'.format(default))
+            amount, oldest, newest = cursor.fetchone()
+            if amount:
+                rows[model._meta.db_table] = (amount, oldest, newest)
+    return rows
+
+
+def create_future_partitions(first_month: date, months_ahead: int) -> list:
+    """
+    Create the monthly partitions of all partitioned tables up to months_ahead
+
+    Args:
+      first_month (date): The first day of the first month needing a partition
+      months_ahead (int): The amount of months to create after the current one
+
+    Returns:
+      list: The names of the partitions created
+    """
+    created = []
+    last_month = add_months(date.today().replace(day=1), months_ahead)
+    with connection.cursor() as cursor:
+        for model in PARTITIONED_MODELS:
+            table = model._meta.db_table
+            month = first_month
+            while month <= last_month:
+                if create_partition(cursor, table, month):
+                    created.append(get_partition_name(table, month))
+                month = add_months(month, 1)
+    return created
+
+
+def detach_partitions(cutoff, drop: bool = False, chunk_size: int = 1000) -> list:
+    """
+    Detach (and optionally drop) the partitions of months ending before the cutoff.
+
+    The sessions of a month are rolled up into the rollup tables in the same
+    transaction as the detach, so /stats/ keeps counting them.
+
+    Args:
+      cutoff (datetime): Months ending before this are detached
+      drop (bool): Drop the detached tables instead of keeping them for archival
+      chunk_size (int): Amount of sessions rolled up at once
+
+    Returns:
+      list: The names of the detached partitions
+    """
+    detached = []
+    session_table = UserSession._meta.db_table
+    with connection.cursor() as cursor:
+        months = [month for name, month in get_partitions(
+            cursor, session_table) if add_months(month, 1) <= cutoff.date()]
+    for month in months:
+        with transaction.atomic(), connection.cursor() as cursor:
+            sessions = UserSession.objects.filter(
+                dateTime__gte=datetime.combine(month, time.min, tzinfo=utc),
+                dateTime__lt=datetime.combine(add_months(month, 1), time.min, tzinfo=utc)
+            ).order_by("pk").values_list("pk", flat=True)
+            chunk = []
+            for pk in sessions.iterator(chunk_size=chunk_size):
+                chunk.append(pk)
+                if len(chunk) == chunk_size:
+                    rollup_sessions(chunk)
+                    chunk = []
+            if chunk:
+                rollup_sessions(chunk)
+            for model in reversed(PARTITIONED_MODELS):
+                table = model._meta.db_table
+                name = get_partition_name(table, month)
+                cursor.execute("SELECT to_regclass(%s)", [name])
+                if cursor.fetchone()[0] is None:
+                    continue
+                cursor.execute('ALTER TABLE "{0}" DETACH PARTITION "{1}"'.format(
+                    table, name))
+                if drop:
+                    cursor.execute('DROP TABLE "{0}"'.format(name))
+                detached.append(name)
+    return detached
+
+
+def convert_table(cursor, model, months_ahead: int):
+    """
+    Replace a regular table by a partitioned one holding the same rows.
+
+    The legacy table is kept as <table>_legacy until everything is copied.
+    """
+    table = model._meta.db_table
+    legacy = table + "_legacy"
+    cursor.execute("""
+        SELECT conname, pg_get_constraintdef(oid), confrelid::regclass::text
+        FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'
+    """, [table])
+    foreign_keys = cursor.fetchall()
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", [table])
+    indexes = cursor.fetchall()
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s ORDER BY ordinal_position
+    """, [table])
+    columns = [column for column, in cursor.fetchall()]
+
+    cursor.execute('ALTER TABLE "{0}" RENAME TO "{1}"'.format(table, legacy))
+    cursor.execute('''
+        CREATE TABLE "{0}" (LIKE "{1}" INCLUDING DEFAULTS INCLUDING STORAGE)
+        PARTITION BY RANGE ("dateTime")
+    '''.format(table, legacy))
+    cursor.execute('ALTER TABLE "{0}" ADD PRIMARY KEY ("id", "dateTime")'.format(table))
+    cursor.execute('CREATE TABLE "{0}" PARTITION OF "{1}" DEFAULT'.format(get_default_partition(table), table))
+
+    cursor.execute('SELECT min("dateTime") FROM "{0}"'.format(
+        UserSession._meta.db_table if model is not UserSession else legacy))
+    oldest = cursor.fetchone()[0]
+    first_month = (oldest.date() if oldest else date.today()).replace(day=1)
+    last_month = add_months(date.today().replace(day=1), months_ahead)
+    month = first_month
+    while month <= last_month:
+        create_partition(cursor, table, month)
+        month = add_months(month, 1)
+
+    column_list = ", ".join('"{0}"'.format(column) for column in columns)
+    if model in PARENT_KEYS:
+        key, parent = PARENT_KEYS[model]
+        source_list = ", ".join('parent."dateTime"' if column == "dateTime" else 'legacy."{0}"'.format(
+            column) for column in columns)
+        cursor.execute('''
+            INSERT INTO "{0}" ({1}) SELECT {2} FROM "{3}" legacy
+            JOIN "{4}" parent ON parent."id" = legacy."{5}"
+        '''.format(table, column_list, source_list, legacy, parent._meta.db_table, key))
+    else:
+        cursor.execute('INSERT INTO "{0}" ({1}) SELECT {1} FROM "{2}"'.format(
+            table, column_list, legacy))
+
+    if sequence:
+        cursor.execute('ALTER SEQUENCE {0} OWNED BY "{1}"."id"'.format(
+            sequence, table))
+    cursor.execute('DROP TABLE "{0}" CASCADE'.format(legacy))
+
+    # the definitions were read before the rename, so they point to the new table
+    partitioned_tables = [partitioned._meta.db_table for partitioned in PARTITIONED_MODELS]
+    for name, definition in indexes:
+        if not name.endswith("_pkey"):
+            cursor.execute(definition)
+    for name, definition, referenced in foreign_keys:
+        # foreign keys to other partitioned tables would need the partition key
+        if referenced.strip('"') in partitioned_tables or referenced.strip('"') == legacy:
+            continue
+        cursor.execute('ALTER TABLE "{0}" ADD CONSTRAINT "{1}" {2}'.format(
+            table, name, definition))
+
+
+def convert(months_ahead: int) -> list:
+    """
+    Convert all session tables into partitioned tables, in one transaction
+
+    Args:
+      months_ahead (int): The amount of months to create partitions for in advance
+
+    Returns:
+      list: The tables converted
+    """
+    converted = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in PARTITIONED_MODELS:
+            table = model._meta.db_table
+            if not is_partitioned(cursor, table):
+                convert_table(cursor, model, months_ahead)
+                converted.append(table)
+    return converted
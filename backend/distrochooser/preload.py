@@ -0,0 +1,37 @@
+"""
+Building the immutable datasets in the gunicorn master.
+
+With preload_app enabled (see gunicorn.conf.py), the master loads the
+application and calls preload() before forking the workers. The translations
+and reason tables built here are then shared copy-on-write by all workers.
+gc.freeze() moves them out of the garbage collector's reach, as a collection
+would otherwise touch (and thereby copy) every page holding them.
+"""
+
+import gc
+
+from django.db import connections
+
+from distrochooser import invalidation
+from distrochooser.constants import TRANSLATIONS
+from distrochooser.calculations import default
+from distrochooser.db.pool import close_pools
+
+
+def preload():
+    """
+    Load all translations and reason tables, then freeze the heap. Call it once, before forking.
+    """
+    # the reason tables are keyed on the cache versions, the listener is started by each worker
+    invalidation.load()
+    for locale in TRANSLATIONS:
+        TRANSLATIONS[locale]
+    for locale in TRANSLATIONS:
+        default.getReasonTable(locale)
+    # the workers must not share the connections of the master
+    connections.close_all()
+    close_pools()
+    gc.collect()
+    # gc.freeze is available as of Python 3.7
+    if hasattr(gc, "freeze"):
+        gc.freeze()
@@ -0,0 +1,119 @@
+"""
+Retention of session data.
+
+Old sessions are rolled up into SessionRollup/ReferrerRollup (their votes into the
+pruned counters of DistributionVoteCount) and deleted afterwards.
+Each chunk is rolled up and deleted in one transaction (per database if the
+sessions are sharded), so an interrupted run can simply be started again. The children are deleted bottom-up with raw
+deletes, which keeps Django from loading the cascaded rows into memory.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction, router
+from django.db.models import F, Sum, Case, When, IntegerField
+from django.utils.timezone import now
+
+from distrochooser.models import UserSession, GivenAnswer, ResultDistroSelection, SelectionReason, SessionRollup, ReferrerRollup, DistributionVoteCount
+from distrochooser.util import get_referrer_host
+
+
+def get_cutoff(days: int):
+    """
+    Get the point in time before which sessions are pruned
+
+    Args:
+      days (int): The retention horizon in days
+
+    Returns:
+      datetime: The cutoff
+    """
+    return now() - timedelta(days=days)
+
+
+def _increment(model, lookup: dict, values: dict):
+    """
+    Add the given values to the row identified by lookup, creating it if needed
+    """
+    model.objects.get_or_create(**lookup)
+    model.objects.filter(**lookup).update(
+        **{key: F(key) + value for key, value in values.items()})
+
+
+def rollup_sessions(session_ids: list, using: str = None):
+    """
+    Add the numbers of the given sessions to the rollup tables (of the default database)
+
+    Args:
+      session_ids (list): The primary keys of the sessions
+      using (str): The database alias of the sessions
+    """
+    tested = set(ResultDistroSelection.objects.using(using).filter(
+        session_id__in=session_ids).values_list("session_id", flat=True).distinct())
+    days = defaultdict(lambda: defaultdict(int))
+    referrers = defaultdict(int)
+    sessions = UserSession.objects.using(using).filter(pk__in=session_ids).values_list(
+        "pk", "dateTime", "language", "referrer", "calculationTime", "calculationEndTime")
+    for pk, date_time, language, referrer, calculation_time, calculation_end_time in sessions:
+        day = days[(date_time.date(), language)]
+        day["sessions"] += 1
+        day["testedSessions"] += int(pk in tested)
+        if calculation_time > 0 and calculation_end_time:
+            day["calculatedSessions"] += 1
+            day["calculationTime"] += calculation_time
+            day["stayTime"] += (calculation_end_time - date_time).seconds
+        host = get_referrer_host(referrer)
+        if host:
+            referrers[host[:255]] += 1
+
+    for (day, language), values in days.items():
+        _increment(SessionRollup, {"day": day, "language": language}, values)
+    for host, amount in referrers.items():
+        _increment(ReferrerRollup, {"host": host}, {"amount": amount})
+
+    # the live counters already contain these votes, they only have to survive rebuild_counts()
+    votes = ResultDistroSelection.objects.using(using).filter(session_id__in=session_ids).values("distro_id").annotate(
+        upvotes=Sum(Case(When(isApprovedByUser=True, then=1), default=0, output_field=IntegerField())),
+        downvotes=Sum(Case(When(isDisApprovedByUser=True, then=1), default=0, output_field=IntegerField())))
+    for vote in votes:
+        if vote["upvotes"] or vote["downvotes"]:
+            _increment(DistributionVoteCount, {"distro_id": vote["distro_id"]}, {
+                       "prunedUpvotes": vote["upvotes"], "prunedDownvotes": vote["downvotes"]})
+
+
+def delete_sessions(session_ids: list, using: str = None):
+    """
+    Delete the given sessions including their children without collecting them in memory
+
+    Args:
+      session_ids (list): The primary keys of the sessions
+      using (str): The database alias, None to let the routers choose
+    """
+    using = using or router.db_for_write(UserSession)
+    selections = ResultDistroSelection.objects.filter(session_id__in=session_ids)
+    SelectionReason.objects.filter(resultSelection__in=selections)._raw_delete(using)
+    selections._raw_delete(using)
+    GivenAnswer.objects.filter(session_id__in=session_ids)._raw_delete(using)
+    UserSession.objects.filter(pk__in=session_ids)._raw_delete(using)
+
+
+def prune_chunk(cutoff, chunk_size: int, using: str = None) -> int:
+    """
+    Roll up and delete the oldest sessions created before the cutoff
+
+    Args:
+      cutoff (datetime): Sessions older than this are pruned
+      chunk_size (int): The maximum amount of sessions to prune
+      using (str): The database alias of the sessions
+
+    Returns:
+      int: The amount of sessions pruned, 0 if nothing is left
+    """
+    with transaction.atomic(), transaction.atomic(using=using):
+        session_ids = list(UserSession.objects.using(using).filter(dateTime__lt=cutoff).order_by(
+            "dateTime").values_list("pk", flat=True)[:chunk_size])
+        if session_ids:
+            rollup_sessions(session_ids, using)
+            delete_sessions(session_ids, using)
+    return len(session_ids)
@@ -0,0 +1,214 @@
+"""
+Routing of read-only requests to database replicas.
+
+Only the views decorated with use_replica() read from a replica, everything
+else (including the reads of start/submit/vote) keeps using the primary. Within
+a decorated view, reads go to the primary again as soon as something was written.
+
+A session token written within the last REPLICA_STICKY_SECONDS is served from
+the primary (read-your-writes), as the replica might not have the new rows yet.
+The marks are kept in the default cache, which has to be shared by all workers
+(e. g. redis) to make this work across workers.
+
+Replicas are checked at most every REPLICA_CHECK_INTERVAL seconds per worker.
+Unreachable replicas and replicas lagging behind for more than REPLICA_MAX_LAG
+seconds are skipped until the next check, if none is left the primary is used.
+"""
+
+import logging
+import random
+from functools import wraps
+from threading import local
+from time import monotonic
+
+from django.core.cache import cache
+from django.db import connections, DEFAULT_DB_ALIAS, OperationalError, InterfaceError
+
+from backend.settings import DATABASE_REPLICAS, REPLICA_MAX_LAG, REPLICA_STICKY_SECONDS, REPLICA_CHECK_INTERVAL
+from distrochooser import metrics
+
+logger = logging.getLogger(__name__)
+
+STATE = local()
+
+# alias -> {"checked": monotonic(), "healthy": bool, "lag": seconds}
+HEALTH = {}
+
+STATS = {
+    "replicaRequests": 0,
+    "primaryRequests": 0,
+    "stickyRequests": 0,
+    "fallbacks": 0
+}
+
+LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class ReplicaRouter:
+    """
+    Enabled by backend/settings.py if DATABASE_REPLICAS is configured
+    """
+
+    def db_for_read(self, model, **hints):
+        if getattr(STATE, "pinned", False):
+            return DEFAULT_DB_ALIAS
+        return getattr(STATE, "replica", None)
+
+    def db_for_write(self, model, **hints):
+        # read the own writes for the rest of the request
+        STATE.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # all databases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in DATABASE_REPLICAS
+
+
+def get_lag(alias: str) -> float:
+    """
+    Get the replication lag of a replica
+
+    Args:
+      alias (str): The database alias of the replica
+
+    Returns:
+      float: The lag in seconds, 0 for vendors which can't report it (e. g. SQLite)
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor != "postgresql":
+            cursor.execute("SELECT 1")
+            return 0
+        cursor.execute(LAG_QUERY)
+        return float(cursor.fetchone()[0])
+
+
+def is_healthy(alias: str) -> bool:
+    """
+    Check if a replica is reachable and up to date, reusing the last result within REPLICA_CHECK_INTERVAL
+
+    Args:
+      alias (str): The database alias of the replica
+
+    Returns:
+      bool: True if the replica can serve reads
+    """
+    health = HEALTH.get(alias)
+    if health and monotonic() - health["checked"] < REPLICA_CHECK_INTERVAL:
+        return health["healthy"]
+    try:
+        lag = get_lag(alias)
+        healthy = lag <= REPLICA_MAX_LAG
+    except Exception:
+        logger.warning("Replica %s is not reachable", alias, exc_info=True)
+        connections[alias].close()
+        lag = None
+        healthy = False
+    HEALTH[alias] = {
+        "checked": monotonic(),
+        "healthy": healthy,
+        "lag": lag
+    }
+    return healthy
+
+
+def mark_unhealthy(alias: str):
+    HEALTH[alias] = {
+        "checked": monotonic(),
+        "healthy": False,
+        "lag": None
+    }
+
+
+def get_replica():
+    """
+    Choose a healthy replica
+
+    Returns:
+      str: The alias of the replica, None if the primary has to be used
+    """
+    replicas = [alias for alias in DATABASE_REPLICAS if is_healthy(alias)]
+    return random.choice(replicas) if replicas else None
+
+
+def get_sticky_key(token: str) -> str:
+    return "replica-sticky-{0}".format(token)
+
+
+def mark_written(token: str):
+    """
+    Serve the reads of a session token from the primary for the next REPLICA_STICKY_SECONDS
+
+    Args:
+      token (str): The session token
+    """
+    if DATABASE_REPLICAS and token:
+        cache.set(get_sticky_key(token), True, REPLICA_STICKY_SECONDS)
+
+
+def is_sticky(token: str) -> bool:
+    return bool(token) and cache.get(get_sticky_key(token)) is not None
+
+
+def use_replica(token_argument: str = None):
+    """
+    Decorate a read-only view to read from a replica
+
+    Args:
+      token_argument (str): The view argument holding the session token, for the read-your-writes check
+
+    Returns:
+      callable: The decorator
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not DATABASE_REPLICAS:
+                return view(request, *args, **kwargs)
+            if token_argument and is_sticky(kwargs.get(token_argument)):
+                STATS["stickyRequests"] += 1
+                return view(request, *args, **kwargs)
+            replica = get_replica()
+            if replica is None:
+                STATS["primaryRequests"] += 1
+                return view(request, *args, **kwargs)
+            STATS["replicaRequests"] += 1
+            STATE.replica = replica
+            STATE.pinned = False
+            try:
+                return view(request, *args, **kwargs)
+            except (OperationalError, InterfaceError):
+                if getattr(STATE, "pinned", False):
+                    # something was written already, so the view can't simply be repeated
+                    raise
+                logger.warning("Replica %s failed, using the primary", replica, exc_info=True)
+                STATS["fallbacks"] += 1
+                mark_unhealthy(replica)
+                connections[replica].close()
+                STATE.replica = None
+                return view(request, *args, **kwargs)
+            finally:
+                STATE.replica = None
+                STATE.pinned = False
+        return wrapper
+    return decorator
+
+
+def get_metrics() -> dict:
+    result = dict(STATS)
+    result["replicas"] = {alias: {
+        "healthy": health["healthy"],
+        "lag": health["lag"]
+    } for alias, health in HEALTH.items()}
+    return result
+
+
+metrics.register("replicas", get_metrics)
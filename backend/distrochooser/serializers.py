@@ -0,0 +1,227 @@
+"""
+JSON serialization of the API responses.
+
+The encoder backend is selected by JSON_SERIALIZER: "orjson" (if installed),
+"json" (the standard library) or "auto", which prefers orjson. Both produce
+the same values as Django's JsonResponse, dates are formatted by DjangoJSONEncoder.
+
+Large and rarely changing parts of the responses (translations, questionnaire,
+distribution metadata) are encoded once into a Fragment. Fragments can be
+placed anywhere in the data and are spliced into the output as they are.
+
+Clients may opt into MessagePack (application/msgpack, needs the msgpack
+package) for responses and request bodies. It carries the same data as JSON,
+fragments are encoded a second time on their first MessagePack use.
+"""
+
+import re
+from functools import lru_cache
+from json import dumps as json_dumps, loads
+from secrets import token_hex
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from backend.settings import JSON_SERIALIZER
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+ENCODER = DjangoJSONEncoder()
+
+# the placeholders must not collide with strings of the data, so they contain a random nonce
+NONCE = token_hex(12)
+PLACEHOLDER = "__fragment_" + NONCE + "_{0}__"
+PLACEHOLDER_PATTERN = re.compile(('"__fragment_' + NONCE + '_([0-9]+)__"').encode("ascii"))
+# the placeholders are longer than 31 bytes, so they are packed as str 8 (0xd9, length, bytes)
+PACKED_PLACEHOLDER_PATTERN = re.compile(
+    b"\\xd9.__fragment_" + NONCE.encode("ascii") + b"_([0-9]+)__", re.DOTALL)
+
+
+class Fragment:
+    """
+    Already serialized JSON, the MessagePack encoding is created on demand
+    """
+    __slots__ = ("content", "data", "packed")
+
+    def __init__(self, content: bytes, data=None):
+        self.content = content
+        self.data = data
+        self.packed = None
+
+    def get_packed(self) -> bytes:
+        if self.packed is None:
+            self.packed = packb(self.data)
+        return self.packed
+
+
+def encode_json(data, default) -> bytes:
+    return json_dumps(data, default=default, separators=(",", ":")).encode("utf-8")
+
+
+def encode_orjson(data, default) -> bytes:
+    return orjson.dumps(data, default=default,
+                        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+
+BACKENDS = {
+    "json": encode_json
+}
+if orjson is not None:
+    BACKENDS["orjson"] = encode_orjson
+
+
+def get_backend(name: str) -> str:
+    """
+    Resolve the configured backend name
+
+    Args:
+      name (str): A key of BACKENDS or "auto"
+
+    Returns:
+      str: The key of the backend to use
+    """
+    if name == "auto":
+        return "orjson" if "orjson" in BACKENDS else "json"
+    if name not in BACKENDS:
+        raise ValueError("JSON serializer {0} is not available".format(name))
+    return name
+
+
+BACKEND = get_backend(JSON_SERIALIZER)
+
+
+def dumps(data, backend: str = None) -> bytes:
+    """
+    Encode data as JSON, splicing in the contained fragments
+
+    Args:
+      data: The data to encode, may contain Fragments
+      backend (str): The key of the backend, the configured one if None
+
+    Returns:
+      bytes: The UTF-8 encoded JSON
+    """
+    fragments = []
+
+    def default(value):
+        if isinstance(value, Fragment):
+            fragments.append(value.content)
+            return PLACEHOLDER.format(len(fragments) - 1)
+        return ENCODER.default(value)
+
+    encoded = BACKENDS[backend or BACKEND](data, default)
+    if fragments:
+        encoded = PLACEHOLDER_PATTERN.sub(lambda match: fragments[int(match.group(1))], encoded)
+    return encoded
+
+
+def to_fragment(data) -> Fragment:
+    """
+    Encode data once to embed it into later responses
+
+    Args:
+      data: The data to encode
+
+    Returns:
+      Fragment: The encoded data
+    """
+    return Fragment(dumps(data), data)
+
+
+def packb(data) -> bytes:
+    """
+    Encode data as MessagePack, splicing in the contained fragments
+
+    Args:
+      data: The data to encode, may contain Fragments
+
+    Returns:
+      bytes: The encoded data
+    """
+    fragments = []
+
+    def default(value):
+        if isinstance(value, Fragment):
+            fragments.append(value)
+            return PLACEHOLDER.format(len(fragments) - 1)
+        return ENCODER.default(value)
+
+    packed = msgpack.packb(data, default=default, use_bin_type=True)
+    if fragments:
+        packed = PACKED_PLACEHOLDER_PATTERN.sub(
+            lambda match: fragments[int(match.group(1))].get_packed(), packed)
+    return packed
+
+
+# media ranges covering JSON
+JSON_RANGES = ("application/json", "application/*", "*/*")
+
+
+@lru_cache(maxsize=256)
+def prefers_msgpack(accept: str) -> bool:
+    """
+    Check if an Accept header rates MessagePack at least as high as JSON
+
+    Args:
+      accept (str): The Accept header
+
+    Returns:
+      bool: True if a MessagePack type is listed explicitly with a q-value above 0 and not below the one of JSON
+    """
+    msgpack_quality = 0
+    json_quality = 0
+    for media_range in accept.split(","):
+        parameters = media_range.split(";")
+        content_type = parameters[0].strip().lower()
+        quality = 1
+        for parameter in parameters[1:]:
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if content_type in MSGPACK_TYPES:
+            msgpack_quality = max(msgpack_quality, quality)
+        elif content_type in JSON_RANGES:
+            json_quality = max(json_quality, quality)
+    return msgpack_quality > 0 and msgpack_quality >= json_quality
+
+
+def accepts_msgpack(request) -> bool:
+    """
+    Check if the client prefers MessagePack over JSON
+
+    Args:
+      request (HttpRequest): The client request
+
+    Returns:
+      bool: True if MessagePack is available and preferred by the Accept header, see prefers_msgpack()
+    """
+    if msgpack is None or request is None:
+        return False
+    return prefers_msgpack(request.META.get("HTTP_ACCEPT", ""))
+
+
+def parse_body(request):
+    """
+    Decode the request body, MessagePack if the Content-Type says so, JSON otherwise
+
+    Args:
+      request (HttpRequest): The client request
+
+    Returns:
+      The decoded data
+    """
+    if msgpack is not None and request.content_type in MSGPACK_TYPES:
+        return msgpack.unpackb(request.body, raw=False)
+    return loads(request.body)
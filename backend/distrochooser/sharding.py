@@ -0,0 +1,241 @@
+"""
+Sharding of the session data across several databases.
+
+UserSession and its children (GivenAnswer, ResultDistroSelection and
+SelectionReason) are placed on one of the DATABASE_SHARDS by a hash of the new
+session token. The index of the shard is stored within the token (see
+place_token()), so each request of a session only touches its shard, no matter
+how many shards there are by then. The default database may be one of the
+shards. Everything else (the questionnaire, the vote counters, the rollups, the
+tasks, ...) stays on the default database.
+
+Shards may be appended to DATABASE_SHARDS, but never removed or reordered, as
+the tokens and ids refer to their position. Tokens without a shard index
+(including the ones created before sharding was enabled) belong to the first
+shard, so it has to be the database which held the sessions before.
+
+As the session rows refer to answers and distributions, the questionnaire
+tables (including their many-to-many relations, e. g. the blocked answers and
+the distributions of the answer matrix) are copied to the other shards by
+manage.py sync_shards. Changes of the
+questionnaire enqueue the sync_shards task, so manage.py run_tasks keeps them up
+to date. Every shard needs the migrations applied (manage.py migrate --database).
+
+Ids handed to the clients (e. g. of the selections to vote for) encode their
+shard, see encode_id(). They don't depend on the amount of shards, but enabling
+sharding changes them once (e. g. incremental exports have to start over).
+Statistics over all sessions are calculated per shard and merged (fan_out()).
+
+Without DATABASE_SHARDS, there is a single shard whose alias is None, so the
+queries aren't pinned to a database and the routers (e. g. the ReplicaRouter)
+still choose one. The ids are unchanged then.
+"""
+
+from hashlib import sha256
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from backend.settings import DATABASE_SHARDS
+from distrochooser.models import UserSession, GivenAnswer, ResultDistroSelection, SelectionReason, Category, Question, Answer, Distribution, AnswerDistributionMatrix
+
+SESSION_MODELS = (UserSession, GivenAnswer, ResultDistroSelection, SelectionReason)
+
+# ids of sharded rows are pk * SHARD_SLOTS + shard index, so appending a shard keeps the issued ids
+SHARD_SLOTS = 64
+
+# separates the shard index from the random part of a session token
+TOKEN_SEPARATOR = "-"
+
+if len(DATABASE_SHARDS) > SHARD_SLOTS:
+    raise ImproperlyConfigured("At most {0} DATABASE_SHARDS are supported".format(SHARD_SLOTS))
+
+# copied to the shards, parents first
+QUESTIONNAIRE_MODELS = (Category, Question, Answer, Distribution, AnswerDistributionMatrix)
+
+
+def get_through_models() -> list:
+    """
+    Get the auto created tables of the many-to-many relations of the questionnaire
+    """
+    return [field.remote_field.through for model in QUESTIONNAIRE_MODELS
+            for field in model._meta.local_many_to_many if field.remote_field.through._meta.auto_created]
+
+
+def get_shards() -> list:
+    """
+    Get the aliases of the databases holding session data
+
+    Returns:
+      list: The aliases, the position of an alias is its shard index. [None] without sharding, which lets the routers choose.
+    """
+    return DATABASE_SHARDS or [None]
+
+
+def place_token(token: str) -> str:
+    """
+    Choose the shard of a new session and store its index in the token
+
+    Args:
+      token (str): The random token of the new session
+
+    Returns:
+      str: The token, with the shard index appended unless it's the first shard
+    """
+    if len(DATABASE_SHARDS) < 2:
+        return token
+    index = int(sha256(token.encode("utf-8")).hexdigest()[:8], 16) % len(DATABASE_SHARDS)
+    return token if index == 0 else "{0}{1}{2}".format(token, TOKEN_SEPARATOR, index)
+
+
+def db_for_token(token: str) -> str:
+    """
+    Get the database of a session
+
+    Args:
+      token (str): The session token (equal to the public url), see place_token()
+
+    Returns:
+      str: The database alias, None without sharding
+
+    Raises:
+      ValueError: The token belongs to a shard which isn't configured
+    """
+    if not DATABASE_SHARDS:
+        return None
+    rest, separator, index = token.rpartition(TOKEN_SEPARATOR)
+    index = int(index) if separator and index.isdigit() else 0
+    if index >= len(DATABASE_SHARDS):
+        raise ValueError("Shard {0} of the token unknown".format(index))
+    return DATABASE_SHARDS[index]
+
+
+def encode_id(alias: str, pk: int) -> int:
+    """
+    Combine the primary key of a session row with the index of its shard
+
+    Args:
+      alias (str): The database alias of the shard
+      pk (int): The primary key within the shard
+
+    Returns:
+      int: The global id, equal to pk without sharding
+    """
+    if not DATABASE_SHARDS:
+        # alias is where a routed query went, e. g. a replica
+        return pk
+    return pk * SHARD_SLOTS + DATABASE_SHARDS.index(alias)
+
+
+def decode_id(id: int) -> tuple:
+    """
+    Split an id of encode_id()
+
+    Returns:
+      tuple: The database alias and the primary key
+
+    Raises:
+      ValueError: The id belongs to a shard which isn't configured
+    """
+    if not DATABASE_SHARDS:
+        return None, id
+    pk, index = divmod(id, SHARD_SLOTS)
+    if index >= len(DATABASE_SHARDS):
+        raise ValueError("Shard {0} of the id unknown".format(index))
+    return DATABASE_SHARDS[index], pk
+
+
+def fan_out(func) -> list:
+    """
+    Call a function once per shard
+
+    Args:
+      func (callable): Receives the database alias of a shard (None without sharding)
+
+    Returns:
+      list: The results, ordered like get_shards()
+    """
+    return [func(alias) for alias in get_shards()]
+
+
+class ShardRouter:
+    """
+    Enabled by backend/settings.py if DATABASE_SHARDS is configured.
+
+    The shard of a session is chosen explicitly by the callers (using()), the
+    router keeps the related rows of a loaded session row on its shard.
+    """
+
+    def get_instance_db(self, model, hints: dict) -> str:
+        instance = hints.get("instance")
+        if model in SESSION_MODELS and instance is not None and instance._state.db:
+            return instance._state.db
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.get_instance_db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.get_instance_db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the questionnaire is copied to all shards
+        return True
+
+
+def sync(alias: str) -> dict:
+    """
+    Copy the questionnaire of the default database to a shard
+
+    Args:
+      alias (str): The database alias of the shard
+
+    Returns:
+      dict: model label -> amount of rows copied
+    """
+    copied = {}
+    with transaction.atomic(using=alias):
+        rows = {model: list(model.objects.using(DEFAULT_DB_ALIAS).order_by("pk")) for model in QUESTIONNAIRE_MODELS}
+        # children first, as removed rows cascade like they did on the default database
+        for model in reversed(QUESTIONNAIRE_MODELS):
+            model.objects.using(alias).exclude(pk__in=[row.pk for row in rows[model]]).delete()
+        for model in QUESTIONNAIRE_MODELS:
+            existing = set(model.objects.using(alias).values_list("pk", flat=True))
+            fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+            model.objects.using(alias).bulk_create([row for row in rows[model] if row.pk not in existing])
+            model.objects.using(alias).bulk_update([row for row in rows[model] if row.pk in existing], fields, batch_size=500)
+            copied[model._meta.label_lower] = len(rows[model])
+        # the relations have no other fields, so they are simply replaced
+        for through in get_through_models():
+            relations = list(through.objects.using(DEFAULT_DB_ALIAS).order_by("pk"))
+            through.objects.using(alias).all().delete()
+            through.objects.using(alias).bulk_create(relations, batch_size=500)
+            copied[through._meta.label_lower] = len(relations)
+    return copied
+
+
+def sync_all() -> dict:
+    """
+    Copy the questionnaire to all shards except the default database
+
+    Returns:
+      dict: alias -> result of sync()
+    """
+    return {alias: sync(alias) for alias in get_shards() if alias != DEFAULT_DB_ALIAS}
+
+
+def on_questionnaire_changed(sender, instance, using, action: str = None, **kwargs):
+    # m2m_changed is sent before and after each change
+    if using != DEFAULT_DB_ALIAS or (action or "").startswith("pre_"):
+        return
+    from distrochooser import tasks
+    transaction.on_commit(lambda: tasks.enqueue("sync_shards", key="sync_shards"))
+
+
+if [alias for alias in DATABASE_SHARDS if alias != DEFAULT_DB_ALIAS]:
+    for model in QUESTIONNAIRE_MODELS:
+        post_save.connect(on_questionnaire_changed, sender=model, dispatch_uid=("shards", model))
+        post_delete.connect(on_questionnaire_changed, sender=model, dispatch_uid=("shards", model))
+    for through in get_through_models():
+        m2m_changed.connect(on_questionnaire_changed, sender=through, dispatch_uid=("shards", through))
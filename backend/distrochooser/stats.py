@@ -0,0 +1,182 @@
+"""
+Statistics of the sessions, as shown at /stats/.
+
+Calculating them scans all sessions, so /stats/ returns a snapshot which is
+refreshed by the refresh_stats task instead. manage.py run_tasks enqueues it
+every STATS_REFRESH_INTERVAL seconds (see schedule_refresh()), so reading the
+statistics never writes. The snapshot is the result of the latest finished task. Only if there is none, or it's older
+than STATS_MAX_AGE (e. g. because no task runner is running), it's calculated
+within the request.
+
+With sharded session data, the numbers of each shard are calculated separately
+and summed up, together with the rollups of the pruned sessions.
+"""
+
+from datetime import timedelta
+from json import loads
+
+from django.db.models import Count, Sum
+from django.utils.timezone import now
+
+from backend.settings import STATS_REFRESH_INTERVAL, STATS_MAX_AGE
+from distrochooser import tasks
+from distrochooser.sharding import fan_out
+from distrochooser.models import UserSession, ResultDistroSelection, DistributionVoteCount, SessionRollup, ReferrerRollup, AnswerCooccurrence, Task
+from distrochooser.util import get_referrer_host
+
+
+def compute_shard_stats(alias: str) -> dict:
+    """
+    Calculate the summable numbers of the sessions of one database
+
+    Args:
+      alias (str): The database alias of the shard
+
+    Returns:
+      dict: The counts and sums, referrers and languages by their name
+    """
+    results = ResultDistroSelection.objects.using(alias).values(
+        'session_id').annotate(total=Count('session_id')).filter(total__gt=0)
+
+    sessions = UserSession.objects.using(alias).filter(calculationTime__gt=0)
+
+    sumCalculationTime = 0
+    sumStayTime = 0
+    countedSessions = 0
+    for session in sessions:
+        if session.calculationTime > 0 and session.calculationEndTime:
+            countedSessions = countedSessions + 1
+            sumCalculationTime = sumCalculationTime + session.calculationTime
+            sumStayTime = sumStayTime + \
+                (session.calculationEndTime - session.dateTime).seconds
+
+    referrersQuery = UserSession.objects.using(alias).values(
+        "referrer").annotate(amount=Count('referrer'))
+    referrers = {}
+    for referrer in referrersQuery:
+        backlink = get_referrer_host(referrer["referrer"])
+        if backlink:
+            if backlink not in referrers:
+                referrers[backlink] = referrer["amount"]
+            else:
+                referrers[backlink] = referrers[backlink] + referrer["amount"]
+
+    got = UserSession.objects.using(alias).values('language').annotate(amount=Count('language'))
+    lang_stats = {}
+    for language in got:
+        lang_stats[language["language"]] = language["amount"]
+
+    return {
+        "sessions": UserSession.objects.using(alias).count(),
+        "testedSessions": results.count(),
+        "calculatedSessions": countedSessions,
+        "calculationTime": sumCalculationTime,
+        "stayTime": sumStayTime,
+        "referrers": referrers,
+        "languages": lang_stats
+    }
+
+
+def get_archived_stats() -> dict:
+    """
+    Get the numbers of the sessions removed by the retention, which are only available as rollups
+
+    Returns:
+      dict: The same keys as compute_shard_stats()
+    """
+    archived = SessionRollup.objects.aggregate(
+        sessions=Sum('sessions'),
+        testedSessions=Sum('testedSessions'),
+        calculatedSessions=Sum('calculatedSessions'),
+        calculationTime=Sum('calculationTime'),
+        stayTime=Sum('stayTime')
+    )
+    archived = {key: value or 0 for key, value in archived.items()}
+    archived["referrers"] = {referrer.host: referrer.amount for referrer in ReferrerRollup.objects.all()}
+    archived["languages"] = {language["language"]: language["amount"] for language in SessionRollup.objects.values(
+        'language').annotate(amount=Sum('sessions'))}
+    return archived
+
+
+def compute_stats() -> dict:
+    """
+    Calculate the statistics
+
+    Returns:
+      dict: The statistics
+    """
+    voteCounts = DistributionVoteCount.objects.aggregate(
+        upvotes=Sum('upvotes'), downvotes=Sum('downvotes'))
+    approvedCount = voteCounts["upvotes"] or 0
+    allVoteResultsCount = approvedCount + (voteCounts["downvotes"] or 0)
+    approvedPercentage = 0
+    if allVoteResultsCount != 0:
+        if approvedCount != 0:
+            approvedPercentage = round(
+                100/(allVoteResultsCount/approvedCount))
+
+    totals = {
+        "sessions": 0,
+        "testedSessions": 0,
+        "calculatedSessions": 0,
+        "calculationTime": 0,
+        "stayTime": 0
+    }
+    referrers = {}
+    lang_stats = {}
+    for partial in fan_out(compute_shard_stats) + [get_archived_stats()]:
+        for key in totals:
+            totals[key] = totals[key] + partial[key]
+        for host, amount in partial["referrers"].items():
+            referrers[host] = referrers.get(host, 0) + amount
+        for language, amount in partial["languages"].items():
+            lang_stats[language] = lang_stats.get(language, 0) + amount
+
+    # run_tasks refreshes the snapshot even before the first calculation
+    calculatedSessions = totals["calculatedSessions"] or 1
+    averageCalculationTime = totals["calculationTime"] / calculatedSessions
+    averageStayTime = totals["stayTime"] / calculatedSessions
+
+    answerPairs = []
+    for pair in AnswerCooccurrence.objects.select_related("answer", "otherAnswer").order_by("-lift")[:10]:
+        answerPairs.append({
+            "answers": [pair.answer.msgid, pair.otherAnswer.msgid],
+            "sessions": pair.sessions,
+            "lift": pair.lift
+        })
+
+    return {
+        "answerPairs": answerPairs,
+        "tests": totals["testedSessions"],
+        "visitors": totals["sessions"],
+        "votedResults": allVoteResultsCount,
+        "approvedPercentage": approvedPercentage,
+        "referrers": referrers,
+        "averageCalculationTime": averageCalculationTime,
+        "averageStayTime": averageStayTime,
+        "languages": lang_stats
+    }
+
+
+def get_snapshot() -> dict:
+    """
+    Get the latest statistics, calculating them if there is no recent snapshot
+
+    Returns:
+      dict: The statistics
+    """
+    latest = Task.objects.filter(name="refresh_stats", status=Task.DONE).order_by(
+        "-finishedAt").values_list("finishedAt", "result").first()
+    if latest is None or latest[0] < now() - timedelta(seconds=STATS_MAX_AGE):
+        return compute_stats()
+    return loads(latest[1])
+
+
+def schedule_refresh() -> bool:
+    """
+    Enqueue the refresh_stats task if the snapshot is outdated and no refresh is pending or running
+
+    Returns:
+      bool: True if the task was enqueued
+    """
+    return tasks.schedule("refresh_stats", STATS_REFRESH_INTERVAL)
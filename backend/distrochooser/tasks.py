@@ -0,0 +1,275 @@
+"""
+Durable background tasks, stored in the database.
+
+enqueue() adds a Task row, in the transaction of the caller, so the task only
+exists if the surrounding work was committed. manage.py run_tasks claims due
+tasks in batches and runs them through the handler registered for their name.
+A handler receives the payloads of all claimed tasks having its name at once,
+so e. g. many requested stats refreshes result in a single calculation.
+
+Claiming uses SELECT ... FOR UPDATE SKIP LOCKED where the database supports it
+(PostgreSQL), so several runners never claim the same task. Elsewhere (SQLite)
+each task is claimed by a conditional UPDATE, which only one runner can win.
+
+Failed tasks are retried with an exponential backoff until maxAttempts is
+reached, afterwards they stay in the table as failed.
+
+The tasks listed in TASK_SCHEDULE are enqueued periodically by run_tasks, see
+schedule().
+"""
+
+import logging
+import traceback
+from datetime import timedelta
+from json import dumps, loads
+
+from django.db import connection, transaction
+from django.db.models import Q, Count, F
+from django.utils.timezone import now
+
+from backend.settings import TASK_BATCH_SIZE, TASK_LEASE, TASK_MAX_ATTEMPTS, TASK_RETRY_DELAY
+from distrochooser import metrics
+from distrochooser.models import Task
+
+logger = logging.getLogger(__name__)
+
+# name -> callable receiving the list of payloads and returning a JSON serializable result
+HANDLERS = {}
+
+STATS = {
+    "processed": 0,
+    "retried": 0,
+    "failed": 0,
+    "batches": 0
+}
+
+
+def handler(name: str):
+    """
+    Register the handler of a task name
+    """
+    def decorator(func):
+        HANDLERS[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name: str, payload=None, key: str = None, delay: float = 0) -> Task:
+    """
+    Add a task
+
+    Args:
+      name (str): The name of the handler
+      payload: JSON serializable data passed to the handler
+      key (str): If given, the task is not added while a pending task has the same key
+      delay (float): Seconds to wait before running the task
+
+    Returns:
+      Task: The new or the already pending task
+    """
+    if name not in HANDLERS:
+        raise ValueError("Task {0} unknown".format(name))
+    if key is not None:
+        pending = Task.objects.filter(key=key, status=Task.PENDING).first()
+        if pending is not None:
+            return pending
+    return Task.objects.create(
+        name=name,
+        key=key,
+        payload=dumps(payload),
+        maxAttempts=TASK_MAX_ATTEMPTS,
+        runAfter=now() + timedelta(seconds=delay)
+    )
+
+
+def schedule(name: str, interval: float, payload=None) -> bool:
+    """
+    Enqueue a task if it did not finish within the interval and is neither pending nor running
+
+    Args:
+      name (str): The name of the handler
+      interval (float): Seconds between two runs
+      payload: JSON serializable data passed to the handler
+
+    Returns:
+      bool: True if the task was enqueued
+    """
+    latest = Task.objects.filter(name=name, status=Task.DONE).order_by(
+        "-finishedAt").values_list("finishedAt", flat=True).first()
+    if latest is not None and latest >= now() - timedelta(seconds=interval):
+        return False
+    if Task.objects.filter(name=name, status__in=(Task.PENDING, Task.RUNNING)).exists():
+        return False
+    enqueue(name, payload, key=name)
+    return True
+
+
+def _get_due(moment):
+    return Task.objects.filter(
+        Q(status=Task.PENDING, runAfter__lte=moment) | Q(status=Task.RUNNING, lockedUntil__lt=moment)
+    ).order_by("runAfter")
+
+
+def claim(batch_size: int = TASK_BATCH_SIZE, lease: float = TASK_LEASE) -> list:
+    """
+    Claim due tasks, including running ones whose lease expired
+
+    Args:
+      batch_size (int): The maximum amount of tasks to claim
+      lease (float): Seconds until the claim expires
+
+    Returns:
+      list: The claimed tasks
+    """
+    moment = now()
+    claimed = {
+        "status": Task.RUNNING,
+        "lockedUntil": moment + timedelta(seconds=lease),
+        "attempts": F("attempts") + 1
+    }
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(_get_due(moment).select_for_update(
+                skip_locked=True).values_list("pk", flat=True)[:batch_size])
+            Task.objects.filter(pk__in=ids).update(**claimed)
+    else:
+        ids = []
+        for task in _get_due(moment).values("pk", "status", "lockedUntil")[:batch_size]:
+            # only succeeds if no other runner claimed the task in the meantime
+            if Task.objects.filter(**task).update(**claimed):
+                ids.append(task["pk"])
+    return list(Task.objects.filter(pk__in=ids).order_by("runAfter"))
+
+
+def finish(tasks: list, result):
+    Task.objects.filter(pk__in=[task.pk for task in tasks]).update(
+        status=Task.DONE,
+        result=dumps(result),
+        finishedAt=now(),
+        lockedUntil=None,
+        lastError=None
+    )
+    STATS["processed"] += len(tasks)
+
+
+def fail(tasks: list, error: str):
+    moment = now()
+    for task in tasks:
+        if task.attempts < task.maxAttempts:
+            Task.objects.filter(pk=task.pk).update(
+                status=Task.PENDING,
+                runAfter=moment + timedelta(seconds=TASK_RETRY_DELAY * 2 ** (task.attempts - 1)),
+                lockedUntil=None,
+                lastError=error
+            )
+            STATS["retried"] += 1
+        else:
+            Task.objects.filter(pk=task.pk).update(
+                status=Task.FAILED,
+                finishedAt=moment,
+                lockedUntil=None,
+                lastError=error
+            )
+            STATS["failed"] += 1
+
+
+def run(tasks: list) -> int:
+    """
+    Run claimed tasks, one handler call per task name
+
+    Args:
+      tasks (list): The claimed tasks
+
+    Returns:
+      int: The amount of tasks run successfully
+    """
+    batches = {}
+    for task in tasks:
+        batches.setdefault(task.name, []).append(task)
+    succeeded = 0
+    for name, batch in batches.items():
+        STATS["batches"] += 1
+        try:
+            if name not in HANDLERS:
+                raise ValueError("Task {0} unknown".format(name))
+            result = HANDLERS[name]([loads(task.payload) for task in batch])
+        except Exception:
+            logger.exception("Task %s failed", name)
+            fail(batch, traceback.format_exc())
+            continue
+        finish(batch, result)
+        succeeded = succeeded + len(batch)
+    return succeeded
+
+
+def delete_finished(before) -> int:
+    """
+    Delete the tasks which are done or failed and finished before the given point in time
+
+    Returns:
+      int: The amount of tasks deleted
+    """
+    deleted, _ = Task.objects.filter(
+        status__in=[Task.DONE, Task.FAILED], finishedAt__lt=before).delete()
+    return deleted
+
+
+def get_metrics() -> dict:
+    result = dict(STATS)
+    result["queue"] = {row["status"]: row["amount"] for row in Task.objects.values(
+        "status").annotate(amount=Count("pk")).order_by()}
+    return result
+
+
+metrics.register("tasks", get_metrics)
+
+
+@handler("refresh_stats")
+def refresh_stats(payloads: list) -> dict:
+    from distrochooser.stats import compute_stats
+    return compute_stats()
+
+
+@handler("rebuild_vote_counts")
+def rebuild_vote_counts(payloads: list) -> int:
+    from distrochooser.votes import rebuild_counts
+    return rebuild_counts()
+
+
+@handler("prune_sessions")
+def prune_sessions(payloads: list) -> int:
+    """
+    Prune one chunk of sessions, the task is enqueued again until nothing is left
+    """
+    from backend.settings import SESSION_RETENTION_DAYS
+    from distrochooser.retention import get_cutoff, prune_chunk
+    from distrochooser.sharding import fan_out
+    chunk_size = max((payload or {}).get("chunkSize", 500) for payload in payloads)
+    days = max((payload or {}).get("days", SESSION_RETENTION_DAYS) for payload in payloads)
+    cutoff = get_cutoff(days)
+    pruned = sum(fan_out(lambda alias: prune_chunk(cutoff, chunk_size, alias)))
+    if pruned:
+        enqueue("prune_sessions", {"chunkSize": chunk_size, "days": days}, key="prune_sessions")
+    return pruned
+
+
+@handler("compute_answer_analytics")
+def compute_answer_analytics(payloads: list) -> list:
+    from distrochooser import analytics
+    range_size = max((payload or {}).get("rangeSize", 50000) for payload in payloads)
+    min_sessions = min((payload or {}).get("minSessions", 10) for payload in payloads)
+    return list(analytics.store(analytics.compute(range_size), min_sessions))
+
+
+@handler("sync_shards")
+def sync_shards(payloads: list) -> dict:
+    from distrochooser.sharding import sync_all
+    return sync_all()
+
+
+@handler("build_media")
+def build_media(payloads: list) -> dict:
+    from distrochooser.media import build, purge_superseded
+    built = {source: build(source) for source in set(payload["source"] for payload in payloads)}
+    purge_superseded()
+    return built
@@ -0,0 +1,252 @@
+"""
+Compiled and hot-reloadable translation store.
+
+Parsing the .po files with polib is slow, so the parsed catalogs are pickled
+into a cache directory, keyed on the path, mtime, size and content hash of the
+.po file. Later starts only need to stat the file and unpickle the catalog.
+In lazy mode, a locale is only loaded when it's accessed the first time.
+
+The store watches the .po files of the loaded locales. Changed catalogs are
+parsed in a background thread and swapped in as a whole, so requests keep using
+the previous version in the meantime. Each swap increments the version and
+notifies the subscribers, which drop the caches derived from the translations.
+"""
+
+import os
+import pickle
+from collections.abc import Mapping
+from hashlib import sha256
+from threading import Lock, Thread
+from time import monotonic
+
+# not using django's translation model b/c of dynamical content instead of values taken out of the sourcecode
+import polib
+
+CACHE_FORMAT = 1
+
+
+def parse_catalog(content: str) -> dict:
+    """
+    Parse the content of a .po file
+
+    Args:
+      content (str): The .po file content
+
+    Returns:
+      dict: msgid -> msgstr
+    """
+    result = {}
+    for entry in polib.pofile(content):
+        result[entry.msgid] = entry.msgstr
+    return result
+
+
+class TranslationStore(Mapping):
+    """
+    Read-only mapping of locale -> catalog, backed by the compiled cache
+    """
+
+    def __init__(self, locales: dict, cache_dir: str, lazy: bool = False, check_interval: float = 0):
+        """
+        Args:
+          locales (dict): locale -> path of the .po file
+          cache_dir (str): Directory of the compiled catalogs, None disables the cache
+          lazy (bool): Load the catalogs on first access instead of right away
+          check_interval (float): Seconds between checks for changed .po files, 0 disables them
+        """
+        self.locales = locales
+        self.cache_dir = cache_dir
+        self.check_interval = check_interval
+        self.catalogs = {}
+        # locale -> (mtime, size) of the .po file the catalog was loaded from
+        self.stamps = {}
+        self.version = 1
+        self.subscribers = []
+        self.lock = Lock()
+        self.last_check = monotonic()
+        self.is_checking = False
+        if not lazy:
+            for locale in locales:
+                self[locale]
+
+    def __getitem__(self, locale: str) -> dict:
+        if self.check_interval and monotonic() - self.last_check > self.check_interval:
+            self.check_in_background()
+        catalog = self.catalogs.get(locale)
+        if catalog is None:
+            if locale not in self.locales:
+                raise KeyError(locale)
+            with self.lock:
+                catalog = self.catalogs.get(locale)
+                if catalog is None:
+                    catalog = self.load(locale)
+                    catalogs = self.catalogs.copy()
+                    catalogs[locale] = catalog
+                    self.catalogs = catalogs
+        return catalog
+
+    def __contains__(self, locale) -> bool:
+        return locale in self.locales
+
+    def __iter__(self):
+        return iter(self.locales)
+
+    def __len__(self) -> int:
+        return len(self.locales)
+
+    def get_cache_path(self, locale: str) -> str:
+        return os.path.join(self.cache_dir, "{0}.pickle".format(locale))
+
+    def read_cache(self, locale: str):
+        try:
+            with open(self.get_cache_path(locale), "rb") as file:
+                cached = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        if not isinstance(cached, dict) or cached.get("format") != CACHE_FORMAT:
+            return None
+        return cached
+
+    def write_cache(self, locale: str, cached: dict):
+        path = self.get_cache_path(locale)
+        temporary = "{0}.{1}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(temporary, "wb") as file:
+                pickle.dump(cached, file, protocol=pickle.HIGHEST_PROTOCOL)
+            # atomic, so concurrently starting workers never read a partial file
+            os.replace(temporary, path)
+        except OSError:
+            # a read-only deployment still works, it just parses on every start
+            pass
+
+    def load(self, locale: str) -> dict:
+        """
+        Load a catalog out of the cache, parsing the .po file only if it changed
+
+        Args:
+          locale (str): The locale to load
+
+        Returns:
+          dict: msgid -> msgstr
+        """
+        path = self.locales[locale]
+        stat = os.stat(path)
+        self.stamps[locale] = (stat.st_mtime_ns, stat.st_size)
+        cached = self.read_cache(locale) if self.cache_dir else None
+        if cached and cached["path"] == path and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+            return cached["catalog"]
+
+        with open(path, "rb") as file:
+            content = file.read()
+        digest = sha256(content).hexdigest()
+        if cached and cached["path"] == path and cached["hash"] == digest:
+            catalog = cached["catalog"]
+        else:
+            catalog = parse_catalog(content.decode("utf-8"))
+        if self.cache_dir:
+            self.write_cache(locale, {
+                "format": CACHE_FORMAT,
+                "path": path,
+                "mtime": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "hash": digest,
+                "catalog": catalog
+            })
+        return catalog
+
+    def compile(self) -> list:
+        """
+        Load all locales, updating the compiled cache where needed
+
+        Returns:
+          list: The locales loaded
+        """
+        with self.lock:
+            catalogs = self.catalogs.copy()
+            for locale in self.locales:
+                catalogs[locale] = self.load(locale)
+            subscribers = self.swap(catalogs)
+        self.notify(subscribers)
+        return list(self.locales)
+
+    def subscribe(self, callback):
+        """
+        Register a callback, which is called with the new version after the catalogs changed
+
+        Args:
+          callback (callable): Receives the version as the only argument
+        """
+        self.subscribers.append(callback)
+
+    def swap(self, catalogs: dict) -> list:
+        """
+        Replace the catalogs at once. Needs the lock.
+
+        Returns:
+          list: The subscribers to pass to notify() once the lock is released
+        """
+        self.catalogs = catalogs
+        self.version = self.version + 1
+        return list(self.subscribers)
+
+    def notify(self, subscribers: list):
+        """
+        Call the subscribers with the current version. They may read the store, so the lock must not be held.
+        """
+        for callback in subscribers:
+            callback(self.version)
+
+    def get_changed(self) -> list:
+        """
+        Get the loaded locales whose .po file changed since loading them
+
+        Returns:
+          list: The changed locales
+        """
+        changed = []
+        for locale in list(self.catalogs):
+            try:
+                stat = os.stat(self.locales[locale])
+            except OSError:
+                continue
+            if self.stamps.get(locale) != (stat.st_mtime_ns, stat.st_size):
+                changed.append(locale)
+        return changed
+
+    def reload(self) -> list:
+        """
+        Reload the changed catalogs
+
+        Returns:
+          list: The locales reloaded
+        """
+        subscribers = []
+        with self.lock:
+            self.last_check = monotonic()
+            changed = self.get_changed()
+            if changed:
+                catalogs = self.catalogs.copy()
+                for locale in changed:
+                    catalogs[locale] = self.load(locale)
+                subscribers = self.swap(catalogs)
+        self.notify(subscribers)
+        return changed
+
+    def check_in_background(self):
+        """
+        Start a reload in a background thread unless one is running already
+        """
+        with self.lock:
+            if self.is_checking:
+                return
+            self.is_checking = True
+            self.last_check = monotonic()
+
+        def check():
+            try:
+                self.reload()
+            finally:
+                self.is_checking = False
+        thread = Thread(target=check, daemon=True)
+        thread.start()
@@ -2,29 +2,179 @@
 Generic helper functions to utilize them in several parts of the backend.
 """
 
-from django.http import JsonResponse, Http404
+from hashlib import sha256
+from urllib.parse import urlparse
+
+from django.http import HttpRequest, HttpResponse, Http404
+from django.db.models import Sum
 from django.forms.models import model_to_dict
-from distrochooser.models import Question, Answer
+from distrochooser.models import Question, Answer, Category, UserSession, SessionRollup, MediaVariant
+from distrochooser.cache import l1_cached
+from distrochooser.sharding import fan_out
+from distrochooser.media import get_media, get_answer_source
+from distrochooser.constants import TESTOFFSET, TRANSLATIONS
+from distrochooser.serializers import Fragment, dumps, packb, to_fragment, accepts_msgpack
 
 
-def get_json_response(data) -> JsonResponse:
+def get_json_response(data, request: HttpRequest = None, status: int = 200) -> HttpResponse:
     """
     Returns a HTTP Response with Content-Type application/JSON from the given data parameter
 
     Args:
-      data: The information to json encode
+      data: The information to json encode, may contain pre-serialized fragments
+      request (HttpRequest): The client request, MessagePack is returned if its Accept header asks for it
+      status (int): The HTTP status code
 
     Returns:
-      JsonResponse:The response including needed CORS headers
+      HttpResponse:The response including needed CORS headers
     """
-    response = JsonResponse(data, safe=False)
+    if accepts_msgpack(request):
+        response = HttpResponse(packb(data), status=status, content_type="application/msgpack")
+    else:
+        response = HttpResponse(dumps(data), status=status, content_type="application/json")
+    response["Vary"] = "Accept"
     response["Access-Control-Allow-Origin"] = "*"
     response["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
     response["Access-Control-Max-Age"] = "1000"
-    response["Access-Control-Allow-Headers"] = "X-Requested-With, Content-Type"
+    response["Access-Control-Allow-Headers"] = "X-Requested-With, Content-Type, Accept"
     return response
 
 
+def get_referrer_host(referrer: str) -> str:
+    """
+    Get the host of a referrer URL, excluding the own domain
+
+    Args:
+      referrer (str): The referrer stored in the session, might be None
+
+    Returns:
+      str: The host or None if it's empty or an internal one
+    """
+    backlink = referrer
+    try:
+        backlink = urlparse(backlink)
+        backlink = backlink.netloc
+    except:
+        pass
+    if backlink and "distrochooser.de" not in backlink:
+        return backlink
+    return None
+
+
+def get_test_count() -> int:
+    """
+    Get the amount of tests done so far, including pruned sessions
+
+    Returns:
+      int: The public test counter
+    """
+    archived = SessionRollup.objects.aggregate(sessions=Sum("sessions"))
+    return TESTOFFSET + sum(fan_out(lambda alias: UserSession.objects.using(alias).count())) + (archived["sessions"] or 0)
+
+
+class AnswerSpaceChanged(Exception):
+    """
+    A compact submission refers to another version of the answer id space
+    """
+    pass
+
+
+class InvalidSubmission(ValueError):
+    """
+    The submitted answers can't be resolved, e. g. because of an unknown id
+    """
+    pass
+
+
+class AnswerSpace:
+    """
+    Compact, versioned ids of all answers.
+
+    The answers are numbered by their primary key order, starting with 0. The
+    version is a hash of the numbered msgids, so all workers agree on it and
+    it only changes if the answers do.
+    """
+
+    def __init__(self, answers: list):
+        """
+        Args:
+          answers (list): (pk, msgid) tuples ordered by pk
+        """
+        self.pks = [pk for pk, msgid in answers]
+        self.ids = {pk: index for index, pk in enumerate(self.pks)}
+        self.pks_by_msgid = {msgid: pk for pk, msgid in answers}
+        self.version = sha256("\n".join(msgid for pk, msgid in answers).encode("utf-8")).hexdigest()[:12]
+
+    def resolve(self, data: dict) -> list:
+        """
+        Resolve the submitted answers to answer primary keys.
+
+        Two formats are accepted: {"answers": [{"msgid": str, "important": bool}, ...]} and the compact
+        {"answerSpace": version, "ids": [int, ...], "important": hex string}, where bit i of important
+        (least significant first) marks ids[i] as important.
+
+        Args:
+          data (dict): The submitted data
+
+        Returns:
+          list: (answer pk, is important) tuples in the submitted order
+
+        Raises:
+          AnswerSpaceChanged: The compact ids refer to another version
+          InvalidSubmission: The answers are malformed or unknown
+        """
+        if "ids" not in data:
+            try:
+                return [(self.pks_by_msgid[answer["msgid"]], answer["important"]) for answer in data["answers"]]
+            except (KeyError, TypeError):
+                raise InvalidSubmission("Answers malformed or unknown")
+        if data.get("answerSpace") != self.version:
+            raise AnswerSpaceChanged(self.version)
+        try:
+            important = int(data.get("important") or "0", 16)
+        except (TypeError, ValueError):
+            raise InvalidSubmission("important is no hex string")
+        if not isinstance(data["ids"], list):
+            raise InvalidSubmission("ids is no list")
+        answers = []
+        for index, answer_id in enumerate(data["ids"]):
+            # bool is a subclass of int
+            if not isinstance(answer_id, int) or isinstance(answer_id, bool) or not 0 <= answer_id < len(self.pks):
+                raise InvalidSubmission("Answer id {0} unknown".format(answer_id))
+            answers.append((self.pks[answer_id], bool(important >> index & 1)))
+        return answers
+
+
+def get_submission_hash(request: HttpRequest, lang_code: str, method: str, answers: list) -> str:
+    """
+    Identify a submission, retries of it get the same hash
+
+    Args:
+      request (HttpRequest): The client request, its Idempotency-Key header is used if given
+      lang_code (str): The language of the result
+      method (str): The calculation method
+      answers (list): The resolved answers, see AnswerSpace.resolve()
+
+    Returns:
+      str: The hex encoded SHA-256 hash
+    """
+    key = request.META.get("HTTP_IDEMPOTENCY_KEY")
+    source = "key:{0}".format(key) if key else "answers:{0}".format(answers)
+    return sha256("{0}:{1}:{2}".format(lang_code, method, source).encode("utf-8")).hexdigest()
+
+
+@l1_cached(Answer)
+def get_answer_space() -> AnswerSpace:
+    """
+    Get the current answer id space
+
+    Returns:
+      AnswerSpace: The compact ids of all answers
+    """
+    return AnswerSpace(list(Answer.objects.order_by("pk").values_list("pk", "msgid")))
+
+
+@l1_cached(Question, Answer, Category, MediaVariant)
 def get_step_data(category_index: int) -> dict:
     """
     Get the question for a given category
@@ -33,7 +183,8 @@ def get_step_data(category_index: int) -> dict:
       category_index (int): The 0-based index of hte category
 
     Returns:
-      dict: A dictionary containing the question, the category and the answers
+      dict: A dictionary containing the question, the category and the answers, must not be modified.
+      The answers of media questions reference their image variants (see media.get_media())
     """
     results = Question.objects.filter(category__index=category_index)
     if results.count() == 0:
@@ -42,18 +193,66 @@ def get_step_data(category_index: int) -> dict:
     question = results.first()
     answers = Answer.objects.filter(
         question=question, isDisabled=False).order_by("orderIndex")
+    answer_space = get_answer_space()
     response_answers = []
     for answer in answers:
         blocked_answers = []
         for blocked in answer.blockedAnswers.all():
             blocked_answers.append(blocked.msgid)
-        response_answers.append({
+        response_answer = {
+            "id": answer_space.ids[answer.pk],
             "msgid": answer.msgid,
             "blockedAnswers": blocked_answers,
             "mediaSourcePath": answer.mediaSourcePath
-        })
+        }
+        if question.isMediaQuestion:
+            response_answer["media"] = get_media(get_answer_source(answer.msgid), fallback=False)
+        response_answers.append(response_answer)
     return {
         "question": model_to_dict(question, fields=('id', 'msgid', 'isMultipleChoice', 'additionalInfo', 'isMediaQuestion')),
         "category": model_to_dict(question.category),
         "answers":  response_answers
     }
+
+
+@l1_cached(Question, Answer, Category, MediaVariant)
+def get_step_fragments(category_index: int) -> dict:
+    """
+    Get the pre-serialized question, category and answers of a category
+
+    Args:
+      category_index (int): The 0-based index of the category
+
+    Returns:
+      dict: The values of get_step_data() as fragments
+    """
+    return {key: to_fragment(value) for key, value in get_step_data(category_index).items()}
+
+
+@l1_cached(Category)
+def get_categories_fragment() -> Fragment:
+    """
+    Get all categories ordered by their index
+
+    Returns:
+      Fragment: The pre-serialized list of categories
+    """
+    return to_fragment(list(Category.objects.all().order_by("index").values()))
+
+
+@l1_cached()
+def _encode_translations(lang_code: str, version: int) -> Fragment:
+    return to_fragment(TRANSLATIONS[lang_code])
+
+
+def get_translations_fragment(lang_code: str) -> Fragment:
+    """
+    Get the pre-serialized translations of a locale
+
+    Args:
+      lang_code (str): The locale
+
+    Returns:
+      Fragment: The translations of the current translation version
+    """
+    return _encode_translations(lang_code, TRANSLATIONS.version)
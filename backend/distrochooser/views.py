@@ -2,25 +2,57 @@
 Views of the API backend.
 """
 
-from json import loads
+import os
 from secrets import token_hex
 from urllib.parse import urlparse
 import datetime
 from math import floor
+from django.db import transaction
 from django.db.models import Q
 
-from django.db.models import Count, Avg
+from django.db.models import Count, Avg, Sum
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse, HttpRequest, JsonResponse, Http404
-from django.shortcuts import render, redirect
-
-from backend.settings import LOCALES
-from distrochooser.util import get_json_response, get_step_data
+from django.http import HttpResponse, HttpRequest, JsonResponse, Http404, StreamingHttpResponse
+from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.dateparse import parse_datetime
+from django.views.static import serve
+
+from backend.settings import LOCALES, MEDIA_ROOT
+from distrochooser.routers import use_replica, mark_written
+from distrochooser.sharding import db_for_token, place_token, decode_id, fan_out
+from distrochooser.cache import micro_cache, SingleFlight
+from distrochooser.serializers import parse_body
+from distrochooser.util import get_json_response, get_test_count, get_step_fragments, get_categories_fragment, get_translations_fragment, get_answer_space, get_submission_hash, AnswerSpaceChanged, InvalidSubmission
 from distrochooser.calculations import default
-from distrochooser.models import UserSession, Category, ResultDistroSelection, GivenAnswer, AnswerDistributionMatrix
+from distrochooser import votes, export, warmup, metrics, stats
+from distrochooser.models import UserSession, Question, Answer, Category, ResultDistroSelection, GivenAnswer, AnswerDistributionMatrix, MediaVariant
 from distrochooser.constants import TRANSLATIONS, TESTOFFSET, CONFIG
 
+# (token, submission hash) -> running calculation of this worker
+SUBMISSIONS = SingleFlight()
+
+
+def get_database(token: str) -> str:
+    """
+    Get the database of a session token sent by a client
+
+    Args:
+      token (str): The session token, see place_token()
+
+    Returns:
+      str: The database alias, see db_for_token()
+
+    Raises:
+      Http404: The token belongs to a shard which isn't configured
+    """
+    try:
+        return db_for_token(token)
+    except ValueError:
+        raise Http404("Session not found")
+
 
+@micro_cache("locales")
 def get_locales(request: HttpRequest) -> JsonResponse:
     """
     Returns a list of installed locales (ISO-639-1) as a JSON response
@@ -31,12 +63,14 @@ def get_locales(request: HttpRequest) -> JsonResponse:
     Returns:
       JsonResponse: An array of the installed locales
     """
-    return get_json_response(list(LOCALES.keys()))
+    return get_json_response(list(LOCALES.keys()), request)
 
 
+@micro_cache("stats")
+@use_replica()
 def get_stats(request):
     """
-    Calculate some stats
+    Returns the latest snapshot of the stats
 
     Args:
       request (HttpRequest): The request of the client
@@ -44,67 +78,11 @@ def get_stats(request):
     Returns:
       JsonResponse: Some statistics
     """
-    results = ResultDistroSelection.objects.all().values(
-        'session_id').annotate(total=Count('session_id')).filter(total__gt=0)
-    approvedResults = ResultDistroSelection.objects.filter(
-        isApprovedByUser=True)
-    disapprovedResults = ResultDistroSelection.objects.filter(
-        isDisApprovedByUser=True)
-    allVoteResultsCount = approvedResults.count() + disapprovedResults.count()
-    approvedPercentage = 0
-    if allVoteResultsCount != 0:
-        if approvedResults.count() != 0:
-            approvedPercentage = round(
-                100/(allVoteResultsCount/approvedResults.count()))
-
-    sessions = UserSession.objects.filter(calculationTime__gt=0)
-
-    sumCalculationTime = 0
-    sumStayTime = 0
-    countedSessions = 0
-    for session in sessions:
-        if session.calculationTime > 0 and session.calculationEndTime:
-            countedSessions = countedSessions + 1
-            sumCalculationTime = sumCalculationTime + session.calculationTime
-            sumStayTime = sumStayTime + \
-                (session.calculationEndTime - session.dateTime).seconds
-
-    averageCalculationTime = sumCalculationTime / countedSessions
-    averageStayTime = sumStayTime / countedSessions
-
-    referrersQuery = UserSession.objects.values(
-        "referrer").annotate(amount=Count('referrer'))
-    referrers = {}
-    for referrer in referrersQuery:
-        backlink = referrer["referrer"]
-        try:
-            backlink = urlparse(backlink)
-            backlink = backlink.netloc
-        except:
-            pass
-        if backlink and "distrochooser.de" not in backlink:
-            if backlink not in referrers:
-                referrers[backlink] = referrer["amount"]
-            else:
-                referrers[backlink] = referrers[backlink] + referrer["amount"]
-
-    got = UserSession.objects.all().values('language').annotate(amount=Count('language'))
-    lang_stats = {}
-    for language in got:
-        lang_stats[language["language"]] = language["amount"]
-
-    return JsonResponse({
-        "tests": results.count(),
-        "visitors": UserSession.objects.all().count(),
-        "votedResults": allVoteResultsCount,
-        "approvedPercentage": approvedPercentage,
-        "referrers": referrers,
-        "averageCalculationTime": averageCalculationTime,
-        "averageStayTime": averageStayTime,
-        "languages": lang_stats
-    })
+    return get_json_response(stats.get_snapshot(), request)
 
 
+@micro_cache("ssrdata")
+@use_replica()
 def get_ssr_data(request: HttpRequest, lang_code: str) -> HttpResponse:
     """
     Returns data needed to render it server side (e. g. about pages or meta tags)
@@ -119,10 +97,10 @@ def get_ssr_data(request: HttpRequest, lang_code: str) -> HttpResponse:
     if lang_code not in TRANSLATIONS:
         raise Http404
 
-    testCount = TESTOFFSET + UserSession.objects.all().count()
+    testCount = get_test_count()
     responseData = TRANSLATIONS[lang_code].copy()
     responseData["testCount"] = testCount
-    return JsonResponse(responseData)
+    return get_json_response(responseData, request)
 
 
 @csrf_exempt
@@ -141,9 +119,9 @@ def start(request: HttpRequest, lang_code: str) -> JsonResponse:
     if lang_code not in LOCALES:
         raise Http404("Language not installed")
 
-    data = loads(request.body)
+    data = parse_body(request)
     referrer = data["referrer"] if "referrer" in data else null
-    token = "d5" + token_hex(5)
+    token = place_token("d5" + token_hex(5))
     session_token = "d5" + token_hex(5)
     user_agent = request.META["HTTP_USER_AGENT"]
     session = UserSession()
@@ -153,23 +131,26 @@ def start(request: HttpRequest, lang_code: str) -> JsonResponse:
     session.sessionToken = session_token
     session.dateTime = datetime.datetime.now()
     session.referrer = referrer
-    session.save()
-    view_bag_data = get_step_data(0)
-    test_count = TESTOFFSET + UserSession.objects.all().count()
+    session.save(using=db_for_token(token))
+    mark_written(session.token)
+    view_bag_data = get_step_fragments(0)
+    test_count = get_test_count()
     return get_json_response({
         "token": session.token,
         "sessionToken": session.sessionToken,
         "language": lang_code,
         "testCount": test_count,
-        "translations": TRANSLATIONS[lang_code],
+        "translations": get_translations_fragment(lang_code),
         "question": view_bag_data["question"],
         "category": view_bag_data["category"],
-        "categories": list(Category.objects.all().order_by("index").values()),
+        "categories": get_categories_fragment(),
+        "answerSpace": get_answer_space().version,
         "answers": view_bag_data["answers"]
-    })
+    }, request)
 
 
 
+@micro_cache("translation")
 def get_language_values(request: HttpRequest, lang_code: str) -> HttpResponse:
     """
     Receive language values as a JSON response.
@@ -184,11 +165,13 @@ def get_language_values(request: HttpRequest, lang_code: str) -> HttpResponse:
     if lang_code not in LOCALES:
         raise Http404("Language not installed")
     return get_json_response({
-        "translations": TRANSLATIONS[lang_code]
-    })
+        "translations": get_translations_fragment(lang_code)
+    }, request)
 
 
 @csrf_exempt
+@micro_cache("question", Question, Answer, Category, MediaVariant)
+@use_replica()
 def load_question(request: HttpRequest, index: int) -> JsonResponse:
     """
     Load a given answer by it's category index.
@@ -202,11 +185,11 @@ def load_question(request: HttpRequest, index: int) -> JsonResponse:
     Returns:
       HttpResponse: The JSON response containing the question and the answer.
     """
-    questionAndCategoryData = get_step_data(index)
+    questionAndCategoryData = get_step_fragments(index)
     return get_json_response({
         "question": questionAndCategoryData["question"],
         "answers": questionAndCategoryData["answers"]
-    })
+    }, request)
 
 
 @csrf_exempt
@@ -215,7 +198,7 @@ def submit_answers(request: HttpRequest, lang_code: str, token: str, method: str
     Submit the user answers
 
     Args:
-      request (HttpRequest): The client request. Contains the answers as application/json!
+      request (HttpRequest): The client request. Contains the answers by msgid or by compact id (see AnswerSpace)
       lang_code (str): The ISO-639-1 encoded language to use
       token (str): The session token
       method (str): The calculation method to be used
@@ -226,29 +209,71 @@ def submit_answers(request: HttpRequest, lang_code: str, token: str, method: str
     if lang_code not in LOCALES:
         raise Exception("Language not installed")
 
-    userSession = UserSession.objects.get(token=token)
-
-    start_time = datetime.datetime.now()
-
-    data = loads(request.body)
+    data = parse_body(request)
     calculations = {
         "default": default.getSelections
     }
-    if method in calculations:
-        selections = calculations[method](userSession, data, lang_code)
-    else:
+    if method not in calculations:
         raise Exception("Calculation method not known")
-
-    end_time = datetime.datetime.now()
-    calculationTime = end_time - start_time
-    userSession.calculationTime = int(calculationTime.microseconds / 1000)
-    userSession.calculationEndTime = end_time
-    userSession.save(update_fields=["calculationTime", "calculationEndTime"])
-    return get_json_response({
+    try:
+        answers = get_answer_space().resolve(data)
+        submissionHash = get_submission_hash(request, lang_code, method, answers)
+        # concurrent retries within this worker wait for the first one instead of calculating again
+        (userSession, selections, isReplay), isShared = SUBMISSIONS.do((token, submissionHash), lambda: calculate_submission(
+            token, lang_code, data, submissionHash, calculations[method]))
+    except AnswerSpaceChanged as changed:
+        # the questionnaire changed since the client loaded it
+        return get_json_response({
+            "error": "answerSpaceChanged",
+            "answerSpace": str(changed)
+        }, request, status=409)
+    except InvalidSubmission as invalid:
+        return get_json_response({
+            "error": "invalidSubmission",
+            "message": str(invalid)
+        }, request, status=400)
+
+    mark_written(userSession.publicUrl)
+    response = get_json_response({
         "url": "https://distrochooser.de/{0}/{1}/".format(lang_code, userSession.publicUrl),
         "selections": selections,
         "token": token
-    })
+    }, request)
+    if isReplay or isShared:
+        response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def calculate_submission(token: str, lang_code: str, data: dict, submissionHash: str, calculation) -> tuple:
+    """
+    Calculate a result, unless it's a retry of the last submission of the session
+
+    Args:
+      token (str): The session token
+      lang_code (str): The ISO-639-1 encoded language to use
+      data (dict): The submitted answers
+      submissionHash (str): The hash of the submission, see get_submission_hash()
+      calculation (callable): The calculation method
+
+    Returns:
+      tuple: The session, the selections and whether they were stored already
+    """
+    database = get_database(token)
+    with transaction.atomic(using=database):
+        # serializes concurrent submissions of the same session across workers
+        userSession = UserSession.objects.using(database).select_for_update().get(token=token)
+        if userSession.submissionHash == submissionHash:
+            return userSession, default.getStoredSelections(userSession, lang_code), True
+
+        start_time = datetime.datetime.now()
+        selections = calculation(userSession, data, lang_code)
+        end_time = datetime.datetime.now()
+        calculationTime = end_time - start_time
+        userSession.calculationTime = int(calculationTime.microseconds / 1000)
+        userSession.calculationEndTime = end_time
+        userSession.submissionHash = submissionHash
+        userSession.save(update_fields=["calculationTime", "calculationEndTime", "submissionHash"])
+    return userSession, selections, False
 
 
 @csrf_exempt
@@ -262,24 +287,19 @@ def vote(request: HttpRequest) -> HttpResponse:
     Returns:
       HttpResponse: A HTTP JSON response containing the count of tuples changed
     """
-    data = loads(request.body)
-    id = int(data["selection"])
-    got = -1
-    if data["positive"] is not None:
-        isPositive = data["positive"] == True
-        got = ResultDistroSelection.objects.filter(pk=id).update(
-            isApprovedByUser=isPositive,
-            isDisApprovedByUser=not isPositive
-        )
-    else:
-        got = ResultDistroSelection.objects.filter(pk=id).update(
-            isApprovedByUser=False,
-            isDisApprovedByUser=False
-        )
+    data = parse_body(request)
+    try:
+        id = int(data["selection"])
+    except (TypeError, ValueError):
+        return get_json_response({
+            "error": "invalidSelection"
+        }, request, status=400)
+    positive = data["positive"] == True if data["positive"] is not None else None
+    got = votes.add_vote(id, positive)
 
-    return JsonResponse({
+    return get_json_response({
         "count": got
-    })
+    }, request)
 
 
 @csrf_exempt
@@ -294,17 +314,20 @@ def update_remark(request: HttpRequest) -> JsonResponse:
     Returns:
       HTTP response with the count of the session results changed
     """
-    data = loads(request.body)
+    data = parse_body(request)
     id = data["result"]
     remark = data["remarks"]
     sessionToken = data["sessionToken"]
-    got = UserSession.objects.filter(
+    got = UserSession.objects.using(get_database(id)).filter(
         token=id, sessionToken=sessionToken).update(remarks=remark)
-    return get_json_response(got)
+    return get_json_response(got, request)
 
 
+@use_replica()
 def get_feedback(request: HttpRequest) -> HttpResponse:
-    sessions = UserSession.objects.exclude(remarks__isnull=True)
+    sessions = []
+    for shard in fan_out(lambda alias: UserSession.objects.using(alias).exclude(remarks__isnull=True)):
+        sessions.extend(shard)
     system_suffix = CONFIG["backend"]["SUFFIX"]
     return render(request, "feedback.html", context={
         "sessions": sessions,
@@ -313,12 +336,14 @@ def get_feedback(request: HttpRequest) -> HttpResponse:
 
 
 def process_feedback(request: HttpRequest, token: str) -> HttpResponse:
-    session = UserSession.objects.get(token=token)
-    UserSession.objects.filter(token=token).update(
+    sessions = UserSession.objects.using(get_database(token))
+    session = get_object_or_404(sessions, token=token)
+    sessions.filter(token=token).update(
         remarksProcessed=not session.remarksProcessed)
     return redirect("get_feedback")
 
 
+@use_replica(token_argument="token")
 def get_given_answers(request: HttpRequest, token: str) -> JsonResponse:
     """
     Receive the answers of a given session token
@@ -330,17 +355,127 @@ def get_given_answers(request: HttpRequest, token: str) -> JsonResponse:
     Returns:
       JsonResponse: A dictionary (answers, important, categories) of the result
     """
-    answers = GivenAnswer.objects.filter(session__publicUrl=token)
+    answers = GivenAnswer.objects.using(get_database(token)).filter(session__publicUrl=token)
     answerList = []
     importanceList = []
     for answer in answers:
         answerList.append(answer.answer.msgid)
         if answer.isImportant:
             importanceList.append(answer.answer.msgid)
-    return JsonResponse(
+    return get_json_response(
         {
             "answers": answerList,
             "important": importanceList,
             "categories": list(answers.values_list("answer__question__category__msgid", flat=True))
-        }
+        }, request
     )
+
+
+@staff_member_required
+def export_sessions(request: HttpRequest, format: str) -> StreamingHttpResponse:
+    """
+    Stream the sessions including their answers and votes, for analytical purposes.
+
+    The query parameters after_id and since (ISO 8601) allow incremental exports.
+
+    Args:
+      request (HttpRequest): The client request, needs a staff user
+      format (str): jsonl or csv
+
+    Returns:
+      StreamingHttpResponse: The export, one session per line
+    """
+    writers = {
+        "jsonl": export.write_jsonl,
+        "csv": export.write_csv
+    }
+    if format not in writers:
+        raise Http404("Format not supported")
+    after_id = request.GET.get("after_id")
+    since = request.GET.get("since")
+    try:
+        after_id = int(after_id) if after_id else None
+        if after_id is not None:
+            # raises for ids of unknown shards
+            decode_id(after_id)
+        # parse_datetime returns None for values not looking like a datetime
+        since = parse_datetime(since) if since else None
+        is_valid = since is not None or not request.GET.get("since")
+    except ValueError:
+        is_valid = False
+    if not is_valid:
+        return JsonResponse({
+            "error": "after_id must be an integer and since an ISO 8601 datetime"
+        }, status=400)
+    records = export.iter_records(after_id, since)
+    response = StreamingHttpResponse(
+        writers[format](records), content_type=export.FORMATS[format])
+    response["Content-Disposition"] = "attachment; filename=sessions.{0}".format(format)
+    return response
+
+
+@staff_member_required
+def reload_translations(request: HttpRequest) -> JsonResponse:
+    """
+    Reload the changed translations of this worker right away.
+
+    The other workers pick up the changes with their next check.
+
+    Args:
+      request (HttpRequest): The client request, needs a staff user
+
+    Returns:
+      JsonResponse: The reloaded locales and the new translation version
+    """
+    reloaded = TRANSLATIONS.reload()
+    return JsonResponse({
+        "reloaded": reloaded,
+        "version": TRANSLATIONS.version
+    })
+
+
+def get_readiness(request: HttpRequest) -> JsonResponse:
+    """
+    Report if this worker is warmed up and can reach its database, for load balancer health checks
+
+    Args:
+      request (HttpRequest): The client request
+
+    Returns:
+      JsonResponse: The readiness, HTTP 503 if the worker is not ready
+    """
+    isReady = warmup.is_ready()
+    return JsonResponse({
+        "ready": isReady,
+        "warmupDuration": warmup.STATE["duration"]
+    }, status=200 if isReady else 503)
+
+
+@staff_member_required
+def get_metrics(request: HttpRequest) -> JsonResponse:
+    """
+    Get the runtime metrics of the worker serving the request
+
+    Args:
+      request (HttpRequest): The client request, needs a staff user
+
+    Returns:
+      JsonResponse: The metrics, keyed by subsystem
+    """
+    return JsonResponse(metrics.collect())
+
+
+def get_media_variant(request: HttpRequest, name: str) -> HttpResponse:
+    """
+    Serve a media variant (see media.py). The names are content hashed, so they can be cached forever.
+
+    Args:
+      request (HttpRequest): The client request
+      name (str): The file name within the variants directory
+
+    Returns:
+      HttpResponse: The file
+    """
+    response = serve(request, name, document_root=os.path.join(MEDIA_ROOT, "variants"))
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
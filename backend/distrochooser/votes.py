@@ -0,0 +1,219 @@
+"""
+Buffered vote ingestion.
+
+Votes are collected per worker and written in batches. While flushing, the
+per-distribution counters (DistributionVoteCount) are adjusted by the difference
+between the stored and the new vote state, so statistics never need to scan
+ResultDistroSelection.
+
+The buffer is flushed when it holds VOTE_BUFFER_SIZE votes, by a timer after
+VOTE_FLUSH_INTERVAL seconds (or by the next vote, if the timer is late) and on
+exit. A worker killed without running its exit handlers (SIGKILL, OOM) loses the
+votes of at most the last VOTE_FLUSH_INTERVAL seconds, a VOTE_BUFFER_SIZE of 1
+writes every vote right away. If writing fails (e. g. a lock timeout), the votes
+are put back into the buffer and retried by the next flush.
+
+Votes of unknown selections are accepted into the buffer and ignored while
+flushing, so voting never waits for the database.
+
+Pruned sessions (see retention.py) take their selections with them, their
+votes are kept in the pruned counters, so rebuild_counts() doesn't lose them.
+"""
+
+import atexit
+import logging
+from collections import defaultdict
+from threading import Lock, Timer
+from time import monotonic
+
+from django.db import transaction, connection
+from django.db.models import F, Sum, Case, When, IntegerField
+
+from backend.settings import VOTE_BUFFER_SIZE, VOTE_FLUSH_INTERVAL
+from distrochooser.models import ResultDistroSelection, DistributionVoteCount
+from distrochooser.sharding import decode_id, fan_out
+
+logger = logging.getLogger(__name__)
+
+_pending = {}
+_lock = Lock()
+_timer = None
+# monotonic time of the oldest buffered vote
+_oldest = None
+
+
+def add_vote(selection_id: int, positive) -> int:
+    """
+    Queue a vote for a selection. The last vote per selection wins.
+
+    Args:
+      selection_id (int): The id of the ResultDistroSelection, as returned by sharding.encode_id()
+      positive (bool|None): True for an upvote, False for a downvote, None to revoke the vote
+
+    Returns:
+      int: The amount of selections changed if the buffer was flushed, otherwise 1, 0 if the id can't belong to any shard
+    """
+    global _oldest
+    try:
+        decode_id(selection_id)
+    except ValueError:
+        return 0
+    with _lock:
+        if not _pending:
+            _oldest = monotonic()
+        _pending[selection_id] = positive
+        is_full = len(_pending) >= VOTE_BUFFER_SIZE or monotonic() - _oldest >= VOTE_FLUSH_INTERVAL
+        if not is_full:
+            _start_timer()
+    if is_full:
+        return flush()
+    return 1
+
+
+def _start_timer():
+    """
+    Flush after VOTE_FLUSH_INTERVAL unless a flush is scheduled already. Needs the lock.
+    """
+    global _timer
+    if _timer is None:
+        _timer = Timer(VOTE_FLUSH_INTERVAL, _flush_in_background)
+        _timer.daemon = True
+        _timer.start()
+
+
+def flush() -> int:
+    """
+    Write all buffered votes of this worker and adjust the vote counters.
+
+    Returns:
+      int: The amount of selections changed, 0 if writing failed and the votes were put back
+    """
+    global _timer, _pending, _oldest
+    with _lock:
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+        pending = _pending
+        _pending = {}
+        _oldest = None
+    if not pending:
+        return 0
+
+    shards = defaultdict(dict)
+    for selection_id, positive in pending.items():
+        alias, pk = decode_id(selection_id)
+        shards[alias][pk] = positive
+
+    count = 0
+    deltas = defaultdict(lambda: [0, 0])
+    try:
+        # the counters are kept on the default database
+        with transaction.atomic():
+            for alias, votes in shards.items():
+                count = count + _apply_votes(alias, votes, deltas)
+
+            for distro_id, (upvotes, downvotes) in deltas.items():
+                if upvotes == 0 and downvotes == 0:
+                    continue
+                DistributionVoteCount.objects.get_or_create(distro_id=distro_id)
+                DistributionVoteCount.objects.filter(distro_id=distro_id).update(
+                    upvotes=F("upvotes") + upvotes,
+                    downvotes=F("downvotes") + downvotes
+                )
+    except Exception:
+        logger.warning("Could not write %s votes, retrying with the next flush", len(pending), exc_info=True)
+        with _lock:
+            # votes given in the meantime are newer
+            for selection_id, positive in pending.items():
+                _pending.setdefault(selection_id, positive)
+            # the age restarts, so a failing database isn't hit by every vote
+            _oldest = monotonic()
+            _start_timer()
+        return 0
+    return count
+
+
+def _apply_votes(alias: str, votes: dict, deltas: dict) -> int:
+    """
+    Write the votes of one shard, adding the counter changes to deltas. Votes of unknown selections are ignored.
+    """
+    changed = {True: [], False: [], None: []}
+    with transaction.atomic(using=alias):
+        current = ResultDistroSelection.objects.using(alias).select_for_update().filter(
+            pk__in=votes.keys()).values_list("pk", "distro_id", "isApprovedByUser", "isDisApprovedByUser")
+        for pk, distro_id, is_approved, is_disapproved in current:
+            positive = votes[pk]
+            will_approve = positive is True
+            will_disapprove = positive is False
+            if (will_approve, will_disapprove) == (is_approved, is_disapproved):
+                continue
+            changed[positive].append(pk)
+            deltas[distro_id][0] += int(will_approve) - int(is_approved)
+            deltas[distro_id][1] += int(will_disapprove) - int(is_disapproved)
+
+        for positive, ids in changed.items():
+            if ids:
+                ResultDistroSelection.objects.using(alias).filter(pk__in=ids).update(
+                    isApprovedByUser=positive is True,
+                    isDisApprovedByUser=positive is False
+                )
+    return sum(len(ids) for ids in changed.values())
+
+
+def _flush_in_background():
+    try:
+        flush()
+    finally:
+        # the timer thread got its own connection, which would be leaked otherwise
+        connection.close()
+
+
+def rebuild_counts() -> int:
+    """
+    Recalculate all vote counters out of the stored selections and the pruned counters.
+
+    Returns:
+      int: The amount of distributions having counters
+    """
+    flush()
+    pruned = {count.distro_id: (count.prunedUpvotes, count.prunedDownvotes)
+              for count in DistributionVoteCount.objects.exclude(prunedUpvotes=0, prunedDownvotes=0)}
+    totals = defaultdict(lambda: [0, 0])
+    for distro_id, (upvotes, downvotes) in pruned.items():
+        totals[distro_id] = [upvotes, downvotes]
+    for shard in fan_out(lambda alias: ResultDistroSelection.objects.using(alias).values("distro_id").annotate(
+        upvotes=Sum(Case(When(isApprovedByUser=True, then=1),
+                         default=0, output_field=IntegerField())),
+        downvotes=Sum(Case(When(isDisApprovedByUser=True, then=1),
+                           default=0, output_field=IntegerField()))
+    )):
+        for total in shard:
+            totals[total["distro_id"]][0] += total["upvotes"]
+            totals[total["distro_id"]][1] += total["downvotes"]
+    with transaction.atomic():
+        DistributionVoteCount.objects.all().delete()
+        DistributionVoteCount.objects.bulk_create([
+            DistributionVoteCount(
+                distro_id=distro_id,
+                upvotes=upvotes,
+                downvotes=downvotes,
+                prunedUpvotes=pruned.get(distro_id, (0, 0))[0],
+                prunedDownvotes=pruned.get(distro_id, (0, 0))[1]
+            ) for distro_id, (upvotes, downvotes) in totals.items()
+        ])
+    return DistributionVoteCount.objects.count()
+
+
+def get_vote_counts() -> dict:
+    """
+    Get the vote counters of all distributions
+
+    Returns:
+      dict: The dictionaries of DistributionVoteCount.as_dict, keyed by the distribution id
+    """
+    return {count.distro_id: count.as_dict() for count in DistributionVoteCount.objects.all()}
+
+
+EMPTY_VOTES = DistributionVoteCount().as_dict()
+
+atexit.register(flush)
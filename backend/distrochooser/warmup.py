@@ -0,0 +1,75 @@
+"""
+Warmup of a worker before it accepts traffic.
+
+gunicorn calls warmup() in post_worker_init (see gunicorn.conf.py), so the
+first requests of a worker don't pay for connecting to the database, importing
+the URLconf or filling the caches. The /ready<suffix>/ endpoint reports the
+result to the load balancer.
+"""
+
+import logging
+from time import monotonic
+
+from django.db import connections
+from django.urls import get_resolver
+
+from distrochooser.constants import TRANSLATIONS
+from distrochooser.calculations import default
+from distrochooser.models import Question
+from distrochooser.util import get_step_fragments, get_categories_fragment, get_translations_fragment
+from distrochooser.votes import get_vote_counts
+
+logger = logging.getLogger(__name__)
+
+STATE = {
+    "ready": False,
+    "duration": None
+}
+
+
+def warmup() -> bool:
+    """
+    Open the database connections, load the URLconf and prime the caches of this worker
+
+    Returns:
+      bool: True if the worker is ready to serve requests
+    """
+    started = monotonic()
+    try:
+        for connection in connections.all():
+            connection.ensure_connection()
+        get_resolver().url_patterns
+        for locale in TRANSLATIONS:
+            TRANSLATIONS[locale]
+            default.getReasonTable(locale)
+            get_translations_fragment(locale)
+        # categories without a question have no step (get_step_fragments raises a 404)
+        for index in Question.objects.order_by("category__index").values_list("category__index", flat=True).distinct():
+            get_step_fragments(index)
+        get_categories_fragment()
+        get_vote_counts()
+    except Exception:
+        logger.exception("Warmup failed")
+        STATE["ready"] = False
+        return False
+    STATE["duration"] = int((monotonic() - started) * 1000)
+    STATE["ready"] = True
+    return True
+
+
+def is_ready() -> bool:
+    """
+    Check if the worker is warm and its database is reachable, warming it up if needed
+
+    Returns:
+      bool: True if the worker can serve requests
+    """
+    if not STATE["ready"]:
+        # e. g. under runserver or if the database was unreachable during the start
+        return warmup()
+    try:
+        for connection in connections.all():
+            connection.ensure_connection()
+    except Exception:
+        return False
+    return True
@@ -0,0 +1,28 @@
+"""
+gunicorn configuration of the backend.
+
+The application is loaded in the master, which builds the translations and
+reason tables once before forking (see distrochooser/preload.py), so all
+workers share them instead of each holding a copy. Each worker is warmed up
+before it accepts requests (see distrochooser/warmup.py).
+"""
+
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
+# more than one thread switches to the threaded (gthread) worker, so a worker keeps
+# serving other clients while one of its threads waits for the database
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+timeout = 600
+preload_app = True
+
+
+def when_ready(server):
+    from distrochooser.preload import preload
+    preload()
+
+
+def post_worker_init(worker):
+    from distrochooser.warmup import warmup
+    warmup()